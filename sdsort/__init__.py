@@ -1,4 +1,51 @@
-from .cli import main
-from .sort import step_down_sort
+from typing import TYPE_CHECKING
 
-__all__ = ["main", "step_down_sort"]
+if TYPE_CHECKING:
+    from .aio import asort_file, asort_many
+    from .cli import main
+    from .context import Context
+    from .incremental import IncrementalSource
+    from .sort import check_step_down_order, sort_source, sort_syntax_tree, step_down_sort
+    from .workers import sort_many
+
+__all__ = [
+    "main",
+    "check_step_down_order",
+    "step_down_sort",
+    "sort_source",
+    "sort_syntax_tree",
+    "sort_many",
+    "asort_file",
+    "asort_many",
+    "IncrementalSource",
+    "Context",
+]
+
+
+def __getattr__(name: str):
+    # The CLI and the sorting machinery are only imported once they're used, which keeps `import sdsort` cheap
+    if name == "main":
+        from .cli import main
+
+        return main
+    if name in ("check_step_down_order", "step_down_sort", "sort_source", "sort_syntax_tree"):
+        from . import sort
+
+        return getattr(sort, name)
+    if name == "sort_many":
+        from .workers import sort_many
+
+        return sort_many
+    if name in ("asort_file", "asort_many"):
+        from . import aio
+
+        return getattr(aio, name)
+    if name == "IncrementalSource":
+        from .incremental import IncrementalSource
+
+        return IncrementalSource
+    if name == "Context":
+        from .context import Context
+
+        return Context
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,71 @@
+"""Sorting from asyncio code, without blocking the event loop.
+
+Files are read and written on the loop's default executor, and sorted on the given executor, which can be a
+thread pool or (to sort files in parallel) a process pool.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+from concurrent.futures import Executor
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from .sort import ResultType, step_down_sort
+from .utils.file import read_file_bytes
+from .workers import count_cpus
+
+
+async def asort_file(
+    python_file_path: str | Path, *, executor: Optional[Executor] = None, write: bool = False
+) -> ResultType:
+    """Sort the file's functions and methods, like `step_down_sort`. With `write`, a re-arranged file is written.
+    The sorting runs on `executor`, or on the loop's default executor if it's None.
+    """
+    loop = asyncio.get_running_loop()
+    raw_source = await loop.run_in_executor(None, read_file_bytes, python_file_path)
+    result = await loop.run_in_executor(executor, partial(step_down_sort, python_file_path, raw_source=raw_source))
+    _, modified_source = result
+    if write and modified_source is not None:
+        await loop.run_in_executor(None, _write_file, python_file_path, modified_source)
+    return result
+
+
+async def asort_many(
+    python_file_paths: Iterable[str | Path],
+    *,
+    concurrency: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    write: bool = False,
+) -> AsyncIterator[tuple[str | Path, ResultType]]:
+    """Sort the files like `asort_file`, yielding each path with its result in the order they're done.
+    At most `concurrency` files (by default, one per CPU) are in progress at a time, and the paths are only taken
+    from the iterable as there's room for them. Closing the iterator early cancels the files in progress.
+    """
+    concurrency = count_cpus() if concurrency is None else concurrency
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    remaining_paths = iter(python_file_paths)
+    pending: dict[asyncio.Task[ResultType], str | Path] = {}
+    try:
+        while True:
+            for python_file_path in remaining_paths:
+                task = asyncio.create_task(asort_file(python_file_path, executor=executor, write=write))
+                pending[task] = python_file_path
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield pending.pop(task), task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _write_file(file_path: str | Path, source: str):
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(source)
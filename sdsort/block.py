@@ -1,3 +1,4 @@
+import copy
 import sys
 from abc import ABC, abstractmethod
 from ast import (
@@ -18,8 +19,9 @@ from ast import (
     stmt,
     walk,
 )
-from collections.abc import Collection
-from typing import Generator, Union
+from collections import deque
+from collections.abc import Collection, Iterable, Sequence
+from typing import Generator, Literal, NamedTuple, Union
 
 if sys.version_info >= (3, 12):
     # PEP 695 `type X = ...` aliases (ast.TypeAlias) only exist on Python 3.12+.
@@ -32,39 +34,79 @@ else:
 from .context import Context
 from .utils.ast import (
     Function,
+    LineIndex,
     determine_line_range,
+    extend_last_line,
     find_first_line,
+    first_line_number,
     get_method_nodes,
 )
 
 
-def block_for(node: stmt, source_lines: list[str], context: Context):
+def block_for(node: stmt, lines: LineIndex, context: Context):
     if isinstance(node, (FunctionDef, AsyncFunctionDef)):
-        return FunctionBlock(node, source_lines, context)
+        return FunctionBlock(node, lines, context)
     elif isinstance(node, ClassDef):
-        return ClassBlock(node, source_lines, context)
+        return ClassBlock(node, lines, context)
     elif isinstance(node, (Import, ImportFrom)):
-        return ImportBlock(node, source_lines, context)
-    return StatementBlock(node, source_lines, context)
+        return ImportBlock(node, lines, context)
+    return StatementBlock(node, lines, context)
+
+
+class Statement(NamedTuple):
+    """What a block keeps of each of its statements (or overloads): enough to lay out the blank lines around it"""
+
+    kind: Literal["function", "class", "other"]
+    name: str
+    """The name of the function or class, if it is one"""
+    first_lineno: int
+    """The line number where it starts, including decorators"""
 
 
 class Block(ABC):
-    def __init__(self, node: AST, context: Context):
-        self._nodes = [node]
+    """A range of lines that's moved as a whole, and what the sort needs to know about the code in it.
+    Blocks take what they need from the AST while they're built, and keep no reference to it.
+    """
+
+    __slots__ = ("_statements", "_context", "start", "end", "line_offset")
+
+    def __init__(self, node: stmt, context: Context):
+        self._statements = [_summarize(node)]
         self._context = context
         self.start = -1
         self.end = -1
+        self.line_offset = 0
+
+    def shift(self, lines: int) -> None:
+        """Move the block's line range, e.g. after it has been re-arranged.
+        `line_offset` tracks the distance between the block's position and the line numbers of its statements.
+        """
+        self.start += lines
+        self.end += lines
+        self.line_offset += lines
+
+    def copy(self) -> "Block":
+        """A copy that can be shifted and extended without moving this block.
+        What the block knows about its code isn't copied, since sorting doesn't change it.
+        """
+        return copy.copy(self)
+
+    @abstractmethod
+    def append(self, node: stmt, lines: LineIndex) -> bool:
+        raise NotImplementedError
 
     @abstractmethod
-    def append(self, node: AST) -> bool:
+    def find_function_calls(self) -> Iterable[str]:
+        """The names of the functions called directly, like `function()`"""
         raise NotImplementedError
 
     @abstractmethod
-    def find_calls(self) -> Generator[Call, None, None]:
+    def find_method_calls(self) -> Iterable[str]:
+        """The names of the methods called on self, like `self.method()`"""
         raise NotImplementedError
 
     @abstractmethod
-    def find_predecessors(self) -> Generator[str, None, None]:
+    def find_predecessors(self) -> Iterable[str]:
         raise NotImplementedError
 
     @property
@@ -76,27 +118,42 @@ class Block(ABC):
     def names(self) -> Collection[str]:
         raise NotImplementedError
 
+    @property
+    def statements(self) -> Sequence[Statement]:
+        return self._statements
+
+
+def _summarize(node: stmt) -> Statement:
+    if isinstance(node, (FunctionDef, AsyncFunctionDef)):
+        return Statement("function", node.name, first_line_number(node))
+    if isinstance(node, ClassDef):
+        return Statement("class", node.name, first_line_number(node))
+    return Statement("other", "", first_line_number(node))
+
 
 class ImportBlock(Block):
-    _nodes: list[Union[Import, ImportFrom]]
+    __slots__ = ()
 
-    def __init__(self, node: Union[Import, ImportFrom], source_lines: list[str], context: Context):
+    def __init__(self, node: Union[Import, ImportFrom], lines: LineIndex, context: Context):
         super().__init__(node, context)
-        self.start = find_first_line(node, source_lines)
+        self.start = find_first_line(node, lines)
         self.end = node.end_lineno or node.lineno
 
-    def append(self, node: AST) -> bool:
+    def append(self, node: stmt, lines: LineIndex) -> bool:
         if isinstance(node, (Import, ImportFrom)):
-            self._nodes.append(node)
+            self._statements.append(_summarize(node))
             self.end = max(self.end, node.end_lineno or node.lineno)
             return True
         return False
 
-    def find_predecessors(self) -> Generator[str, None, None]:
-        yield from []
+    def find_predecessors(self) -> Iterable[str]:
+        return []
+
+    def find_function_calls(self) -> Iterable[str]:
+        return []
 
-    def find_calls(self) -> Generator[Call, None, None]:
-        yield from []
+    def find_method_calls(self) -> Iterable[str]:
+        return []
 
     @property
     def names(self) -> Collection[str]:
@@ -104,56 +161,61 @@ class ImportBlock(Block):
 
 
 class StatementBlock(Block):
-    _nodes: list[stmt]
-    _names: set[str]
+    __slots__ = ("_names", "_references")
 
-    def __init__(self, node: stmt, source_lines: list[str], context: Context):
+    def __init__(self, node: stmt, lines: LineIndex, context: Context):
         super().__init__(node, context)
-        self.start = find_first_line(node, source_lines)
+        self.start = find_first_line(node, lines)
         self.end = node.end_lineno or node.lineno
-        self._names = set(self._extract_names(node))
+        self._names: set[str] = set()
+        self._references: list[str] = []
+        self._index(node)
 
-    def append(self, node: AST) -> bool:
-        if isinstance(node, stmt) and not isinstance(
-            node, (ClassDef, FunctionDef, AsyncFunctionDef, Import, ImportFrom)
-        ):
-            self._nodes.append(node)
+    def append(self, node: stmt, lines: LineIndex) -> bool:
+        if not isinstance(node, (ClassDef, FunctionDef, AsyncFunctionDef, Import, ImportFrom)):
+            self._statements.append(_summarize(node))
             self.end = max(self.end, node.end_lineno or node.lineno)
-            self._names.update(self._extract_names(node))
+            self._index(node)
             return True
         return False
 
-    def _extract_names(self, node: AST):
-        for child in walk(node):
-            if isinstance(child, Assign):
-                for target in child.targets:
-                    if isinstance(target, Name):
-                        yield target.id
-            if isinstance(child, AnnAssign):
-                if isinstance(child.target, Name):
-                    yield child.target.id
-
-    def find_predecessors(self) -> Generator[str, None, None]:
-        for node in self._nodes:
-            yield from self._find_predecessor_names(node)
-
-    def _find_predecessor_names(self, node: AST) -> Generator[str, None, None]:
-        # A PEP 695 `type X = <value>` alias evaluates <value> lazily, so names it
-        # references are not definition-order dependencies.
-        if isinstance(node, _TYPE_ALIAS_TYPES):
-            return
-        if isinstance(node, AnnAssign) and self._context.deferred_annotations:
-            yield from self._find_predecessor_names(node.target)
-            if node.value is not None:
-                yield from self._find_predecessor_names(node.value)
-            return
-        if isinstance(node, Name) and node.id not in self._names:
-            yield node.id
-        for child in iter_child_nodes(node):
-            yield from self._find_predecessor_names(child)
+    def _index(self, root: AST):
+        """Collect the names the statement assigns, and the names it refers to, in one depth-first pass.
+        Assignments are statements, so they can't hide in the parts that aren't searched for references.
+        The pass keeps its own stack, since generated code can nest expressions deeper than the recursion limit.
+        """
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Assign):
+                self._names.update(target.id for target in node.targets if isinstance(target, Name))
+            if isinstance(node, AnnAssign) and isinstance(node.target, Name):
+                self._names.add(node.target.id)
+
+            # A PEP 695 `type X = <value>` alias evaluates <value> lazily, so names it
+            # references are not definition-order dependencies.
+            if isinstance(node, _TYPE_ALIAS_TYPES):
+                continue
+            if isinstance(node, AnnAssign) and self._context.deferred_annotations:
+                children = [node.target] if node.value is None else [node.target, node.value]
+            else:
+                if isinstance(node, Name):
+                    self._references.append(node.id)
+                children = list(iter_child_nodes(node))
+
+            # Push the children in reverse, so they're visited in order
+            children.reverse()
+            stack.extend(children)
 
-    def find_calls(self) -> Generator[Call, None, None]:
-        yield from []
+    def find_predecessors(self) -> Iterable[str]:
+        # Names the block assigns itself are left out, wherever they're assigned within the block
+        return [name for name in self._references if name not in self._names]
+
+    def find_function_calls(self) -> Iterable[str]:
+        return []
+
+    def find_method_calls(self) -> Iterable[str]:
+        return []
 
     @property
     def names(self) -> Collection[str]:
@@ -161,49 +223,64 @@ class StatementBlock(Block):
 
 
 class ClassBlock(Block):
-    _nodes: list[ClassDef]
+    __slots__ = ("_methods", "_references")
 
-    def __init__(self, node: ClassDef, source_lines: list[str], context: Context):
+    def __init__(self, node: ClassDef, lines: LineIndex, context: Context):
         super().__init__(node, context)
-        self.start, self.end = determine_line_range(node, source_lines)
-        method_nodes = get_method_nodes(node)
-        self._methods: list[FunctionBlock] = []
-        current_block: Union[Block, None] = None
-        for method_node in method_nodes:
-            if current_block is None or not current_block.append(method_node):
-                current_block = FunctionBlock(method_node, source_lines, self._context)
-                self._methods.append(current_block)
-        resolve_overlapping_ranges(self._methods)
+        self.start, self.end = determine_line_range(node, lines)
+        self._methods = build_method_blocks(get_method_nodes(node), lines, context)
+        self._references = list(self._find_references(node))
 
-    def append(self, node: AST) -> bool:
+    def append(self, node: stmt, lines: LineIndex) -> bool:
         return False
 
-    def find_calls(self) -> Generator[Call, None, None]:
+    def shift(self, lines: int) -> None:
+        super().shift(lines)
         for method in self._methods:
-            yield from method.find_calls()
+            method.shift(lines)
 
-    def find_predecessors(self) -> Generator[str, None, None]:
-        for base in self._nodes[0].bases:
-            for node in walk(base):
-                if isinstance(node, Name):
-                    yield node.id
-                if isinstance(node, Attribute):
-                    yield node.attr
+    def copy(self) -> "ClassBlock":
+        clone = copy.copy(self)
+        clone._methods = [method.copy() for method in self._methods]
+        return clone
+
+    def replace_methods(self, start: int, stop: int, method_blocks: Sequence["FunctionBlock"]) -> None:
+        """Replace the method blocks from start up to stop, e.g. with those of the same methods after an edit"""
+        self._methods[start:stop] = method_blocks
+        resolve_overlapping_ranges(self._methods)
+
+    def find_function_calls(self) -> Iterable[str]:
+        for method in self._methods:
+            yield from method.find_function_calls()
+
+    def find_method_calls(self) -> Iterable[str]:
+        for method in self._methods:
+            yield from method.find_method_calls()
+
+    def find_predecessors(self) -> Iterable[str]:
+        yield from self._references
+        for method in self._methods:
+            yield from method.find_predecessors()
+
+    def _find_references(self, node: ClassDef) -> Generator[str, None, None]:
+        for base in node.bases:
+            for child in walk(base):
+                if isinstance(child, Name):
+                    yield child.id
+                if isinstance(child, Attribute):
+                    yield child.attr
 
         # A class-attribute assignment target (e.g. `config` in `config: dict = ...`) is
         # class-local, not a reference to a top-level definition, so it must not be treated
         # as a predecessor. Names being *read* (annotations, right-hand sides) still count,
         # even when they happen to share the target's name (e.g. `x = staticmethod(x)`).
-        for statement in self._nodes[0].body:
+        for statement in node.body:
             if isinstance(statement, (FunctionDef, AsyncFunctionDef)):
                 continue
             for subtree in self._reference_subtrees(statement):
-                for node in walk(subtree):
-                    if isinstance(node, Name) and not isinstance(node.ctx, Store):
-                        yield node.id
-
-        for method in self._methods:
-            yield from method.find_predecessors()
+                for child in walk(subtree):
+                    if isinstance(child, Name) and not isinstance(child.ctx, Store):
+                        yield child.id
 
     def _reference_subtrees(self, statement: stmt) -> Generator[AST, None, None]:
         # Don't consider type annotations as predecessors when their evaluation is deferred
@@ -215,13 +292,27 @@ class ClassBlock(Block):
 
     @property
     def names(self):
-        return [n.name for n in self._nodes]
+        return [statement.name for statement in self._statements]
 
     @property
-    def method_blocks(self) -> Collection[Block]:
+    def method_blocks(self) -> Sequence["FunctionBlock"]:
         return self._methods
 
 
+def build_method_blocks(
+    method_nodes: Iterable[Function], lines: LineIndex, context: Context
+) -> list["FunctionBlock"]:
+    """Build the blocks of a class's methods, with the overloads of each method in one block"""
+    method_blocks: list[FunctionBlock] = []
+    current_block: Union[Block, None] = None
+    for method_node in method_nodes:
+        if current_block is None or not current_block.append(method_node, lines):
+            current_block = FunctionBlock(method_node, lines, context)
+            method_blocks.append(current_block)
+    resolve_overlapping_ranges(method_blocks)
+    return method_blocks
+
+
 def resolve_overlapping_ranges(blocks: Collection[Block]) -> None:
     running_end = 0
     for block in blocks:
@@ -230,70 +321,119 @@ def resolve_overlapping_ranges(blocks: Collection[Block]) -> None:
 
 
 class FunctionBlock(Block):
-    _nodes: list[Function]
-
-    def __init__(self, node: Function, source_lines: list[str], context: Context):
+    __slots__ = (
+        "_col_offset",
+        "_function_calls",
+        "_method_calls",
+        "_decorator_names",
+        "_annotation_names",
+        "_is_pytest_fixture",
+    )
+
+    def __init__(self, node: Function, lines: LineIndex, context: Context):
         super().__init__(node, context)
-        self.start, self.end = determine_line_range(node, source_lines)
-        self._source_lines = source_lines
-
-    def append(self, node: AST) -> bool:
-        if isinstance(node, (FunctionDef, AsyncFunctionDef)) and node.name == self._nodes[0].name:
-            self._nodes.append(node)
-            start, end = determine_line_range(node, self._source_lines)
+        self.start, self.end = determine_line_range(node, lines)
+        self._function_calls: list[str] = []
+        self._method_calls: list[str] = []
+        self._decorator_names: list[str] = []
+        self._annotation_names: list[str] = []
+        self._is_pytest_fixture = _is_pytest_fixture(node)
+        self._index(node)
+
+    def append(self, node: stmt, lines: LineIndex) -> bool:
+        if isinstance(node, (FunctionDef, AsyncFunctionDef)) and node.name == self._statements[0].name:
+            self._statements.append(_summarize(node))
+            start, end = determine_line_range(node, lines)
             self.start = min(self.start, start)
             self.end = max(self.end, end)
+            self._index(node)
             return True
         return False
 
-    def find_calls(self) -> Generator[Call, None, None]:
-        for root in self._nodes:
-            subtrees = [*root.body, root.args, *([] if root.returns is None else [root.returns])]
-            for subtree in subtrees:
-                for node in walk(subtree):
-                    if isinstance(node, Call):
-                        yield node
-
-    def find_predecessors(self) -> Generator[str, None, None]:
-        for function in self._nodes:
-            for decorator in function.decorator_list:
-                for node in walk(decorator):
-                    if isinstance(node, Name):
-                        yield node.id
+    def extend(self, source_lines: Sequence[str]) -> None:
+        """Re-evaluate where the block ends, after the lines following it have changed."""
+        self.end = extend_last_line(self.end, self._col_offset, source_lines)
+
+    def _index(self, function: Function):
+        """Collect the function's calls and the names in its decorators and annotations.
+        The body, arguments and return annotation are walked once, for both the calls and the annotations.
+        """
+        self._col_offset = function.col_offset
+        for decorator in function.decorator_list:
+            for node in walk(decorator):
+                if isinstance(node, Name):
+                    self._decorator_names.append(node.id)
+
+        # The names in each annotation are tagged with its position, to list them annotation by annotation
+        annotations = {} if self._context.deferred_annotations else self._find_annotations(function)
+        annotation_names: list[tuple[int, str]] = []
+        subtrees = [*function.body, function.args, *([] if function.returns is None else [function.returns])]
+        for subtree in subtrees:
+            # Like ast.walk, breadth first
+            queue: deque[tuple[AST, int]] = deque([(subtree, -1)])
+            while queue:
+                node, annotation = queue.popleft()
+                if annotation == -1:
+                    annotation = annotations.get(node, -1)
+                if isinstance(node, Call):
+                    self._index_call(node)
+                elif isinstance(node, Name) and annotation != -1:
+                    annotation_names.append((annotation, node.id))
+                queue.extend((child, annotation) for child in iter_child_nodes(node))
+        annotation_names.sort(key=lambda tagged_name: tagged_name[0])
+        self._annotation_names.extend(name for _, name in annotation_names)
+
+    @staticmethod
+    def _find_annotations(function: Function) -> dict[AST, int]:
+        """Map the function's annotations to their positions, leaving out lazy string annotations like "MyClass"."""
+        all_args = [*function.args.posonlyargs, *function.args.args, *function.args.kwonlyargs]
+        if function.args.vararg:
+            all_args.append(function.args.vararg)
+        if function.args.kwarg:
+            all_args.append(function.args.kwarg)
+        annotation_nodes = [a.annotation for a in all_args if a.annotation is not None]
+        if function.returns is not None:
+            annotation_nodes.append(function.returns)
+        return {
+            annotation: position
+            for position, annotation in enumerate(annotation_nodes)
+            if not (isinstance(annotation, Constant) and isinstance(annotation.value, str))
+        }
+
+    def _index_call(self, call: Call):
+        if isinstance(call.func, Name):
+            self._function_calls.append(call.func.id)
+        elif (
+            isinstance(call.func, Attribute) and isinstance(call.func.value, Name) and call.func.value.id == "self"
+        ):
+            self._method_calls.append(call.func.attr)
+
+    def find_function_calls(self) -> Iterable[str]:
+        return self._function_calls
+
+    def find_method_calls(self) -> Iterable[str]:
+        return self._method_calls
+
+    def find_predecessors(self) -> Iterable[str]:
+        yield from self._decorator_names
 
         # XXX: it is not safe to omit annotations if the function has a decorator (e.g. @inject)
-        if not self._context.deferred_annotations:
-            yield from self._get_type_annotations()
-
-    def _get_type_annotations(self):
-        for root in self._nodes:
-            all_args = [*root.args.posonlyargs, *root.args.args, *root.args.kwonlyargs]
-            if root.args.vararg:
-                all_args.append(root.args.vararg)
-            if root.args.kwarg:
-                all_args.append(root.args.kwarg)
-            annotation_nodes = [a.annotation for a in all_args if a.annotation is not None]
-            if root.returns is not None:
-                annotation_nodes.append(root.returns)
-            for annotation in annotation_nodes:
-                if isinstance(annotation, Constant) and isinstance(annotation.value, str):
-                    continue  # skip lazy string annotations like "MyClass"
-                for node in walk(annotation):
-                    if isinstance(node, Name):
-                        yield node.id
+        yield from self._annotation_names
 
     @property
     def is_pytest_fixture(self) -> bool:
-        node = self._nodes[0]
-        assert isinstance(node, (FunctionDef, AsyncFunctionDef))
-        for decorator in node.decorator_list:
-            target = decorator.func if isinstance(decorator, Call) else decorator
-            if isinstance(target, Name) and target.id == "fixture":
-                return True
-            if isinstance(target, Attribute) and target.attr == "fixture":
-                return True
-        return False
+        return self._is_pytest_fixture
 
     @property
     def names(self):
-        return [n.name for n in self._nodes]
+        return [statement.name for statement in self._statements]
+
+
+def _is_pytest_fixture(node: Function) -> bool:
+    for decorator in node.decorator_list:
+        target = decorator.func if isinstance(decorator, Call) else decorator
+        if isinstance(target, Name) and target.id == "fixture":
+            return True
+        if isinstance(target, Attribute) and target.attr == "fixture":
+            return True
+    return False
@@ -0,0 +1,195 @@
+"""Persistent cache of files that are known to be sorted or skipped, so they don't have to be analyzed again."""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, cast
+
+from .context import find_pyproject
+
+if TYPE_CHECKING:
+    from .sort import Status
+
+MAX_ENTRIES = 100_000
+
+# Only these outcomes are cached. Files that would be re-arranged have to be processed again anyway.
+_CACHEABLE_STATUSES = ("unchanged", "skipped")
+
+# A file modified within this window might be modified again without its mtime changing
+_RACY_MTIME_WINDOW_NS = 2_000_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY, status TEXT NOT NULL, last_used INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def user_cache_dir() -> Path:
+    if override := os.environ.get("SDSORT_CACHE_DIR"):
+        return Path(override)
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "sdsort"
+
+
+def daemon_socket_path() -> Path:
+    if override := os.environ.get("SDSORT_DAEMON_SOCKET"):
+        return Path(override)
+    return user_cache_dir() / "daemon.sock"
+
+
+class ResultCache:
+    """Maps file contents to the outcome of sorting them, for the running version of sdsort.
+
+    Files are looked up in two tiers: by (path, size, mtime, inode), which doesn't require reading the file,
+    and by a hash of the contents. Writes are buffered until the cache is closed, and then committed in a single
+    transaction, so several processes can share the cache. Least recently used entries are evicted once there are
+    more than `max_entries` of them.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, max_entries: int = MAX_ENTRIES):
+        self._connection = connection
+        self._max_entries = max_entries
+        self._fingerprint = sdsort_fingerprint()
+        self._now = time.time_ns()
+        self._results: dict[str, str] = {}
+        self._stats: dict[str, tuple[int, int, int, str]] = {}
+        self._used_keys: set[str] = set()
+        self._used_paths: set[str] = set()
+
+    @classmethod
+    def open(cls, directory: Optional[Path] = None, max_entries: int = MAX_ENTRIES) -> Optional["ResultCache"]:
+        """Open the cache, or return None if it can't be used (e.g. because the directory is read-only)."""
+        directory = directory or user_cache_dir()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(directory / "results.db", timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+        except (OSError, sqlite3.Error):
+            return None
+        return cls(connection, max_entries)
+
+    def get(self, file_path: str, file_stat: os.stat_result) -> Optional["Status"]:
+        """Look up the status of a file by its stat, without reading it."""
+        path = os.path.abspath(file_path)
+        row = self._query("SELECT size, mtime_ns, inode, digest FROM stats WHERE path = ?", path)
+        if row is None or tuple(row[:3]) != _stat_signature(file_stat):
+            return None
+        status = self.get_by_digest(file_path, cast(str, row[3]))
+        if status is not None:
+            self._used_paths.add(path)
+        return status
+
+    def get_by_digest(self, file_path: str, digest: str) -> Optional["Status"]:
+        """Look up the status of a file by the digest of its contents."""
+        key = self._key(digest, os.path.abspath(file_path))
+        row = self._query("SELECT status FROM results WHERE key = ?", key)
+        if row is None:
+            return None
+        self._used_keys.add(key)
+        return cast("Status", row[0])
+
+    def put(self, file_path: str, file_stat: os.stat_result, digest: str, status: "Status") -> None:
+        if status not in _CACHEABLE_STATUSES:
+            return
+        path = os.path.abspath(file_path)
+        self._results[self._key(digest, path)] = status
+        if self._now - file_stat.st_mtime_ns > _RACY_MTIME_WINDOW_NS:
+            self._stats[path] = (*_stat_signature(file_stat), digest)
+
+    def close(self) -> None:
+        """Write buffered entries and evict the least recently used ones."""
+        try:
+            if self._results or self._stats or self._used_keys or self._used_paths:
+                self._connection.execute("BEGIN IMMEDIATE")
+                self._write()
+                self._connection.execute("COMMIT")
+        except sqlite3.Error:
+            pass  # The cache is an optimization. Failing to update it must not fail the run.
+        finally:
+            self._connection.close()
+
+    def _write(self) -> None:
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO results (key, status, last_used) VALUES (?, ?, ?)",
+            [(key, status, self._now) for key, status in self._results.items()],
+        )
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO stats (path, size, mtime_ns, inode, digest, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, *signature, self._now) for path, signature in self._stats.items()],
+        )
+        self._connection.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?", [(self._now, key) for key in self._used_keys]
+        )
+        self._connection.executemany(
+            "UPDATE stats SET last_used = ? WHERE path = ?", [(self._now, path) for path in self._used_paths]
+        )
+        for table, column, added in [("results", "key", self._results), ("stats", "path", self._stats)]:
+            if added:
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE {column} IN "
+                    f"(SELECT {column} FROM {table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self._max_entries,),
+                )
+
+    def _query(self, sql: str, parameter: str) -> Optional[tuple[object, ...]]:
+        try:
+            return self._connection.execute(sql, (parameter,)).fetchone()
+        except sqlite3.Error:
+            return None
+
+    def _key(self, digest: str, path: str) -> str:
+        return f"{digest}:{self._fingerprint}:{_context_key(os.path.dirname(path))}"
+
+
+def _stat_signature(file_stat: os.stat_result) -> tuple[int, int, int]:
+    return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
+def content_digest(raw_source: bytes) -> str:
+    return hashlib.blake2b(raw_source, digest_size=20).hexdigest()
+
+
+@lru_cache
+def _context_key(directory: str) -> str:
+    """Identify the project configuration that applies to files in the directory.
+    The rest of the context is determined by the file's contents, which are already part of the key.
+    The pyproject.toml is identified by its stat, which is cheaper than parsing it.
+    """
+    pyproject = find_pyproject(Path(directory).resolve())
+    if pyproject is None:
+        return ""
+    pyproject_stat = pyproject.stat()
+    return f"{pyproject}:{pyproject_stat.st_size}:{pyproject_stat.st_mtime_ns}"
+
+
+@lru_cache(maxsize=1)
+def sdsort_fingerprint() -> str:
+    """Identify the running version of sdsort by its source files.
+    Installing another version (or editing a development install) changes their sizes or mtimes.
+    """
+    digest = hashlib.blake2b(digest_size=10)
+    for source_file in sorted(Path(__file__).parent.rglob("*.py")):
+        source_stat = source_file.stat()
+        digest.update(f"{source_file.name}:{source_stat.st_size}:{source_stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
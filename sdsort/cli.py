@@ -1,72 +1,297 @@
 import os
+import re
+import sys
+from contextlib import closing
 from dataclasses import dataclass, field
-from glob import glob
-from typing import Iterable
+from typing import TYPE_CHECKING, Generator, Optional
 
 import click
 
-from .sort import step_down_sort
+from .cache import ResultCache, daemon_socket_path
+from .discovery import DEFAULT_EXCLUDES, filter_python_files, find_python_files
 from .utils.pluralize import pluralize
+from .utils.profile import active_profile, phase, start_profiling
 from .utils.timer import Timer
 
+if TYPE_CHECKING:
+    from .client import DaemonClient
+    from .sort import Status
+    from .workers import FileResult
+
 # TODO: switch to pathlib
+# Modules that aren't needed by every run are imported where they're used, to keep startup fast
 
 
 @click.command()
 @click.argument(
     "paths",
     nargs=-1,
-    type=click.Path(exists=True, file_okay=True, dir_okay=True, readable=True),
+    type=click.Path(exists=True, file_okay=True, dir_okay=True, readable=True, allow_dash=True),
     is_eager=True,
 )
 @click.option("--check", is_flag=True, help="Don't write changes, just report if files would be re-arranged.")
-def main(paths: tuple[str, ...], check: bool):
-    file_paths = _expand_file_paths(paths)
+@click.option(
+    "--fail-fast",
+    is_flag=True,
+    help="With --check, stop at the first file that would be re-arranged, without checking the rest.",
+)
+@click.option("--no-cache", is_flag=True, help="Don't use the cache of files that are known to be sorted.")
+@click.option("--no-daemon", is_flag=True, help="Don't forward files to a running sdsort daemon.")
+@click.option(
+    "--jobs",
+    "-j",
+    default="auto",
+    callback=lambda _, __, value: _parse_jobs(value),
+    help="Number of files to process in parallel. Defaults to 'auto', which is based on the number of CPUs.",
+)
+@click.option(
+    "--exclude",
+    default=DEFAULT_EXCLUDES,
+    show_default=True,
+    callback=lambda _, __, value: _compile_pattern(value),
+    help="Regular expression for paths to skip when searching directories. Replaces the default excludes.",
+)
+@click.option(
+    "--extend-exclude",
+    callback=lambda _, __, value: _compile_pattern(value),
+    help="Regular expression for paths to skip in addition to the default excludes.",
+)
+@click.option(
+    "--diff-base",
+    metavar="REF",
+    help="Only process files that differ from this git revision, or are untracked. "
+    "Paths, if given, narrow down the files further.",
+)
+@click.option(
+    "--stdin-filename",
+    help="The path of the file that is read from stdin (as '-'). It's used to find the project's configuration.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Show how much time was spent in each phase of processing the files. Files aren't forwarded to a daemon.",
+)
+def main(
+    paths: tuple[str, ...],
+    check: bool,
+    fail_fast: bool,
+    no_cache: bool,
+    no_daemon: bool,
+    jobs: Optional[int],
+    exclude: Optional[re.Pattern[str]],
+    extend_exclude: Optional[re.Pattern[str]],
+    diff_base: Optional[str],
+    stdin_filename: Optional[str],
+    profile: bool,
+):
+    if fail_fast and not check:
+        raise click.UsageError("--fail-fast can only be used with --check")
+    if profile:
+        start_profiling()
+        no_daemon = True
+
+    if "-" in paths:
+        if len(paths) > 1 or diff_base is not None:
+            raise click.UsageError("'-' can't be combined with other paths or --diff-base")
+        _sort_stdin(stdin_filename, check, None if no_daemon else _connect_to_daemon())
+        return
+
+    excludes = [pattern for pattern in (exclude, extend_exclude) if pattern is not None]
+    with phase("find_files"):
+        dir_entries = _find_files(paths, excludes, diff_base)
+    cache = None if no_cache else ResultCache.open()
+    use_daemon = not no_daemon and _is_daemon_running()
 
     with Timer() as t:
-        results = _sort_files(sorted(file_paths), check)
+        try:
+            results = _sort_files(sorted(dir_entries), check, cache, jobs, dir_entries, use_daemon, fail_fast)
+        finally:
+            if cache is not None:
+                cache.close()
 
     _print_results(results, check, t.elapsed)
+    _print_profile()
 
     if check and len(results.modified_files) > 0:
         raise SystemExit(1)
 
 
-def _expand_file_paths(paths: tuple[str, ...]) -> Iterable[str]:
-    file_paths = []
-    for path in paths:
-        if os.path.isdir(path):
-            file_paths.extend(glob(os.path.join(path, "**/*.py"), recursive=True))
-        else:
-            file_paths.append(path)
-    return file_paths
+def _parse_jobs(value: str) -> Optional[int]:
+    if value == "auto":
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise click.BadParameter("must be a positive integer or 'auto'")
+    return int(value)
 
 
-def _sort_files(file_paths: list[str], check: bool):
+def _find_files(
+    paths: tuple[str, ...], excludes: list[re.Pattern[str]], diff_base: Optional[str]
+) -> dict[str, Optional[os.DirEntry[str]]]:
+    if diff_base is None:
+        return dict(find_python_files(paths, excludes))
+
+    from .utils.git import GitError, find_changed_files, find_repository_root
+
+    try:
+        changed_files = find_changed_files(diff_base)
+        return dict(filter_python_files(changed_files, paths or [find_repository_root()], excludes))
+    except GitError as e:
+        raise click.ClickException(f"--diff-base: {e}")
+
+
+def _is_daemon_running() -> bool:
+    client = _connect_to_daemon()
+    if client is None:
+        return False
+    client.close()
+    return True
+
+
+def _connect_to_daemon() -> Optional["DaemonClient"]:
+    if not daemon_socket_path().exists():
+        return None
+    from .client import DaemonClient
+
+    return DaemonClient.connect()
+
+
+def _sort_stdin(stdin_filename: Optional[str], check: bool, daemon: Optional["DaemonClient"]):
+    """Sort the source read from stdin, and write it to stdout. With --check, only report whether it's sorted.
+    Without a filename, the configuration is looked up from the current directory.
+    """
+    file_path = stdin_filename or "<stdin>"
+    raw_source = sys.stdin.buffer.read()
+    from .client import DaemonError
+    from .sort import check_step_down_order, step_down_sort
+
+    with Timer() as t:
+        try:
+            if check:
+                if daemon is not None:
+                    status = daemon.check(file_path, raw_source)
+                else:
+                    status = check_step_down_order(file_path, raw_source=raw_source)
+            else:
+                if daemon is not None:
+                    status, modified_source = daemon.sort(file_path, raw_source)
+                else:
+                    status, modified_source = step_down_sort(file_path, raw_source=raw_source)
+                sys.stdout.buffer.write(raw_source if modified_source is None else modified_source.encode("utf-8"))
+                sys.stdout.buffer.flush()
+                _print_profile(err=True)  # stdout is taken by the source
+                return
+        except DaemonError as e:
+            raise click.ClickException(f"Failed to forward stdin to the daemon ({e}). Try again with --no-daemon.")
+
     results = Results()
+    results.add(file_path, status)
+    _print_results(results, check, t.elapsed)
+    _print_profile()
+    if status == "sorted":
+        raise SystemExit(1)
+
+
+def _compile_pattern(value: Optional[str]) -> Optional[re.Pattern[str]]:
+    if not value:
+        return None
+    try:
+        return re.compile(value)
+    except re.error as e:
+        raise click.BadParameter(f"not a valid regular expression: {e}")
 
-    for file_path in file_paths:
-        modification = step_down_sort(file_path)
-        match modification:
-            case ("sorted", modified_source):
-                if not check:
-                    with open(file_path, "w", encoding="utf-8") as file:
-                        file.write(modified_source)
-                results.modified_files.append(file_path)
-            case ("skipped", _):
-                results.skipped_files.append(file_path)
-            case ("unchanged", _):
-                results.pristine_files.append(file_path)
 
+def _sort_files(
+    file_paths: list[str],
+    check: bool,
+    cache: Optional[ResultCache] = None,
+    jobs: Optional[int] = 1,
+    dir_entries: Optional[dict[str, Optional[os.DirEntry[str]]]] = None,
+    use_daemon: bool = False,
+    fail_fast: bool = False,
+) -> "Results":
+    """Sort (or check) the files, and gather their statuses in the order of the paths.
+    With `fail_fast`, files are processed until one is found that is (or would be) re-arranged, and the results
+    only cover the files that were processed by then.
+    """
+    statuses: dict[str, "Status"] = {}
+    file_stats: dict[str, os.stat_result] = {}
+    if cache is not None:
+        # Files that haven't changed since they were last found to be sorted don't even need to be read
+        with phase("cache"):
+            for file_path in file_paths:
+                dir_entry = dir_entries.get(file_path) if dir_entries is not None else None
+                file_stats[file_path] = dir_entry.stat() if dir_entry is not None else os.stat(file_path)
+                status = cache.get(file_path, file_stats[file_path])
+                if status is not None:
+                    statuses[file_path] = status
+
+    pending_paths = [file_path for file_path in file_paths if file_path not in statuses]
+    # Closing the results as soon as they're no longer needed cancels the files that are still pending
+    with closing(
+        _process_files(pending_paths, check, cache, jobs, use_daemon, in_order=not fail_fast)
+    ) as file_results:
+        for file_path, (status, digest) in file_results:
+            statuses[file_path] = status
+            if cache is not None and digest is not None:
+                cache.put(file_path, file_stats[file_path], digest, status)
+            if fail_fast and status == "sorted":
+                break
+
+    return _collect_results(file_paths, statuses)
+
+
+def _collect_results(file_paths: list[str], statuses: dict[str, "Status"]) -> "Results":
+    results = Results()
+    for file_path in file_paths:
+        if file_path in statuses:
+            results.add(file_path, statuses[file_path])
     return results
 
 
+def _process_files(
+    file_paths: list[str],
+    check: bool,
+    cache: Optional[ResultCache],
+    jobs: Optional[int],
+    use_daemon: bool,
+    in_order: bool = True,
+) -> Generator[tuple[str, "FileResult"], None, None]:
+    """Yield each path with its result, in the order of the paths or, if not `in_order`, as soon as it's known"""
+    if not file_paths:
+        return
+    if not use_daemon:
+        from .workers import process_files, process_files_as_completed
+
+        if in_order:
+            yield from zip(file_paths, process_files(file_paths, check, cache, jobs))
+        else:
+            yield from process_files_as_completed(file_paths, check, cache, jobs)
+        return
+
+    from .client import DaemonError, forward_files
+
+    try:
+        # The daemon's answers come back in order, but closing them early still cancels the pending requests
+        yield from zip(file_paths, forward_files(file_paths, check, jobs or os.cpu_count() or 1))
+    except DaemonError as e:
+        raise click.ClickException(f"Failed to forward files to the daemon ({e}). Try again with --no-daemon.")
+
+
 @dataclass
 class Results:
     modified_files: list[str] = field(default_factory=list)
     skipped_files: list[str] = field(default_factory=list)
     pristine_files: list[str] = field(default_factory=list)
 
+    def add(self, file_path: str, status: "Status"):
+        match status:
+            case "sorted":
+                self.modified_files.append(file_path)
+            case "skipped":
+                self.skipped_files.append(file_path)
+            case "unchanged":
+                self.pristine_files.append(file_path)
+
     def __len__(self):
         return len(self.modified_files) + len(self.pristine_files) + len(self.skipped_files)
 
@@ -94,3 +319,13 @@ def _print_results(results: Results, check: bool, duration: float):
         click.secho("No python files found to format", fg="yellow")
     else:
         click.secho(f"Done! Checked {pluralize(len(results), 'file')} in {duration:.2f}s", dim=True)
+
+
+def _print_profile(err: bool = False):
+    profile = active_profile()
+    if profile is None:
+        return
+    click.echo(err=err)
+    click.secho("Time per phase (summed over worker processes):", bold=True, err=err)
+    for row in profile.format_table():
+        click.echo(row, err=err)
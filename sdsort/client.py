@@ -0,0 +1,113 @@
+"""The client side of the sdsort daemon, kept apart from the server so the CLI only imports what it needs."""
+
+import base64
+import json
+import os
+import socket
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, cast
+
+from .cache import content_digest, daemon_socket_path, sdsort_fingerprint
+from .utils.file import read_file_bytes
+
+if TYPE_CHECKING:
+    from .sort import ResultType, Status
+    from .workers import FileResult
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonClient:
+    """A connection to a running daemon. Connections aren't thread-safe, but a daemon accepts many of them."""
+
+    def __init__(self, connection: socket.socket):
+        self._connection = connection
+        self._reader = connection.makefile("rb")
+
+    @classmethod
+    def connect(cls, socket_path: Optional[Path] = None) -> Optional["DaemonClient"]:
+        """Connect to the daemon, or return None if none is running for this version of sdsort."""
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        socket_path = socket_path or daemon_socket_path()
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(str(socket_path))
+            client = cls(connection)
+            client.request("ping")
+        except (OSError, DaemonError):
+            connection.close()
+            return None
+        return client
+
+    def sort(self, file_path: str, raw_source: bytes) -> "ResultType":
+        response = self.request("sort", file_path=_resolve(file_path), source=_encode(raw_source))
+        return cast("ResultType", (response["status"], response["source"]))
+
+    def check(self, file_path: str, raw_source: bytes) -> "Status":
+        return self.request("check", file_path=_resolve(file_path), source=_encode(raw_source))["status"]
+
+    def request(self, command: str, **arguments: Any) -> dict[str, Any]:
+        message = {"command": command, "fingerprint": sdsort_fingerprint(), **arguments}
+        try:
+            self._connection.sendall(json.dumps(message).encode() + b"\n")
+            line = self._reader.readline()
+        except OSError as e:
+            raise DaemonError(f"lost connection to the daemon: {e}") from e
+        if not line:
+            raise DaemonError("the daemon closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response
+
+    def close(self):
+        self._reader.close()
+        self._connection.close()
+
+
+def forward_files(file_paths: list[str], check: bool, connections: int) -> Iterator["FileResult"]:
+    """Have the daemon sort (or check) the files, yielding their results in the same order as the paths.
+    The files are read and written here, so the daemon doesn't need access to them.
+    """
+    local = threading.local()
+    clients: list[DaemonClient] = []
+
+    def forward(file_path: str) -> "FileResult":
+        if not hasattr(local, "client"):
+            local.client = DaemonClient.connect()
+            if local.client is None:
+                raise DaemonError("the daemon stopped")
+            clients.append(local.client)
+        raw_source = read_file_bytes(file_path)
+        if check:
+            return local.client.check(file_path, raw_source), content_digest(raw_source)
+        status, modified_source = local.client.sort(file_path, raw_source)
+        if modified_source is not None:
+            with open(file_path, "w", encoding="utf-8") as file:
+                file.write(modified_source)
+        return status, content_digest(raw_source)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        with ThreadPoolExecutor(max(1, min(connections, len(file_paths)))) as executor:
+            yield from executor.map(forward, file_paths)
+    finally:
+        for client in clients:
+            client.close()
+
+
+def _resolve(file_path: str) -> str:
+    """Make the path absolute, since the daemon would resolve a relative one against its own working directory,
+    and find the configuration of some other project
+    """
+    return os.path.abspath(file_path)
+
+
+def _encode(raw_source: bytes) -> str:
+    return base64.b64encode(raw_source).decode("ascii")
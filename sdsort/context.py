@@ -1,13 +1,12 @@
-import tomllib
 from ast import ImportFrom, Module
-from dataclasses import dataclass
 from functools import lru_cache
 from itertools import takewhile
 from pathlib import Path
+from typing import NamedTuple
 
 
-@dataclass
-class Context:
+# Not a dataclass, since importing dataclasses would take longer than importing the rest of sdsort.sort
+class Context(NamedTuple):
     deferred_annotations: bool
 
 
@@ -19,16 +18,28 @@ def gather_context(root_node: Module, file_path: Path | None = None) -> Context:
     )
 
     if not deferred_annotations and file_path is not None:
-        deferred_annotations = _targets_python314_or_newer(file_path.parent)
+        deferred_annotations = gather_project_context(file_path.parent).deferred_annotations
 
     return Context(deferred_annotations=deferred_annotations)
 
 
+def gather_project_context(directory: Path) -> Context:
+    """Gather the context that applies to all files in a directory, regardless of their contents."""
+    return Context(deferred_annotations=_targets_python314_or_newer(directory))
+
+
+def forget_project_contexts():
+    """Drop the cached project contexts, e.g. after a pyproject.toml has changed."""
+    _targets_python314_or_newer.cache_clear()
+
+
 @lru_cache
 def _targets_python314_or_newer(directory: Path) -> bool:
-    pyproject = _find_pyproject(directory)
+    pyproject = find_pyproject(directory)
     if pyproject is None:
         return False
+    import tomllib  # only needed when the file itself doesn't import annotations from __future__
+
     with pyproject.open("rb") as f:
         data = tomllib.load(f)
     specifier: str = data.get("project", {}).get("requires-python", "")
@@ -55,7 +66,7 @@ def _leading_int(text: str) -> int:
     return int(digits) if digits else 0
 
 
-def _find_pyproject(directory: Path) -> Path | None:
+def find_pyproject(directory: Path) -> Path | None:
     for parent in [directory, *directory.parents]:
         candidate = parent / "pyproject.toml"
         if candidate.is_file():
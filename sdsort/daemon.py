@@ -0,0 +1,215 @@
+"""A long-running process that sorts source sent to it over a Unix socket. The client side lives in client.py.
+
+Keeping the process around saves the interpreter startup and imports on every run of sdsort, and keeps the
+project context and results warm. The protocol is one JSON object per line, in both directions.
+"""
+
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional, cast
+
+import click
+
+from .cache import content_digest, daemon_socket_path, sdsort_fingerprint
+from .client import DaemonClient
+from .context import find_pyproject, forget_project_contexts
+from .sort import ResultType, check_step_down_order, step_down_sort
+from .workers import count_cpus
+
+MAX_RESULTS = 10_000
+
+# Only this many of the most recent latencies are kept per command, to compute percentiles
+_LATENCY_SAMPLES = 1_000
+
+# Bumped in the workers when a pyproject.toml changes, so they drop the project context they have cached
+_worker_context_generation = 0
+
+
+class LatencyStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: dict[str, int] = {}
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, command: str, seconds: float):
+        with self._lock:
+            self._counts[command] = self._counts.get(command, 0) + 1
+            self._samples.setdefault(command, deque(maxlen=_LATENCY_SAMPLES)).append(seconds)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Count the requests per command, with the latency percentiles of the most recent ones, in milliseconds."""
+        with self._lock:
+            summary: dict[str, dict[str, float]] = {}
+            for command, samples in self._samples.items():
+                ordered = sorted(samples)
+                summary[command] = {
+                    "count": self._counts[command],
+                    "mean_ms": 1000 * sum(ordered) / len(ordered),
+                    "p50_ms": 1000 * _percentile(ordered, 0.5),
+                    "p95_ms": 1000 * _percentile(ordered, 0.95),
+                    "max_ms": 1000 * ordered[-1],
+                }
+            return summary
+
+
+class SortServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves each connection in a thread, and does the sorting in a pool of worker processes.
+
+    Results of unchanged and skipped source are kept in memory, keyed by the digest of the source and its directory.
+    The project context is looked up in the workers, and cached there until a pyproject.toml changes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, jobs: Optional[int] = None):
+        super().__init__(str(socket_path), _RequestHandler)
+        self.socket_path = socket_path
+        self.stats = LatencyStats()
+        self.started = time.time()
+        self._fingerprint = sdsort_fingerprint()
+        self._lock = threading.Lock()
+        self._results: OrderedDict[tuple[str, str, str, int], ResultType] = OrderedDict()
+        self._pyprojects: dict[str, Optional[tuple[str, int]]] = {}
+        self._context_generation = 0
+        workers = jobs or count_cpus()
+        self._executor: Optional[Executor] = None
+        if workers > 1:
+            self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def respond(self, request: dict[str, Any]) -> dict[str, Any]:
+        if request.get("fingerprint") != self._fingerprint:
+            return {"error": "the daemon is running a different version of sdsort"}
+        match request.get("command"):
+            case "ping":
+                return {}
+            case "sort" | "check":
+                return self._sort(request["command"], request["file_path"], base64.b64decode(request["source"]))
+            case "stats":
+                return {"uptime": time.time() - self.started, "commands": self.stats.summary()}
+            case "stop":
+                threading.Thread(target=self.shutdown).start()
+                return {}
+            case command:
+                return {"error": f"unknown command: {command}"}
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        self.socket_path.unlink(missing_ok=True)
+
+    def _sort(self, command: str, file_path: str, raw_source: bytes) -> dict[str, Any]:
+        directory = os.path.dirname(os.path.abspath(file_path))
+        generation = self._check_pyproject(directory)
+        key = (command, content_digest(raw_source), directory, generation)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+        if result is None:
+            if self._executor is None:
+                result = _sort_in_worker(command, file_path, raw_source, generation)
+            else:
+                result = self._executor.submit(
+                    _sort_in_worker, command, file_path, raw_source, generation
+                ).result()
+            if result[0] != "sorted":
+                with self._lock:
+                    self._results[key] = result
+                    if len(self._results) > MAX_RESULTS:
+                        self._results.popitem(last=False)
+        return {"status": result[0], "source": result[1]}
+
+    def _check_pyproject(self, directory: str) -> int:
+        """Find out if the pyproject.toml that applies to the directory has changed, since the context depends on it."""
+        pyproject = find_pyproject(Path(directory))
+        signature = (str(pyproject), pyproject.stat().st_mtime_ns) if pyproject is not None else None
+        with self._lock:
+            if directory in self._pyprojects and self._pyprojects[directory] != signature:
+                self._context_generation += 1
+                self._results.clear()
+            self._pyprojects[directory] = signature
+            return self._context_generation
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = cast(SortServer, self.server)
+        for line in self.rfile:
+            start = time.perf_counter()
+            try:
+                request = json.loads(line)
+                response = server.respond(request)
+            except Exception as e:
+                request, response = {}, {"error": f"{type(e).__name__}: {e}"}
+            server.stats.record(str(request.get("command")), time.perf_counter() - start)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def _sort_in_worker(command: str, file_path: str, raw_source: bytes, context_generation: int) -> ResultType:
+    global _worker_context_generation
+    if context_generation != _worker_context_generation:
+        forget_project_contexts()
+        _worker_context_generation = context_generation
+    if command == "check":
+        return cast(ResultType, (check_step_down_order(file_path, raw_source=raw_source), None))
+    return step_down_sort(file_path, raw_source=raw_source)
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+@click.command()
+@click.option("--stop", is_flag=True, help="Stop the running daemon.")
+@click.option("--stats", is_flag=True, help="Show how many requests the running daemon has served, and how fast.")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), help="Number of worker processes. Defaults to the CPUs.")
+def main(stop: bool, stats: bool, jobs: Optional[int]):
+    """Run the sdsort daemon, which sdsort forwards files to when it's running."""
+    socket_path = daemon_socket_path()
+    client = DaemonClient.connect(socket_path)
+    if stop or stats:
+        if client is None:
+            raise click.ClickException("the daemon isn't running")
+        response = client.request("stats" if stats else "stop")
+        client.close()
+        if stats:
+            _print_stats(response)
+        return
+
+    if client is not None:
+        client.close()
+        raise click.ClickException(f"the daemon is already running on {socket_path}")
+    if not hasattr(socket, "AF_UNIX"):
+        raise click.ClickException("the daemon requires Unix domain sockets")
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.unlink(missing_ok=True)  # left behind by a daemon that didn't shut down cleanly
+    with SortServer(socket_path, jobs) as server:
+        click.echo(f"Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _print_stats(response: dict[str, Any]):
+    click.echo(f"Up for {response['uptime']:.0f}s")
+    for command, summary in response["commands"].items():
+        click.echo(
+            f"{command}: {summary['count']:.0f} requests, mean {summary['mean_ms']:.1f}ms, "
+            f"p50 {summary['p50_ms']:.1f}ms, p95 {summary['p95_ms']:.1f}ms, max {summary['max_ms']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
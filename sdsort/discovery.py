@@ -0,0 +1,111 @@
+"""Discovery of the Python files to sort."""
+
+import os
+import re
+from collections.abc import Iterable, Iterator
+from typing import Optional
+
+from .utils.gitignore import GitIgnore
+
+DEFAULT_EXCLUDES = (
+    r"/(\.direnv|\.eggs|\.git|\.hg|\.ipynb_checkpoints|\.mypy_cache|\.nox|\.pytest_cache|\.ruff_cache|\.svn|\.tox"
+    r"|\.venv|__pypackages__|_build|buck-out|build|dist|node_modules|venv)/"
+)
+
+FoundFile = tuple[str, Optional[os.DirEntry[str]]]
+"""The path of a file to sort, and its directory entry if it was found by walking a directory"""
+
+
+def find_python_files(paths: Iterable[str], excludes: list[re.Pattern[str]]) -> Iterator[FoundFile]:
+    """Find the files to sort. Files that are given explicitly are always included.
+
+    Directories are walked recursively, skipping hidden entries and symlinks to directories. Entries are also
+    skipped if they're ignored by a .gitignore file, or one of the exclude patterns is found in their path. That path
+    is relative to the given directory, with a leading / (and a trailing / for directories), like /build/. Skipped
+    directories aren't descended into.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            directory = _to_posix(os.path.abspath(path))
+            yield from _walk(path, directory, directory, _find_enclosing_gitignores(directory), excludes)
+        else:
+            yield path, None
+
+
+def filter_python_files(
+    candidate_paths: Iterable[str], paths: Iterable[str], excludes: list[re.Pattern[str]]
+) -> Iterator[FoundFile]:
+    """Select the candidates that `find_python_files` would find among the given paths, without walking them.
+    Candidates within a directory are subject to the same rules, except that .gitignore files aren't consulted.
+    """
+    roots = [(_to_posix(os.path.abspath(path)), os.path.isdir(path)) for path in paths]
+    for candidate_path in candidate_paths:
+        if not candidate_path.endswith(".py") or not os.path.isfile(candidate_path):
+            continue
+        absolute_path = _to_posix(os.path.abspath(candidate_path))
+        for root, is_dir in roots:
+            if not is_dir:
+                if absolute_path == root:
+                    yield candidate_path, None
+                    break
+            elif absolute_path.startswith(root + "/"):
+                relative_path = absolute_path[len(root) :]
+                if "/." not in relative_path and not any(exclude.search(relative_path) for exclude in excludes):
+                    yield candidate_path, None
+                break
+
+
+def _walk(
+    path: str, directory: str, root: str, gitignores: list[GitIgnore], excludes: list[re.Pattern[str]]
+) -> Iterator[FoundFile]:
+    gitignore = GitIgnore.load(directory)
+    if gitignore is not None:
+        gitignores = [*gitignores, gitignore]
+
+    with os.scandir(path) as scanned_entries:
+        entries = list(scanned_entries)
+
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if not is_dir and not (entry.name.endswith(".py") and entry.is_file()):
+            continue
+        absolute_path = f"{directory}/{entry.name}"
+        relative_path = absolute_path[len(root) :] + ("/" if is_dir else "")
+        if any(exclude.search(relative_path) for exclude in excludes):
+            continue
+        if _is_ignored(absolute_path, is_dir, gitignores):
+            continue
+
+        if is_dir:
+            yield from _walk(entry.path, absolute_path, root, gitignores, excludes)
+        else:
+            yield entry.path, entry
+
+
+def _is_ignored(absolute_path: str, is_dir: bool, gitignores: list[GitIgnore]) -> bool:
+    # The innermost .gitignore that has a say in the matter decides
+    for gitignore in reversed(gitignores):
+        is_ignored = gitignore.match(absolute_path[len(gitignore.directory) + 1 :], is_dir)
+        if is_ignored is not None:
+            return is_ignored
+    return False
+
+
+def _find_enclosing_gitignores(directory: str) -> list[GitIgnore]:
+    """Load the .gitignore files in the directories above the given one, up to the root of the git repository."""
+    gitignores: list[GitIgnore] = []
+    parent, current = os.path.dirname(directory), directory
+    while parent != current and not os.path.exists(os.path.join(current, ".git")):
+        parent, current = os.path.dirname(parent), parent
+        gitignore = GitIgnore.load(current)
+        if gitignore is not None:
+            gitignores.insert(0, gitignore)
+    if not os.path.exists(os.path.join(current, ".git")):
+        return []  # not in a git repository
+    return gitignores
+
+
+def _to_posix(path: str) -> str:
+    return path.replace(os.sep, "/") if os.sep != "/" else path
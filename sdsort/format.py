@@ -1,75 +1,104 @@
-from ast import AsyncFunctionDef, ClassDef, FunctionDef, Module, parse, stmt
+from collections.abc import Iterator, Sequence
 
-from .utils.ast import find_first_line, get_class_nodes, get_method_nodes, is_blank
+from .block import Block, ClassBlock, Statement
+from .utils.ast import LineIndex, include_leading_comments, is_blank
 
 
-def normalize_blank_lines(lines: list[str]) -> str:
+def normalize_blank_lines(lines: list[str], blocks: Sequence[Block]) -> str:
     """Normalize blank lines per PEP 8:
     - 2 blank lines before top-level function/class definitions
     - 1 blank line between methods in a class (0 before the first)
     - Then there are a few exceptions, like allowing 0 lines between overload defs
+
+    The top-level blocks must be given in the order they appear in `lines`, and must have been shifted to
+    their positions within it.
     """
-    tree = parse("\n".join(lines) + "\n")
-    required_blanks = _find_where_blanks_should_be(tree, lines)
+    required_blanks = _find_where_blanks_should_be(blocks, LineIndex(lines))
     reformatted_lines = _adjust_blank_lines(lines, required_blanks)
     return "\n".join(reformatted_lines).strip() + "\n"
 
 
-def _find_where_blanks_should_be(ast: Module, lines: list[str]):
+def _find_where_blanks_should_be(blocks: Sequence[Block], lines: LineIndex):
     """Collect 0-based line indices where PEP 8 spacing rules apply.
     Maps line_index -> required number of preceding blank lines.
     """
-    required_top_level_blanks = _find_required_top_level_blanks(ast, lines)
-    required_class_method_blanks = _find_required_class_method_blanks(ast, lines)
+    required_top_level_blanks = _find_required_top_level_blanks(blocks, lines)
+    required_class_method_blanks = _find_required_class_method_blanks(blocks, lines)
     return required_top_level_blanks | required_class_method_blanks
 
 
-def _find_required_top_level_blanks(ast: Module, lines: list[str]):
+def _find_required_top_level_blanks(blocks: Sequence[Block], lines: LineIndex):
     required_blanks: dict[int, int] = {}
     seen_functions = set[str]()
-    previous_node: stmt | None = None
-    for node in ast.body:
-        if isinstance(node, (FunctionDef, AsyncFunctionDef, ClassDef)):
-            is_overload_repeat = isinstance(node, (FunctionDef, AsyncFunctionDef)) and node.name in seen_functions
-            if isinstance(node, (FunctionDef, AsyncFunctionDef)):
-                seen_functions.add(node.name)
-            if not is_overload_repeat:
-                required_blanks[find_first_line(node, lines)] = 2
-        elif isinstance(previous_node, (FunctionDef, AsyncFunctionDef, ClassDef)):
-            # PEP 8 requires 2 blank lines after a top-level def/class, i.e. before a following statement.
-            required_blanks[find_first_line(node, lines)] = 2
-        previous_node = node
+    previous_statement: Statement | None = None
+    for block in blocks:
+        for statement in block.statements:
+            if statement.kind != "other":
+                is_overload_repeat = statement.kind == "function" and statement.name in seen_functions
+                if statement.kind == "function":
+                    seen_functions.add(statement.name)
+                if not is_overload_repeat:
+                    required_blanks[include_leading_comments(statement.first_lineno, lines, block.line_offset)] = 2
+            elif previous_statement is not None and previous_statement.kind != "other":
+                # PEP 8 requires 2 blank lines after a top-level def/class, i.e. before a following statement.
+                required_blanks[include_leading_comments(statement.first_lineno, lines, block.line_offset)] = 2
+            previous_statement = statement
     return required_blanks
 
 
-def _find_required_class_method_blanks(ast, lines):
+def _find_required_class_method_blanks(blocks: Sequence[Block], lines: LineIndex):
     required_blanks: dict[int, int] = {}
-    for class_node in get_class_nodes(ast):
+    for class_block in blocks:
+        if not isinstance(class_block, ClassBlock):
+            continue
         seen_methods = set[str]()
-        for i, method in enumerate(get_method_nodes(class_node)):
+        # The method blocks have been shifted to their final positions, so their order is given by where they start
+        method_blocks = sorted(class_block.method_blocks, key=lambda b: b.start)
+        methods = [(method, block.line_offset) for block in method_blocks for method in block.statements]
+        for i, (method, line_offset) in enumerate(methods):
             if method.name in seen_methods:
                 continue
             seen_methods.add(method.name)
-            line_index = find_first_line(method, lines)
-            has_preceding_blank = is_blank(lines[line_index - 1])
+            line_index = include_leading_comments(method.first_lineno, lines, line_offset)
+            has_preceding_blank = lines.is_blank[line_index - 1]
             is_first_method = i == 0
             required_blanks[line_index] = 1 if has_preceding_blank or not is_first_method else 0
     return required_blanks
 
 
-def _adjust_blank_lines(lines: list[str], required_blanks: dict[int, int]):
-    result: list[str] = []
-    for i, line in enumerate(lines):
-        if i in required_blanks:
-            # Strip any blank lines already accumulated at the end of result
-            while result and is_blank(result[-1]):
-                result.pop()
+def _adjust_blank_lines(lines: list[str], required_blanks: dict[int, int]) -> list[str]:
+    """Put the required number of blank lines before each of the given lines, and shorten any other run of blank
+    lines to two. Only those runs of blank lines are rewritten; the lines in between are copied as they are.
+    """
+    # Map the start of each run of blank lines that changes to where the run ends, and what it's replaced by
+    replacements: dict[int, tuple[int, list[str]]] = {}
+    for line_index, count in required_blanks.items():
+        start = line_index
+        while start > 0 and is_blank(lines[start - 1]):
+            start -= 1
+        replacements[start] = (line_index, [""] * count)
+    for start, end in _find_long_blank_runs(lines):
+        if end not in required_blanks:
+            replacements[start] = (end, lines[start : start + 2])
 
-            # Inject the required blank lines
-            result.extend([""] * required_blanks[i])
+    result: list[str] = []
+    copied = 0
+    for start in sorted(replacements):
+        end, replacement = replacements[start]
+        result.extend(lines[copied:start])
+        result.extend(replacement)
+        copied = end
+    result.extend(lines[copied:])
+    return result
 
-        # Append current line, as long as that doesn't result in 3 blank lines in succession
-        if not is_blank(line) or len(result) < 2 or any(not is_blank(line) for line in result[-2:]):
-            result.append(line)
 
-    return result
+def _find_long_blank_runs(lines: list[str]) -> Iterator[tuple[int, int]]:
+    """Find the runs of more than two blank lines, as (start, end) ranges"""
+    run_start = 0
+    for index, line in enumerate(lines):
+        if not is_blank(line):
+            if index - run_start > 2:
+                yield run_start, index
+            run_start = index + 1
+    if len(lines) - run_start > 2:
+        yield run_start, len(lines)
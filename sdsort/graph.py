@@ -1,32 +1,161 @@
-from collections import defaultdict
+from collections.abc import Iterable, Iterator
 
 from .block import Block
 
 
 class AcyclicGraph:
-    def __init__(self) -> None:
-        self._edges: defaultdict[Block, list[Block]] = defaultdict(list)
-
-    def add_edge(self, *, _from: Block, to: Block) -> bool:
-        if to in self._edges[_from]:
-            return False
-        if _from == to or self._is_reachable(_from, start=to):
-            return False
-        self._edges[_from].append(to)
-        return True
+    """A directed graph built from candidate edges, leaving out those that would close a cycle.
+
+    Edges are considered in the order they're given, and an edge is left out if its target can already reach its
+    source through the edges accepted before it.
+
+    Only an edge within a strongly connected component of the candidate graph can close a cycle, since every path
+    from its target back to its source stays within the component. So the components are found first (with Tarjan's
+    algorithm), edges between them are accepted right away, and only the edges within a component are checked.
+    For those, the nodes are kept in topological order (Pearce & Kelly's dynamic topological sort): an edge that
+    points forward in the order can't close a cycle, and otherwise only the nodes between its endpoints in the order
+    have to be searched, and then re-ordered.
+
+    Blocks are interned as integer ids, which index the adjacency lists and the order.
+    """
+
+    def __init__(self, edges: Iterable[tuple[Block, Block]] = ()) -> None:
+        self._ids: dict[Block, int] = {}
+        self._blocks: list[Block] = []
+        candidates = self._deduplicate([(self._intern(source), self._intern(target)) for source, target in edges])
+
+        node_count = len(self._blocks)
+        self._successors: list[list[int]] = [[] for _ in range(node_count)]
+        self._internal_successors: list[list[int]] = [[] for _ in range(node_count)]
+        self._internal_predecessors: list[list[int]] = [[] for _ in range(node_count)]
+        self._order = list(range(node_count))  # the position of each node in the topological order
+
+        components = _find_strongly_connected_components(node_count, candidates)
+        for source, target in candidates:
+            if components[source] != components[target]:
+                self._successors[source].append(target)
+            elif self._order[target] > self._order[source] or self._reorder(source, target):
+                self._successors[source].append(target)
+                self._internal_successors[source].append(target)
+                self._internal_predecessors[target].append(source)
+
+    def get_successors(self, _from: Block) -> Iterator[Block]:
+        node = self._ids.get(_from)
+        if node is None:
+            return
+        blocks = self._blocks
+        for successor in self._successors[node]:
+            yield blocks[successor]
+
+    def _intern(self, block: Block) -> int:
+        node = self._ids.get(block)
+        if node is None:
+            node = self._ids[block] = len(self._blocks)
+            self._blocks.append(block)
+        return node
+
+    @staticmethod
+    def _deduplicate(edges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Drop self-loops and repeated edges, which are decided by their first occurrence"""
+        seen: set[tuple[int, int]] = set()
+        unique: list[tuple[int, int]] = []
+        for edge in edges:
+            if edge[0] != edge[1] and edge not in seen:
+                seen.add(edge)
+                unique.append(edge)
+        return unique
 
-    def _is_reachable(self, target: Block, *, start: Block) -> bool:
-        visited: set[Block] = set()
-        stack = [start]
+    def _reorder(self, source: int, target: int) -> bool:
+        """Make room for an edge from source to target, which currently points backwards in the topological order.
+        Returns False, leaving the order as it was, if the target reaches the source, i.e. the edge closes a cycle.
+        """
+        order = self._order
+        lower_bound, upper_bound = order[target], order[source]
+
+        # Nodes reachable from the target that come before the source in the order
+        forward: list[int] = []
+        visited = {target}
+        stack = [target]
         while stack:
             node = stack.pop()
-            if node == target:
-                return True
-            if node in visited:
+            forward.append(node)
+            for successor in self._internal_successors[node]:
+                if successor == source:
+                    return False
+                if successor not in visited and order[successor] < upper_bound:
+                    visited.add(successor)
+                    stack.append(successor)
+
+        # Nodes that reach the source and come after the target in the order
+        backward: list[int] = []
+        visited = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            backward.append(node)
+            for predecessor in self._internal_predecessors[node]:
+                if predecessor not in visited and order[predecessor] > lower_bound:
+                    visited.add(predecessor)
+                    stack.append(predecessor)
+
+        # Hand the positions of both groups out again, with the source's group first
+        forward.sort(key=order.__getitem__)
+        backward.sort(key=order.__getitem__)
+        affected = backward + forward
+        positions = sorted(order[node] for node in affected)
+        for node, position in zip(affected, positions):
+            order[node] = position
+        return True
+
+
+def _find_strongly_connected_components(node_count: int, edges: list[tuple[int, int]]) -> list[int]:
+    """Label each node with the strongly connected component it belongs to, using an iterative Tarjan's algorithm."""
+    successors: list[list[int]] = [[] for _ in range(node_count)]
+    for source, target in edges:
+        successors[source].append(target)
+
+    index = [-1] * node_count
+    low_link = [0] * node_count
+    on_stack = [False] * node_count
+    component = [-1] * node_count
+    stack: list[int] = []
+    next_index = 0
+    component_count = 0
+
+    for root in range(node_count):
+        if index[root] != -1:
+            continue
+        # Each frame is a node and the position of the next successor to visit
+        frames = [(root, 0)]
+        index[root] = low_link[root] = next_index
+        next_index += 1
+        stack.append(root)
+        on_stack[root] = True
+        while frames:
+            node, position = frames[-1]
+            if position < len(successors[node]):
+                frames[-1] = (node, position + 1)
+                successor = successors[node][position]
+                if index[successor] == -1:
+                    index[successor] = low_link[successor] = next_index
+                    next_index += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    frames.append((successor, 0))
+                elif on_stack[successor]:
+                    low_link[node] = min(low_link[node], index[successor])
                 continue
-            visited.add(node)
-            stack.extend(self._edges[node])
-        return False
 
-    def get_successors(self, _from: Block):
-        yield from self._edges[_from]
+            frames.pop()
+            if frames:
+                parent = frames[-1][0]
+                low_link[parent] = min(low_link[parent], low_link[node])
+            if low_link[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = component_count
+                    if member == node:
+                        break
+                component_count += 1
+    return component
@@ -0,0 +1,496 @@
+"""Sorting of source code that's edited bit by bit, like a document that's open in an editor.
+
+The blocks of the source are kept between edits, along with where their statements are. After an edit, only the
+statements around it are parsed and analyzed again: the top-level statements it touches or, within a class, just the
+methods it touches. Their neighbours are included, since the lines between two statements decide where both of their
+blocks end and start. Edits that can't be handled that way, like ones that leave a bracket open, have the whole
+source analyzed again.
+"""
+
+from ast import AsyncFunctionDef, ClassDef, FunctionDef, Module, parse, stmt
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from io import StringIO
+from pathlib import Path
+from tokenize import OP, TokenError, generate_tokens
+from typing import NamedTuple, Optional
+
+from .block import Block, ClassBlock, block_for, build_method_blocks, resolve_overlapping_ranges
+from .context import Context, gather_context
+from .prefilter import has_skip_directive
+from .sort import (
+    ResultType,
+    Status,
+    method_step_down_order,
+    moves_only_copies,
+    sort_top_level_blocks,
+    step_down_order,
+)
+from .utils.ast import LineIndex, find_last_line, first_line_number, is_comment
+from .utils.file import split_lines
+from .utils.profile import phase
+
+
+class _Statement(NamedTuple):
+    """Where a statement in a class body is"""
+
+    first_line: int
+    """The 0-based line where it starts, including decorators"""
+    end_line: int
+    """The 0-based line after its last line"""
+    method_name: Optional[str]
+    """The name of the function, if it's a method"""
+
+    def shift(self, lines: int) -> "_Statement":
+        return self._replace(first_line=self.first_line + lines, end_line=self.end_line + lines)
+
+
+class _Unit:
+    """A top-level block, with where its statements are (and the statements of its body, if it's a class).
+    The block is never sorted itself, so it keeps the positions it had when it was built, shifted by later edits.
+    """
+
+    __slots__ = (
+        "block",
+        "first_line",
+        "end_line",
+        "body",
+        "body_indentation",
+        "methods_in_order",
+        "method_order",
+        "_dependencies",
+    )
+
+    def __init__(self, node: stmt, lines: LineIndex, context: Context):
+        self.block = block_for(node, lines, context)
+        self.first_line = first_line_number(node) - 1
+        self.end_line = node.end_lineno or node.lineno
+        self.body: list[_Statement] = []
+        self.body_indentation = 0
+        self.methods_in_order: Optional[bool] = None
+        """Whether the methods of the class are in step-down order, once that's been checked"""
+        self.method_order: Optional[list[int]] = None
+        """The positions of the methods in step-down order, if they're out of it"""
+        self._dependencies: Optional[tuple] = None
+        if isinstance(node, ClassDef):
+            self.body = [_summarize(statement, line_offset=0) for statement in node.body]
+            self.body_indentation = node.body[0].col_offset
+
+    def shift(self, lines: int) -> None:
+        self.block.shift(lines)
+        self.first_line += lines
+        self.end_line += lines
+        self.body = [statement.shift(lines) for statement in self.body]
+
+    @property
+    def dependencies(self) -> tuple:
+        """Everything the order of the top-level blocks depends on that this block contributes"""
+        if self._dependencies is None:
+            block = self.block
+            self._dependencies = (
+                type(block),
+                tuple(block.names),
+                tuple(block.find_predecessors()),
+                tuple(block.find_function_calls()),
+                block.is_pytest_fixture,
+            )
+        return self._dependencies
+
+    def forget_methods(self) -> None:
+        """Forget what's been found out about the methods of the class, after they have changed"""
+        self.methods_in_order = None
+        self.method_order = None
+        self._dependencies = None
+
+
+class _Analysis(NamedTuple):
+    source_lines: list[str]
+    """The lines that were analyzed, as split by `utils.file.split_lines`"""
+    filename: str
+    context: Context
+    units: list[_Unit]
+
+
+class IncrementalSource:
+    """Source code that's edited in place, and can be sorted after every edit without analyzing all of it again.
+    The filename and context are used the same way as by `sort_source`.
+    """
+
+    def __init__(self, source: str, filename: str | Path | None = None, context: Optional[Context] = None):
+        self.lines = source.split("\n")
+        self._filename = filename
+        self._context = context
+        self._analysis: Optional[_Analysis] = None
+        self._status: Optional[Status] = None
+        self._checked_order: tuple[list[tuple], Optional[list[int]]] = ([], None)
+        """The dependencies of the top-level blocks when their order was last checked, and the step-down order of
+        the blocks if they were out of it"""
+        self._result: Optional[ResultType] = None
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def edit(self, start_line: int, start_column: int, end_line: int, end_column: int, text: str) -> None:
+        """Replace the text between two positions, given as 0-based line numbers and indices within those lines"""
+        prefix = self.lines[start_line][:start_column]
+        suffix = self.lines[end_line][end_column:]
+        self.lines[start_line : end_line + 1] = (prefix + text + suffix).split("\n")
+        self._status = None
+        self._result = None
+
+    def check(self) -> Status:
+        """Determine the status `sort` would report, like `check_step_down_order`, which only re-arranges the source
+        if its blocks are out of order. Raises SyntaxError if the source can't be parsed.
+        """
+        if self._status is None:
+            self._status = self._check()
+        return self._status
+
+    def sort(self) -> ResultType:
+        """Sort the source as it is now, like `sort_source` does. Raises SyntaxError if it can't be parsed."""
+        if self._result is None:
+            self._result = self._sort()
+        return self._result
+
+    def _sort(self) -> ResultType:
+        status = self.check()
+        if self._result is not None:
+            return self._result  # the source was sorted to find out its status
+        if status == "skipped":
+            return ("skipped", None)
+        if status == "unchanged":
+            return ("unchanged", None)
+        return self._sort_blocks()
+
+    def _check(self) -> Status:
+        # Newlines are translated like they are in files that are read
+        source = self.text.replace("\r\n", "\n").replace("\r", "\n")
+        if has_skip_directive(source.encode("utf-8")):
+            return "skipped"
+
+        source_lines = split_lines(source)
+        if self._analysis is None or not _update_analysis(self._analysis, source, source_lines):
+            self._analysis = self._analyze(source, source_lines)
+        out_of_order = self._find_blocks_out_of_order(self._analysis.units)
+        if not out_of_order:
+            return "unchanged"
+        source_lines = self._analysis.source_lines
+        if not all(moves_only_copies(source_lines, blocks, order) for blocks, order in out_of_order):
+            return "sorted"
+
+        # Blocks that only swap places with copies of themselves can leave the source as it is, which sorting it
+        # finds out, like `check_step_down_order` does
+        self._result = self._sort_blocks()
+        return self._result[0]
+
+    def _sort_blocks(self) -> ResultType:
+        # The kept blocks stay where they are, and copies of them are sorted
+        assert self._analysis is not None
+        blocks = [unit.block.copy() for unit in self._analysis.units]
+        resolve_overlapping_ranges(blocks)
+        return sort_top_level_blocks(self._analysis.source_lines, blocks)
+
+    def _find_blocks_out_of_order(self, units: list[_Unit]) -> list[tuple[Sequence[Block], list[int]]]:
+        """Find the blocks that aren't in step-down order, with the order they belong in, like
+        `check_step_down_order` does. The order of the methods of a class is only checked again once they have
+        changed, and the order of the top-level blocks once what it depends on has changed.
+        """
+        out_of_order: list[tuple[Sequence[Block], list[int]]] = []
+        for unit in units:
+            if not isinstance(unit.block, ClassBlock):
+                continue
+            if unit.methods_in_order is None:
+                unit.method_order = method_step_down_order(unit.block)
+                unit.methods_in_order = unit.method_order is None
+            if unit.method_order is not None:
+                out_of_order.append((unit.block.method_blocks, unit.method_order))
+
+        dependencies = [unit.dependencies for unit in units]
+        if dependencies != self._checked_order[0]:
+            self._checked_order = (dependencies, step_down_order([unit.block for unit in units]))
+        if self._checked_order[1] is not None:
+            out_of_order.append(([unit.block for unit in units], self._checked_order[1]))
+        return out_of_order
+
+    def _analyze(self, source: str, source_lines: list[str]) -> _Analysis:
+        filename = "<unknown>" if self._filename is None else str(self._filename)
+        with phase("parse"):
+            syntax_tree = parse(source, filename=filename)
+        context = self._context
+        if context is None:
+            with phase("gather_context"):
+                file_path = None if self._filename is None else Path(self._filename).resolve()
+                context = gather_context(syntax_tree, file_path)
+        with phase("build_blocks"):
+            units = _build_units(syntax_tree.body, LineIndex(source_lines), context)
+        return _Analysis(source_lines, filename, context, units)
+
+
+def _update_analysis(analysis: _Analysis, source: str, source_lines: list[str]) -> bool:
+    """Bring the analysis up to date with edited lines, by analyzing the statements around the edits again.
+    Returns False if that isn't possible, and the whole source has to be analyzed again.
+    """
+    change = find_changed_lines(analysis.source_lines, source_lines)
+    if change is None:
+        return True
+    start, old_end, new_end = change
+    changed_lines = [*analysis.source_lines[start:old_end], *source_lines[start:new_end]]
+    if not analysis.units or any("__future__" in line for line in changed_lines):
+        return False  # the context may have changed
+    if source.endswith("\\"):
+        return False  # the parts are parsed with a newline at the end, which would continue the last line
+
+    first, last = _find_affected_statements(
+        [(unit.first_line, unit.end_line) for unit in analysis.units], start, old_end
+    )
+    updated = (first == last and _update_methods(analysis, first, change, source_lines)) or _update_units(
+        analysis, first, last, change, source_lines
+    )
+    if updated:
+        analysis.source_lines[:] = source_lines
+    return updated
+
+
+def _build_units(nodes: Sequence[stmt], lines: LineIndex, context: Context) -> list[_Unit]:
+    """Build the top-level blocks of the statements like `sort._find_top_level_blocks` does, but leave their
+    overlapping ranges, which are resolved once they're all in place.
+    """
+    units: list[_Unit] = []
+    for node in nodes:
+        if units and units[-1].block.append(node, lines):
+            units[-1].end_line = node.end_lineno or node.lineno
+        else:
+            units.append(_Unit(node, lines, context))
+    return units
+
+
+def _update_units(
+    analysis: _Analysis, first: int, last: int, change: tuple[int, int, int], source_lines: list[str]
+) -> bool:
+    """Build the top-level blocks from first to last again, along with the blocks on either side of them"""
+    units = analysis.units
+    first, last = max(first - 1, 0), min(last + 1, len(units) - 1)
+    region_start = units[first - 1].end_line if first > 0 else 0
+    region_end = units[last + 1].first_line if last + 1 < len(units) else len(analysis.source_lines)
+    if region_start > units[first].first_line or region_end < units[last].end_line:
+        return False  # statements on the same line belong to different blocks
+
+    region = _parse_region(analysis, region_start, region_end, change, source_lines)
+    if region is None:
+        return False
+    region_lines, syntax_tree = region
+    new_units = _build_units(syntax_tree.body, LineIndex(region_lines), analysis.context)
+    for unit in new_units:
+        unit.shift(region_start)
+
+    delta = change[2] - change[1]
+    for unit in units[last + 1 :]:
+        unit.shift(delta)
+    units[first : last + 1] = new_units
+    return True
+
+
+def _update_methods(
+    analysis: _Analysis, index: int, change: tuple[int, int, int], source_lines: list[str]
+) -> bool:
+    """Build the method blocks of a class again, for the methods that an edit within its body touches.
+    That's only possible if the edit leaves methods (and only methods) between the other statements of the class.
+    """
+    unit = analysis.units[index]
+    start, old_end, _ = change
+    if not isinstance(unit.block, ClassBlock) or not (
+        unit.first_line <= start < unit.end_line and old_end <= unit.end_line
+    ):
+        return False  # lines outside of the class decide where the blocks around it start and end
+    body = unit.body
+    source_end = analysis.units[index + 1].first_line if index + 1 < len(analysis.units) else None
+    first, last = _find_affected_statements(
+        [(statement.first_line, statement.end_line) for statement in body], start, old_end
+    )
+
+    # Whole method blocks are built again, i.e. all overloads of a method, as well as the methods next to them
+    method_indices = _index_method_blocks(body)
+    first, last = _widen_to_method_blocks(method_indices, first, last)
+    if first > 0 and method_indices[first - 1] is not None:
+        first, _ = _widen_to_method_blocks(method_indices, first - 1, first - 1)
+    if last + 1 < len(body) and method_indices[last + 1] is not None:
+        _, last = _widen_to_method_blocks(method_indices, last + 1, last + 1)
+    if first == 0 or any(method_indices[i] is None for i in range(first, last + 1)):
+        return False  # the edit may change the class itself
+
+    reaches_end = last + 1 == len(body)
+    region_start = body[first - 1].end_line
+    if reaches_end:
+        region_end = len(analysis.source_lines) if source_end is None else source_end
+    else:
+        region_end = body[last + 1].first_line
+    # The methods are parsed within a class of their own, which takes up the line before them
+    region = _parse_region(analysis, region_start, region_end, change, source_lines, header="class _:")
+    if region is None:
+        return False
+    region_lines, syntax_tree = region
+    wrapper = syntax_tree.body[0]
+    assert isinstance(wrapper, ClassDef)
+    methods = wrapper.body
+    if any(
+        not isinstance(method, (FunctionDef, AsyncFunctionDef)) or method.col_offset != unit.body_indentation
+        for method in methods
+    ):
+        return False
+    method_names = [method.name for method in methods if isinstance(method, (FunctionDef, AsyncFunctionDef))]
+    names_before = [statement.method_name for statement in body[:first] if statement.method_name is not None]
+    names_after = [statement.method_name for statement in body[last + 1 :] if statement.method_name is not None]
+    if method_names:
+        merges = names_before[-1:] == method_names[:1] or names_after[:1] == method_names[-1:]
+    else:
+        merges = names_before[-1:] == names_after[:1]
+    if merges:
+        return False  # methods would become overloads of the ones next to them
+
+    lines = LineIndex(region_lines)
+    line_offset = region_start - 1
+    method_blocks = build_method_blocks(
+        (method for method in methods if isinstance(method, (FunctionDef, AsyncFunctionDef))),
+        lines,
+        analysis.context,
+    )
+    for method_block in method_blocks:
+        method_block.shift(line_offset)
+
+    delta = change[2] - change[1]
+    class_block = unit.block
+    first_method, last_method = method_indices[first], method_indices[last]
+    assert first_method is not None and last_method is not None
+    for method_block in class_block.method_blocks[last_method + 1 :]:
+        method_block.shift(delta)
+    class_block.replace_methods(first_method, last_method + 1, method_blocks)
+    unit.forget_methods()
+    unit.body = [
+        *body[:first],
+        *(_summarize(method, line_offset) for method in methods),
+        *(statement.shift(delta) for statement in body[last + 1 :]),
+    ]
+    if reaches_end:
+        unit.end_line = (wrapper.end_lineno or wrapper.lineno) + line_offset
+        class_block.end = find_last_line(wrapper, lines) + line_offset
+    else:
+        unit.end_line += delta
+        class_block.end += delta
+    for later_unit in analysis.units[index + 1 :]:
+        later_unit.shift(delta)
+    return True
+
+
+def _parse_region(
+    analysis: _Analysis,
+    region_start: int,
+    region_end: int,
+    change: tuple[int, int, int],
+    source_lines: list[str],
+    header: Optional[str] = None,
+) -> Optional[tuple[list[str], Module]]:
+    """Parse the edited lines of a region that spans whole statements, from where the statement before it ends to
+    where the one after it starts. Returns None if the region can't be parsed on its own.
+    Raises SyntaxError if the source can't be parsed, which the region of top-level statements can tell when no token
+    crosses its ends: the statements at its ends haven't been edited, so the ones outside can't complete the others.
+    Nor can they close a bracket the region leaves open, as they were parsed with their brackets balanced.
+    """
+    if region_start > 0:
+        line_before = analysis.source_lines[region_start - 1]
+        if is_comment(line_before) or line_before.endswith("\\"):
+            return None  # the region might not start at the beginning of a line of code
+    region_lines = source_lines[region_start : region_end + change[2] - change[1]]
+    if header is not None:
+        region_lines.insert(0, header)
+    region_source = "\n".join(region_lines) + "\n"
+    with phase("parse"):
+        try:
+            syntax_tree = parse(region_source, filename=analysis.filename)
+        except SyntaxError:
+            if header is not None or not _can_fail_on_its_own(region_source):
+                return None
+            # Parsed at its place in the source, the region raises the error that parsing all of it would, or one
+            # at the bracket it leaves open
+            parse("\n" * region_start + region_source, filename=analysis.filename)
+            return None
+        except ValueError:
+            return None
+    if header is not None and (len(syntax_tree.body) != 1 or not isinstance(syntax_tree.body[0], ClassDef)):
+        return None
+    return region_lines, syntax_tree
+
+
+def _can_fail_on_its_own(source: str) -> bool:
+    """Check that the source isn't completed by the lines after it: no string or line continuation is left open at
+    its end, unless a bracket is too
+    """
+    open_brackets = 0
+    try:
+        for token in generate_tokens(StringIO(source).readline):
+            if token.type == OP and token.string in ("(", "[", "{"):
+                open_brackets += 1
+            elif token.type == OP and token.string in (")", "]", "}"):
+                open_brackets -= 1
+    except TokenError as e:
+        return e.args[0] == "EOF in multi-line statement" and open_brackets > 0
+    except SyntaxError:
+        return False
+    return True
+
+
+def _summarize(statement: stmt, line_offset: int) -> _Statement:
+    method_name = statement.name if isinstance(statement, (FunctionDef, AsyncFunctionDef)) else None
+    first_line = first_line_number(statement) - 1 + line_offset
+    return _Statement(first_line, (statement.end_lineno or statement.lineno) + line_offset, method_name)
+
+
+def _index_method_blocks(body: Sequence[_Statement]) -> list[Optional[int]]:
+    """The index of the method block of each statement in a class body, or None for statements that aren't methods.
+    Consecutive methods with the same name are overloads, which share a block.
+    """
+    indices: list[Optional[int]] = []
+    method_block = -1
+    previous_name = None
+    for statement in body:
+        if statement.method_name is not None and statement.method_name != previous_name:
+            method_block += 1
+            previous_name = statement.method_name
+        indices.append(None if statement.method_name is None else method_block)
+    return indices
+
+
+def _widen_to_method_blocks(method_indices: list[Optional[int]], first: int, last: int) -> tuple[int, int]:
+    """Widen a range of statements to whole method blocks, including any statements between the methods"""
+    first_method = next((i for i in method_indices[first : last + 1] if i is not None), None)
+    last_method = next((i for i in reversed(method_indices[first : last + 1]) if i is not None), None)
+    if first_method is None or last_method is None:
+        return first, last
+    first = min(first, method_indices.index(first_method))
+    last = max(last, len(method_indices) - 1 - method_indices[::-1].index(last_method))
+    return first, last
+
+
+def _find_affected_statements(ranges: list[tuple[int, int]], start: int, end: int) -> tuple[int, int]:
+    """Find the first and last of the statements (given as ranges of lines, in order) that a change of the lines
+    from start up to end touches, along with the lines right before or after them.
+    """
+    first = min(bisect_left([end_line for _, end_line in ranges], start), len(ranges) - 1)
+    last = max(bisect_right([first_line for first_line, _ in ranges], end) - 1, first)
+    return first, last
+
+
+def find_changed_lines(old_lines: list[str], new_lines: list[str]) -> Optional[tuple[int, int, int]]:
+    """Find the lines that differ, as the start of the change and where it ends in the old and in the new lines.
+    Returns None if the lines are the same.
+    """
+    start = 0
+    shortest = min(len(old_lines), len(new_lines))
+    while start < shortest and old_lines[start] == new_lines[start]:
+        start += 1
+    if start == len(old_lines) == len(new_lines):
+        return None
+    common_end = 0
+    while common_end < shortest - start and old_lines[-1 - common_end] == new_lines[-1 - common_end]:
+        common_end += 1
+    return start, len(old_lines) - common_end, len(new_lines) - common_end
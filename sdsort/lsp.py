@@ -0,0 +1,265 @@
+"""A language server, which offers sorting to editors over the Language Server Protocol, on stdin and stdout.
+
+Each open document is kept as an `IncrementalSource`, which the edits the editor sends are applied to, so answering
+a request only takes analyzing the statements around the latest edits. Editors ask for code actions whenever the
+cursor moves, so those only check the order of the blocks. The sorted source is only put together when the action
+is resolved, or the document is formatted.
+"""
+
+import json
+import sys
+from tokenize import TokenError
+from typing import Any, BinaryIO, Optional
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import click
+
+from .incremental import IncrementalSource, find_changed_lines
+
+SORT_ACTION_KIND = "source.sdsort"
+SORT_ACTION_TITLE = "Sort by step-down rule"
+
+# Error codes of JSON-RPC, and of the protocol itself
+_PARSE_ERROR = -32700
+_INVALID_REQUEST = -32600
+_METHOD_NOT_FOUND = -32601
+_INTERNAL_ERROR = -32603
+_SERVER_NOT_INITIALIZED = -32002
+
+
+class _ResponseError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class LanguageServer:
+    """Serves one client, reading messages from `rfile` and writing them to `wfile`"""
+
+    def __init__(self, rfile: BinaryIO, wfile: BinaryIO):
+        self._rfile = rfile
+        self._wfile = wfile
+        self._documents: dict[str, IncrementalSource] = {}
+        self._initialized = False
+        self._shut_down = False
+        self._utf16_positions = True
+        self._resolves_edits = False
+
+    def serve(self) -> int:
+        """Handle messages until the client exits. Returns the exit code the protocol asks for."""
+        while True:
+            try:
+                message = self._read_message()
+            except ValueError as e:
+                self._send({"id": None, "error": {"code": _PARSE_ERROR, "message": str(e)}})
+                continue
+            if message is None or message.get("method") == "exit":
+                return 0 if self._shut_down else 1
+            self._handle(message)
+
+    def respond(self, method: str, params: Any) -> Any:
+        """Handle a request or notification, returning the result of a request"""
+        if not self._initialized and method != "initialize":
+            raise _ResponseError(_SERVER_NOT_INITIALIZED, "the server hasn't been initialized")
+        if self._shut_down:
+            raise _ResponseError(_INVALID_REQUEST, "the server has been shut down")
+        match method:
+            case "initialize":
+                return self._initialize(params)
+            case "initialized":
+                return None
+            case "shutdown":
+                self._shut_down = True
+                return None
+            case "textDocument/didOpen":
+                document = params["textDocument"]
+                self._documents[document["uri"]] = IncrementalSource(document["text"], _path_of(document["uri"]))
+                return None
+            case "textDocument/didChange":
+                document = self._documents[params["textDocument"]["uri"]]
+                for change in params["contentChanges"]:
+                    self._apply_change(document, change)
+                return None
+            case "textDocument/didClose":
+                self._documents.pop(params["textDocument"]["uri"], None)
+                return None
+            case "textDocument/codeAction":
+                return self._code_actions(params)
+            case "codeAction/resolve":
+                return self._resolve_code_action(params)
+            case "textDocument/formatting":
+                return self._format(params["textDocument"]["uri"])
+            case _:
+                raise _ResponseError(_METHOD_NOT_FOUND, f"unknown method: {method}")
+
+    def _handle(self, message: dict[str, Any]):
+        if "method" not in message:
+            return  # a response to a request from the server, which never sends any
+        is_request = "id" in message
+        try:
+            result = self.respond(message["method"], message.get("params"))
+        except _ResponseError as e:
+            if is_request or e.code != _METHOD_NOT_FOUND:  # notifications the server doesn't know are ignored
+                self._reply(message, error={"code": e.code, "message": str(e)})
+            return
+        except Exception as e:
+            self._reply(message, error={"code": _INTERNAL_ERROR, "message": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(message, result=result)
+
+    def _reply(self, message: dict[str, Any], *, result: Any = None, error: Optional[dict[str, Any]] = None):
+        if "id" not in message:
+            if error is not None:
+                print(f"sdsort: {message['method']}: {error['message']}", file=sys.stderr)
+            return
+        if error is not None:
+            self._send({"id": message["id"], "error": error})
+        else:
+            self._send({"id": message["id"], "result": result})
+
+    def _initialize(self, params: dict[str, Any]) -> dict[str, Any]:
+        capabilities = params.get("capabilities", {})
+        # Positions count UTF-16 code units, unless the client can count code points, like Python strings do
+        self._utf16_positions = "utf-32" not in capabilities.get("general", {}).get("positionEncodings", [])
+        resolve_support = capabilities.get("textDocument", {}).get("codeAction", {}).get("resolveSupport", {})
+        self._resolves_edits = "edit" in resolve_support.get("properties", [])
+        self._initialized = True
+        return {
+            "capabilities": {
+                "positionEncoding": "utf-16" if self._utf16_positions else "utf-32",
+                "textDocumentSync": {"openClose": True, "change": 2},  # 2: incremental changes
+                "codeActionProvider": {"codeActionKinds": [SORT_ACTION_KIND], "resolveProvider": True},
+                "documentFormattingProvider": True,
+            },
+            "serverInfo": {"name": "sdsort"},
+        }
+
+    def _apply_change(self, document: IncrementalSource, change: dict[str, Any]):
+        if "range" not in change:
+            lines = document.lines
+            document.edit(0, 0, len(lines) - 1, len(lines[-1]), change["text"])  # the whole text is replaced
+            return
+        start_line, start_column = self._find_position(document.lines, change["range"]["start"])
+        end_line, end_column = self._find_position(document.lines, change["range"]["end"])
+        document.edit(start_line, start_column, end_line, end_column, change["text"])
+
+    def _find_position(self, lines: list[str], position: dict[str, int]) -> tuple[int, int]:
+        """Find the line and index within it of a position, which may be past the end of the line or document"""
+        if position["line"] >= len(lines):
+            return len(lines) - 1, len(lines[-1])
+        line = lines[position["line"]].removesuffix("\r")
+        character = position["character"]
+        if self._utf16_positions and not line.isascii():
+            character = _utf16_to_index(line, character)
+        return position["line"], min(character, len(line))
+
+    def _code_actions(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        only = params.get("context", {}).get("only")
+        if only is not None and not any(
+            SORT_ACTION_KIND == kind or SORT_ACTION_KIND.startswith(f"{kind}.") for kind in only
+        ):
+            return []
+        uri = params["textDocument"]["uri"]
+        document = self._documents.get(uri)
+        try:
+            if document is None or document.check() != "sorted":
+                return []
+        except (SyntaxError, TokenError):
+            return []  # the document is being edited
+        action: dict[str, Any] = {"title": SORT_ACTION_TITLE, "kind": SORT_ACTION_KIND, "data": {"uri": uri}}
+        if not self._resolves_edits:
+            action = self._resolve_code_action(action)
+        return [action]
+
+    def _resolve_code_action(self, action: dict[str, Any]) -> dict[str, Any]:
+        uri = action["data"]["uri"]
+        edits = self._format(uri)
+        return {**action, "edit": {"changes": {uri: edits}}} if edits else action
+
+    def _format(self, uri: str) -> list[dict[str, Any]]:
+        """The edits that sort a document, which replace the range of lines that changes"""
+        document = self._documents.get(uri)
+        if document is None:
+            return []
+        try:
+            _, sorted_source = document.sort()
+        except (SyntaxError, TokenError):
+            return []
+        if sorted_source is None:
+            return []
+
+        lines = document.lines
+        newline = "\r\n" if lines[0].endswith("\r") else "\n"
+        new_lines = sorted_source.replace("\n", newline).split("\n")
+        change = find_changed_lines(lines, new_lines)
+        if change is None:
+            return []
+        start, old_end, new_end = change
+        if old_end < len(lines):
+            end = {"line": old_end, "character": 0}
+            new_text = "".join(f"{line}\n" for line in new_lines[start:new_end])
+        else:
+            # The last line changes, which has no line break to end the range at
+            end = _end_of(lines, self._utf16_positions)
+            new_text = "\n".join(new_lines[start:new_end])
+        return [{"range": {"start": {"line": start, "character": 0}, "end": end}, "newText": new_text}]
+
+    def _read_message(self) -> Optional[dict[str, Any]]:
+        """Read a message, after its headers. Returns None once the input has ended."""
+        content_length = None
+        while True:
+            header = self._rfile.readline()
+            if not header:
+                return None
+            if header in (b"\r\n", b"\n"):
+                break
+            name, _, value = header.decode("ascii").partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value)
+        if content_length is None:
+            raise ValueError("a message without a Content-Length header")
+        content = self._rfile.read(content_length)
+        if len(content) < content_length:
+            return None
+        message = json.loads(content)
+        if not isinstance(message, dict):
+            raise ValueError("a message that isn't an object")
+        return message
+
+    def _send(self, message: dict[str, Any]):
+        content = json.dumps({"jsonrpc": "2.0", **message}).encode("utf-8")
+        self._wfile.write(b"Content-Length: %d\r\n\r\n" % len(content) + content)
+        self._wfile.flush()
+
+
+def _path_of(uri: str) -> Optional[str]:
+    """The path of a file URI, which lets the configuration of the file's project be found"""
+    parsed = urlparse(uri)
+    return url2pathname(parsed.path) if parsed.scheme == "file" else None
+
+
+def _end_of(lines: list[str], utf16_positions: bool) -> dict[str, int]:
+    last_line = lines[-1]
+    length = len(last_line.encode("utf-16-le")) // 2 if utf16_positions else len(last_line)
+    return {"line": len(lines) - 1, "character": length}
+
+
+def _utf16_to_index(line: str, character: int) -> int:
+    """Find the index in a line of a position in UTF-16 code units, where characters beyond the BMP take up two"""
+    units = 0
+    for index, char in enumerate(line):
+        if units >= character:
+            return index
+        units += 2 if ord(char) > 0xFFFF else 1
+    return len(line)
+
+
+@click.command()
+@click.option(
+    "--stdio", is_flag=True, hidden=True, help="Talk over stdin and stdout, which is all the server does."
+)
+def main(stdio: bool):
+    """Run the sdsort language server, which an editor talks to over stdin and stdout."""
+    server = LanguageServer(sys.stdin.buffer, sys.stdout.buffer)
+    sys.exit(server.serve())
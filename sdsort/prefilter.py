@@ -0,0 +1,110 @@
+"""Cheap checks on the raw bytes of a file, to avoid tokenizing and parsing files that can't change."""
+
+import re
+
+from .utils.file import decode_source
+
+_UTF8_BOM = b"\xef\xbb\xbf"
+
+# Lines that start in the first column and aren't comments. A form feed moves Python's tokenizer back to the first
+# column, so whitespace up to the last one doesn't indent a line, and the group of the match leaves it out.
+_TOP_LEVEL_LINE = re.compile(rb"^(?:[ \t\f]*\f)?([^ \t\f\n#].*)", re.MULTILINE)
+_DEFINITION = re.compile(rb"(?:async[ \t]+)?def\b|class\b")
+_IMPORT = re.compile(rb"(?:import|from)\b")
+_INDENTED_DEFINITION = re.compile(rb"^(?:[ \t\f]*\f)?[ \t]+(?:async[ \t]+)?def\b", re.MULTILINE)
+
+_LEADING_BLANKS_AND_COMMENTS = re.compile(rb"(?:[ \t\f]*(?:#.*)?\n)*")
+_DOCSTRING_START = re.compile(rb"[rRuU]?(\"\"\"|''')")
+
+
+def has_skip_directive(source: bytes) -> bool:
+    """Check for a `# sdsort: skip_file` comment.
+    Only lines mentioning sdsort are candidates, and the tokenizer is only run as far as needed to confirm them.
+    """
+    if b"sdsort" not in source:
+        return False
+
+    # Most files never get this far, so they don't pay for importing the tokenizer
+    from io import StringIO
+    from tokenize import COMMENT, generate_tokens
+
+    text = decode_source(source)
+    candidate_lines = _find_line_numbers(text, "sdsort")
+    for token in generate_tokens(StringIO(text).readline):
+        if token.start[0] > candidate_lines[-1]:
+            break
+        if token.type == COMMENT and token.start[0] in candidate_lines:
+            key, _, value = token.string.lstrip("#").partition(":")
+            if key.strip() == "sdsort" and value.strip() == "skip_file":
+                return True
+    return False
+
+
+def _find_line_numbers(text: str, substring: str) -> list[int]:
+    """1-based numbers of the lines containing the substring, in ascending order"""
+    line_numbers: list[int] = []
+    index = text.find(substring)
+    while index != -1:
+        line_number = text.count("\n", 0, index) + 1
+        if not line_numbers or line_numbers[-1] != line_number:
+            line_numbers.append(line_number)
+        index = text.find(substring, index + len(substring))
+    return line_numbers
+
+
+def cannot_be_reordered(source: bytes) -> bool:
+    """Detect files that sorting would leave unchanged, without parsing them.
+
+    That's the case when there's at most one top-level block that could take part in a dependency,
+    i.e. one definition or one run of statements (imports and a module docstring don't count),
+    and no class has more than one method.
+    The check is conservative: every top-level line that isn't recognized counts as a statement.
+    """
+    if b"\r" in source:
+        source = source.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    if source.startswith(_UTF8_BOM):
+        source = source[len(_UTF8_BOM) :]
+
+    movable_blocks = 0
+    in_statements = False
+    has_class = False
+    for match in _TOP_LEVEL_LINE.finditer(source, _skip_docstring(source)):
+        line = match.group(1)
+        if _DEFINITION.match(line):
+            movable_blocks += 1
+            in_statements = False
+            has_class = has_class or line.startswith(b"class")
+        elif line.startswith(b"@"):
+            in_statements = False  # a decorator belongs to the definition that follows it
+        elif b";" not in line and _IMPORT.match(line):
+            in_statements = False  # imports have no dependencies
+        elif b";" not in line and line.startswith((b")", b"]", b"}")):
+            pass  # a closing bracket continues the previous line
+        elif not in_statements:
+            movable_blocks += 1
+            in_statements = True
+
+        if movable_blocks > 1:
+            return False
+
+    return not (has_class and len(_INDENTED_DEFINITION.findall(source)) > 1)
+
+
+def _skip_docstring(source: bytes) -> int:
+    """Find where the code after the module docstring starts. Returns 0 if there's no docstring."""
+    leading_lines = _LEADING_BLANKS_AND_COMMENTS.match(source)
+    quotes = _DOCSTRING_START.match(source, leading_lines.end() if leading_lines else 0)
+    if quotes is None:
+        return 0
+
+    # An escaped quote can end the docstring early, which only means more lines get inspected
+    end = source.find(quotes.group(1), quotes.end())
+    if end == -1:
+        return 0
+    end += len(quotes.group(1))
+    line_end = source.find(b"\n", end)
+    if line_end == -1:
+        line_end = len(source)
+    if source[end:line_end].strip():
+        return 0  # something follows the docstring on the same line
+    return line_end
@@ -1,181 +1,302 @@
-from ast import Attribute, Call, ClassDef, Module, Name, parse
+from ast import Module, parse
 from collections import defaultdict
-from collections.abc import Collection
-from io import BytesIO
+from collections.abc import Collection, Iterable, Sequence
 from itertools import takewhile
 from pathlib import Path
-from tokenize import COMMENT, tokenize
 from typing import Callable, Literal, Optional, Union
 
 from .block import Block, ClassBlock, FunctionBlock, block_for, resolve_overlapping_ranges
 from .context import Context, gather_context
 from .format import normalize_blank_lines
 from .graph import AcyclicGraph
-from .utils.ast import (
-    find_start_of_class_body,
-    get_class_nodes,
-    is_blank,
-)
-from .utils.file import read_file, split_lines
+from .prefilter import cannot_be_reordered, has_skip_directive
+from .utils.ast import LineIndex, is_blank
+from .utils.file import decode_source, read_file_bytes, split_lines
+from .utils.profile import phase
+from .utils.spans import SpannedLines
 
+Status = Literal["sorted", "skipped", "unchanged"]
 ResultType = Union[
     tuple[Literal["sorted"], str], tuple[Literal["skipped"], None], tuple[Literal["unchanged"], None]
 ]
 
 
-def step_down_sort(python_file_path: str | Path) -> ResultType:
-    source = read_file(python_file_path)
-    if _should_skip(source):
+def step_down_sort(python_file_path: str | Path, *, raw_source: Optional[bytes] = None) -> ResultType:
+    """Sort the file's functions and methods. `raw_source` can be given if the file has already been read."""
+    if raw_source is None:
+        raw_source = read_file_bytes(python_file_path)
+    return _sort_raw_source(raw_source, python_file_path)
+
+
+def sort_source(
+    source: str, *, filename: str | Path | None = None, context: Optional[Context] = None
+) -> ResultType:
+    """Sort the functions and methods of source code that's already in memory.
+    If `filename` is given, it appears in syntax errors and the configuration of its project is taken into account.
+    A `context` replaces what would be gathered from the source and its project.
+    Without a filename, the filesystem isn't touched.
+    """
+    # The checks that spare most files from being parsed work on raw bytes, like those read from a file
+    return _sort_raw_source(source.encode("utf-8"), filename, context)
+
+
+def _sort_raw_source(
+    raw_source: bytes, python_file_path: str | Path | None, context: Optional[Context] = None
+) -> ResultType:
+    if _is_skipped(raw_source):
         return ("skipped", None)
+    if _cannot_be_reordered(raw_source):
+        return ("unchanged", None)
 
-    syntax_tree = parse(source, filename=python_file_path)
-    context = gather_context(syntax_tree, Path(python_file_path).resolve())
-    source_lines = split_lines(source)
+    source_lines, blocks = _find_blocks(raw_source, python_file_path, context)
+    return sort_top_level_blocks(source_lines, blocks)
+
+
+def sort_syntax_tree(
+    syntax_tree: Module,
+    source_lines: list[str],
+    *,
+    filename: str | Path | None = None,
+    context: Optional[Context] = None,
+) -> ResultType:
+    """Sort the functions and methods of source code that another tool has parsed already, so it isn't parsed again.
+    `source_lines` are the lines of the source that was parsed, as split by `utils.file.split_lines`.
+    The filename and context are used the same way as by `sort_source`. The syntax tree isn't modified.
+    """
+    # Only the tokenizer can tell a skip directive from text in a string, and it needs the source in one piece
+    if _is_skipped("\n".join(source_lines).encode("utf-8")):
+        return ("skipped", None)
+    return sort_top_level_blocks(source_lines, _build_blocks(syntax_tree, source_lines, filename, context))
 
-    # First, sort top-level blocks (functions and classes)
-    modified_lines = _sort_top_level_blocks(source_lines, syntax_tree, context)
 
-    # Re-parse to get updated line numbers for class sorting
-    modified_source = "\n".join(modified_lines) + "\n"
-    modified_tree = parse(modified_source)
+def sort_top_level_blocks(source_lines: list[str], blocks: list[Block]) -> ResultType:
+    """Re-arrange the lines of source code, given its top-level blocks in order.
+    The blocks are moved around in the process, so they can only be sorted once.
+    """
+    # First, sort top-level blocks (functions and classes).
+    # The blocks are shifted to their new positions, so the class blocks can be re-used below.
+    sorted_blocks = _sort_blocks(blocks, _function_calls)
+    with phase("rearrange_lines"):
+        modified_lines = _rearrange_lines(SpannedLines.of(source_lines), blocks, sorted_blocks)
 
     # Then, sort methods within classes
-    final_lines: list[str] = []
-    for cls in get_class_nodes(modified_tree):
-        # Copy everything, which hasn't been copied so far, up until the class body,
-        class_body_start = find_start_of_class_body(cls, modified_lines)
-        final_lines.extend(modified_lines[len(final_lines) : class_body_start])
-
-        # Copy class after sorting its methods
-        final_lines.extend(_sort_methods_within_class(modified_lines, cls, context))
+    class_bodies = [
+        _sort_methods_within_class(modified_lines, block)
+        for block in sorted_blocks
+        if isinstance(block, ClassBlock) and block.method_blocks
+    ]
 
-    # Copy remainder of file
-    final_lines.extend(modified_lines[len(final_lines) :])
+    # Both re-arrangements are spans of the source lines, which are only copied now
+    with phase("rearrange_lines"):
+        final_lines = list(modified_lines.replace(class_bodies))
 
     if source_lines != final_lines:
-        return ("sorted", normalize_blank_lines(final_lines))
+        with phase("normalize_blank_lines"):
+            return ("sorted", normalize_blank_lines(final_lines, sorted_blocks))
     else:
         return ("unchanged", None)
 
 
-def _should_skip(source: str) -> bool:
-    code_bytes = BytesIO(source.encode("utf-8"))
-    for token in tokenize(code_bytes.readline):
-        if token.type == COMMENT:
-            key, _, value = token.string.lstrip("#").partition(":")
-            if key.strip() == "sdsort" and value.strip() == "skip_file":
-                return True
-    return False
+def check_step_down_order(python_file_path: str | Path, *, raw_source: Optional[bytes] = None) -> Status:
+    """Determine the status step_down_sort would report for a file, without re-arranging it, unless it has to be.
+    A file is unchanged if its top-level blocks, and the methods of each class, are already in step-down order.
+    Sorting blocks that are out of order changes the file, unless they only swap places with copies of themselves,
+    in which case the file is sorted to find out.
+    """
+    if raw_source is None:
+        raw_source = read_file_bytes(python_file_path)
+    if _is_skipped(raw_source):
+        return "skipped"
+    if _cannot_be_reordered(raw_source):
+        return "unchanged"
+
+    source_lines, blocks = _find_blocks(raw_source, python_file_path)
+    orders: list[tuple[Sequence[Block], Optional[list[int]]]] = [(blocks, step_down_order(blocks))]
+    orders.extend(
+        (block.method_blocks, method_step_down_order(block)) for block in blocks if isinstance(block, ClassBlock)
+    )
+    out_of_order = [(ordered_blocks, order) for ordered_blocks, order in orders if order is not None]
+    if not out_of_order:
+        return "unchanged"
+    if not all(moves_only_copies(source_lines, ordered_blocks, order) for ordered_blocks, order in out_of_order):
+        return "sorted"
+    status, _ = sort_top_level_blocks(source_lines, blocks)
+    return status
+
+
+def step_down_order(blocks: Sequence[Block]) -> Optional[list[int]]:
+    """Find the positions of top-level blocks in step-down order, or None if they're in that order already"""
+    return _step_down_order(blocks, _function_calls)
 
 
-def _sort_top_level_blocks(source_lines: list[str], syntax_tree: Module, context: Context) -> list[str]:
-    """Sort top-level functions/classes according to step-down rule."""
-    blocks = _find_top_level_blocks(syntax_tree, source_lines, context)
+def method_step_down_order(class_block: ClassBlock) -> Optional[list[int]]:
+    return _step_down_order(class_block.method_blocks, _method_calls)
 
-    if not blocks:
-        return source_lines
 
-    deps = _find_dependencies(blocks, _function_call_target)
-    sorted_blocks: list[Block] = []
+def moves_only_copies(source_lines: list[str], blocks: Sequence[Block], order: list[int]) -> bool:
+    """Check if putting blocks in order only swaps some with copies of themselves, i.e. blocks with the same lines.
+    Otherwise, sorting them changes the source. Ranges that overlap are taken as `resolve_overlapping_ranges` leaves
+    them.
+    """
+    starts: list[int] = []
+    running_end = 0
     for block in blocks:
-        _depth_first_sort(block, deps, sorted_blocks, [])
-    return _rearrange_lines(source_lines, blocks, sorted_blocks)
+        starts.append(max(block.start, running_end))
+        running_end = max(running_end, block.end)
+    return all(
+        position == moved
+        or source_lines[starts[position] : blocks[position].end] == source_lines[starts[moved] : blocks[moved].end]
+        for position, moved in enumerate(order)
+    )
 
 
-def _find_top_level_blocks(syntax_tree: Module, source_lines: list[str], context: Context):
+def _is_skipped(raw_source: bytes) -> bool:
+    with phase("skip_directive"):
+        return has_skip_directive(raw_source)
+
+
+def _cannot_be_reordered(raw_source: bytes) -> bool:
+    with phase("prefilter"):
+        return cannot_be_reordered(raw_source)
+
+
+def _find_blocks(
+    raw_source: bytes, python_file_path: str | Path | None, context: Optional[Context] = None
+) -> tuple[list[str], list[Block]]:
+    with phase("parse"):
+        source = decode_source(raw_source)
+        syntax_tree = parse(source, filename="<unknown>" if python_file_path is None else python_file_path)
+    source_lines = split_lines(source)
+    return source_lines, _build_blocks(syntax_tree, source_lines, python_file_path, context)
+
+
+def _build_blocks(
+    syntax_tree: Module, source_lines: list[str], python_file_path: str | Path | None, context: Optional[Context]
+) -> list[Block]:
+    if context is None:
+        with phase("gather_context"):
+            file_path = None if python_file_path is None else Path(python_file_path).resolve()
+            context = gather_context(syntax_tree, file_path)
+    with phase("build_blocks"):
+        return _find_top_level_blocks(syntax_tree, LineIndex(source_lines), context)
+
+
+def _find_top_level_blocks(syntax_tree: Module, lines: LineIndex, context: Context):
     blocks: list[Block] = []
     current_block: Union[Block, None] = None
     for node in syntax_tree.body:
-        if current_block is None or not current_block.append(node):
-            current_block = block_for(node, source_lines, context)
+        if current_block is None or not current_block.append(node, lines):
+            current_block = block_for(node, lines, context)
             blocks.append(current_block)
 
     resolve_overlapping_ranges(blocks)
     return blocks
 
 
-def _sort_methods_within_class(source_lines: list[str], class_def: ClassDef, context: Context) -> list[str]:
+def _sort_methods_within_class(modified_lines: SpannedLines, class_block: ClassBlock) -> tuple[int, SpannedLines]:
+    """Re-arrange the methods of a class. Returns where the class body starts, and its lines in sorted order."""
     # TODO: recursively sort methods within nested classes?
+    blocks = class_block.method_blocks
 
-    # Find methods
-    blocks = ClassBlock(class_def, source_lines, context).method_blocks
-
-    # Build dependency graph among methods
-    dependencies = _find_dependencies(blocks, _method_call_target)
+    # The class may have been moved next to different lines, which changes where its last method ends
+    if blocks[-1].end == class_block.end:
+        blocks[-1].extend(modified_lines)
 
     # Re-order methods as needed
-    sorted_blocks: list[Block] = []
-    for block in blocks:
-        _depth_first_sort(block, dependencies, sorted_blocks, [])
+    sorted_blocks = _sort_blocks(blocks, _method_calls)
 
-    # Copy lines from the original source, shifting the methods around as needed
-    return _rearrange_lines(
-        source_lines, blocks, sorted_blocks, start=find_start_of_class_body(class_def, source_lines)
-    )
+    # Take the lines from the top-level arrangement, shifting the methods around as needed
+    with phase("rearrange_lines"):
+        class_body_start = blocks[0].start
+        return class_body_start, _rearrange_lines(modified_lines, blocks, sorted_blocks, start=class_body_start)
+
+
+def _sort_blocks(blocks: Sequence[Block], find_calls: Callable[[Block], Iterable[str]]) -> list[Block]:
+    """Order blocks according to the step-down rule."""
+    with phase("dependency_graph"):
+        dependencies = _find_dependencies(blocks, find_calls)
+    with phase("depth_first_sort"):
+        return _depth_first_sort(blocks, dependencies)
+
+
+def _step_down_order(blocks: Sequence[Block], find_calls: Callable[[Block], Iterable[str]]) -> Optional[list[int]]:
+    positions = {id(block): position for position, block in enumerate(blocks)}
+    order = [positions[id(block)] for block in _sort_blocks(blocks, find_calls)]
+    return None if order == list(range(len(blocks))) else order
 
 
 def _find_dependencies(
     blocks: Collection[Block],
-    get_call_target: Callable[[Call], Optional[str]],
+    find_calls: Callable[[Block], Iterable[str]],
 ):
-    dependencies = AcyclicGraph()
-
     blocks_by_name: dict[str, list[Block]] = defaultdict(list)
     for block in blocks:
         for name in block.names:
             blocks_by_name[name].append(block)
 
+    # Edges are listed in order of precedence: one that would close a cycle is left out of the graph
+    edges: list[tuple[Block, Block]] = []
     for block in blocks:
         for name in block.find_predecessors():
             # XXX: filter out built-ins (e.g. str, int)?
             for predecessor_block in blocks_by_name.get(name, []):
-                dependencies.add_edge(_from=predecessor_block, to=block)
+                edges.append((predecessor_block, block))
 
     for block in blocks:
-        for call in block.find_calls():
-            target = get_call_target(call)
-            if target is not None:
-                for successor_block in blocks_by_name.get(target, []):
-                    if isinstance(successor_block, FunctionBlock) and not successor_block.is_pytest_fixture:
-                        dependencies.add_edge(_from=block, to=successor_block)
-
-    return dependencies
-
-
-def _depth_first_sort(
-    current_block: Block,
-    dependencies: AcyclicGraph,
-    sorted_blocks: list[Block],
-    path: list[Block],
-):
-    path.append(current_block)
-
-    # Move the current block last
-    try:
-        sorted_blocks.remove(current_block)
-    except ValueError:
-        pass
-    sorted_blocks.append(current_block)
-
-    for dependency in dependencies.get_successors(current_block):
-        if dependency not in path:
-            _depth_first_sort(dependency, dependencies, sorted_blocks, path)
-
-    path.pop()
+        for target in find_calls(block):
+            for successor_block in blocks_by_name.get(target, []):
+                if isinstance(successor_block, FunctionBlock) and not successor_block.is_pytest_fixture:
+                    edges.append((block, successor_block))
+
+    return AcyclicGraph(edges)
+
+
+def _depth_first_sort(blocks: Sequence[Block], dependencies: AcyclicGraph) -> list[Block]:
+    """Order the blocks like a depth-first walk that visits each block in turn, and then recursively its
+    dependencies, moving every block it visits to the end of the order.
+
+    A block ends up where it was visited last. Going through that walk backwards, each block is first seen after all
+    of its dependencies, so the walk backwards with a visited set is a post-order walk that stops at blocks it has
+    seen before. Its result, reversed, is the same order, in O(V + E) time and without recursion.
+    """
+    visited: set[Block] = set()
+    reversed_order: list[Block] = []
+    for root in reversed(blocks):
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, reversed(list(dependencies.get_successors(root))))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, reversed(list(dependencies.get_successors(successor)))))
+                    break
+            else:
+                stack.pop()
+                reversed_order.append(block)
+
+    reversed_order.reverse()
+    return reversed_order
 
 
 def _rearrange_lines(
-    source_lines: list[str], original_blocks: Collection[Block], sorted_blocks: list[Block], start: int = 0
-) -> list[str]:
-    def lines_of(block: Block) -> list[str]:
-        return source_lines[block.start : block.end]
-
-    result: list[str] = []
+    source_lines: SpannedLines, original_blocks: Collection[Block], sorted_blocks: list[Block], start: int = 0
+) -> SpannedLines:
+    """Arrange spans of the lines, with blocks in sorted order. The blocks are shifted to their new positions."""
+    result = SpannedLines()
+    placements: list[tuple[Block, int]] = []
     pos = start
     sort_idx = 0
 
+    def emit(block: Block):
+        placements.append((block, start + len(result)))
+        result.extend_spans(source_lines.spans_between(block.start, block.end))
+
     for orig_block in original_blocks:
-        result.extend(source_lines[pos : orig_block.start])  # filler is always emitted in original order
+        # filler is always emitted in original order
+        result.extend_spans(source_lines.spans_between(pos, orig_block.start))
         pos = orig_block.end
 
         if sort_idx >= len(sorted_blocks) or orig_block != sorted_blocks[sort_idx]:
@@ -183,29 +304,31 @@ def _rearrange_lines(
             # Blocks emitted early by the while-loop below also land here.
             continue
 
-        result.extend(lines_of(sorted_blocks[sort_idx]))
+        emit(sorted_blocks[sort_idx])
         sort_idx += 1
 
         # A block that originally appeared before this slot should follow it immediately,
         # because its own slot was already passed (and skipped) earlier in the walk.
         while sort_idx < len(sorted_blocks) and sorted_blocks[sort_idx].start < orig_block.start:
-            result.extend(lines_of(sorted_blocks[sort_idx]))
+            emit(sorted_blocks[sort_idx])
             sort_idx += 1
 
     if start == 0:
         # Include trailing content if we are doing the whole file
-        result.extend(source_lines[pos:])
+        result.extend_spans(source_lines.spans_between(pos, len(source_lines)))
 
-    result = _ensure_number_of_leading_blank_lines_remains_unchanged(
-        source_lines[start : start + len(result)], result
-    )
+    surplus = _count_surplus_leading_blank_lines(source_lines[start : start + len(result)], result)
+    if surplus > 0:
+        # We have additional leading blanks.
+        # Move them to the back and let the formatter take care of the rest.
+        result = SpannedLines([*result[surplus:].spans, ([""] * surplus, 0, surplus)])
+
+    for block, new_start in placements:
+        block.shift(new_start - surplus - block.start)
     return result
 
 
-def _ensure_number_of_leading_blank_lines_remains_unchanged(
-    original_lines: list[str],
-    rearranged_lines: list[str],
-):
+def _count_surplus_leading_blank_lines(original_lines: Sequence[str], rearranged_lines: Sequence[str]) -> int:
     assert len(original_lines) == len(rearranged_lines)
     num_leading_blanks_before = 0
     for _ in takewhile(is_blank, original_lines):
@@ -213,23 +336,14 @@ def _ensure_number_of_leading_blank_lines_remains_unchanged(
     num_leading_blanks_after = 0
     for _ in takewhile(is_blank, rearranged_lines):
         num_leading_blanks_after += 1
-    if num_leading_blanks_after > num_leading_blanks_before:
-        # We have additional leading blanks.
-        # Move them to the back and let the formatter take care of the rest.
-        diff = num_leading_blanks_after - num_leading_blanks_before
-        return list(rearranged_lines[diff:]) + [""] * diff
-    return rearranged_lines
+    return max(num_leading_blanks_after - num_leading_blanks_before, 0)
 
 
-def _method_call_target(node: Call) -> Optional[str]:
-    """Extract target name from self.method() calls."""
-    return (
-        node.func.attr
-        if isinstance(node.func, Attribute) and isinstance(node.func.value, Name) and node.func.value.id == "self"
-        else None
-    )
+def _method_calls(block: Block) -> Iterable[str]:
+    """Target names of self.method() calls."""
+    return block.find_method_calls()
 
 
-def _function_call_target(node: Call) -> Optional[str]:
-    """Extract target name from direct function() calls."""
-    return node.func.id if isinstance(node.func, Name) else None
+def _function_calls(block: Block) -> Iterable[str]:
+    """Target names of direct function() calls."""
+    return block.find_function_calls()
@@ -1,63 +1,93 @@
-from ast import AST, AsyncFunctionDef, ClassDef, FunctionDef, Module, stmt, walk
-from itertools import takewhile
+from ast import AST, AsyncFunctionDef, ClassDef, FunctionDef, stmt, walk
+from collections.abc import Sequence
 from typing import Protocol, TypeGuard, Union
 
 Function = Union[FunctionDef, AsyncFunctionDef]
 ClassOrFunction = Union[ClassDef, Function]
 
 
-def find_start_of_class_body(cls: ClassDef, source_lines: list[str]):
-    first_method = next(get_method_nodes(cls), None)
-    if first_method is not None:
-        return find_first_line(first_method, source_lines)
-
-    # HACK: this is not a great fallback, but it shouldn't matter since there are no methods to re-arrange
-    return cls.lineno
-
-
 def get_method_nodes(classNode: ClassDef):
     return (node for node in classNode.body if isinstance(node, (FunctionDef, AsyncFunctionDef)))
 
 
-def determine_line_range(class_or_function: ClassOrFunction, source_lines: list[str]) -> tuple[int, int]:
-    start = find_first_line(class_or_function, source_lines)
-    stop = find_last_line(class_or_function, source_lines)
+def determine_line_range(class_or_function: ClassOrFunction, lines: "LineIndex") -> tuple[int, int]:
+    start = find_first_line(class_or_function, lines)
+    stop = find_last_line(class_or_function, lines)
     return start, stop
 
 
-def find_first_line(node: stmt, source_lines: list[str]) -> int:
-    start = node.lineno
-    if isinstance(node, (ClassDef, FunctionDef, AsyncFunctionDef)):
-        start = min((d.lineno for d in node.decorator_list), default=start)
-
-    # AST line numbers are 1-based. Subtract one from the start position to make it 0-based
-    start -= 1
+def find_first_line(node: stmt, lines: "LineIndex", line_offset: int = 0) -> int:
+    """Find the 0-based line where the node starts, including decorators and leading comments.
+    `line_offset` is added to the node's line numbers, for nodes that have been moved since parsing.
+    """
+    return include_leading_comments(first_line_number(node), lines, line_offset)
 
-    # Check if there are any leading comments. If so, include them as well
-    preceding_lines = source_lines[0:start]
-    for _ in takewhile(is_comment, reversed(preceding_lines)):
-        start -= 1
-
-    return start
 
+def first_line_number(node: stmt) -> int:
+    """The 1-based line number where the node starts, including decorators"""
+    if isinstance(node, (ClassDef, FunctionDef, AsyncFunctionDef)):
+        return min((d.lineno for d in node.decorator_list), default=node.lineno)
+    return node.lineno
+
+
+def include_leading_comments(line_number: int, lines: "LineIndex", line_offset: int = 0) -> int:
+    """Find the 0-based line where the comments leading up to a 1-based line number start, if there are any.
+    `line_offset` is added to the line number, for nodes that have been moved since parsing.
+    """
+    return lines.comment_run_starts[line_number + line_offset - 1]
+
+
+def find_last_line(function: ClassOrFunction, lines: "LineIndex") -> int:
+    # A node's range includes all of its children, so there's no need to walk them
+    stop = function.end_lineno or max(getattr(n, "end_lineno", n.lineno) for n in walk(function) if has_lineno(n))
+    return _probe_trailing_lines(stop, function.col_offset, lines)
+
+
+def extend_last_line(stop: int, col_offset: int, source_lines: Sequence[str]) -> int:
+    """Re-evaluate the end of a range that was found by find_last_line, after the lines following it changed."""
+    # If trailing white-space has already been included, only more of it can follow
+    if stop == 0 or not is_blank(source_lines[stop - 1]):
+        while (
+            stop < len(source_lines)
+            and not is_blank(source_lines[stop])
+            and count_leading_whitespace_chars(source_lines[stop]) > col_offset
+        ):
+            stop += 1
+    while stop < len(source_lines) and is_blank(source_lines[stop]):
+        stop += 1
+    return stop
 
-def find_last_line(function: ClassOrFunction, source_lines: list[str]) -> int:
-    stop = max(getattr(n, "end_lineno", n.lineno) for n in walk(function) if has_lineno(n))
 
+def _probe_trailing_lines(stop: int, col_offset: int, lines: "LineIndex") -> int:
     # Probe a bit further until we find a blank line or one with less indentation than the function/class body
-    def should_continue(line: str):
-        return is_blank(line) is False and count_leading_whitespace_chars(line) > function.col_offset
-
-    subsequent_lines = source_lines[stop:]
-    for _ in takewhile(should_continue, subsequent_lines):
+    while stop < len(lines.is_blank) and not lines.is_blank[stop] and lines.indentation[stop] > col_offset:
         stop += 1
 
     # Now continue until we find a non-blank line, to include trailing white-space
-    subsequent_lines = source_lines[stop:]
-    for _ in takewhile(is_blank, subsequent_lines):
-        stop += 1
+    return lines.blank_run_ends[stop]
 
-    return stop
+
+class LineIndex:
+    """Facts about each line of a file, gathered in one pass, so ranges of lines can be found without re-scanning
+    the lines around them.
+    """
+
+    def __init__(self, lines: Sequence[str]):
+        self.lines = lines
+        self.is_blank = [is_blank(line) for line in lines]
+        self.indentation = [count_leading_whitespace_chars(line) for line in lines]
+
+        # For each position (up to and including the end), where the run of comment lines right before it starts
+        self.comment_run_starts = list(range(len(lines) + 1))
+        for index, line in enumerate(lines):
+            if is_comment(line):
+                self.comment_run_starts[index + 1] = self.comment_run_starts[index]
+
+        # For each position (up to and including the end), where the run of blank lines starting at it ends
+        self.blank_run_ends = list(range(len(lines) + 1))
+        for index in reversed(range(len(lines))):
+            if self.is_blank[index]:
+                self.blank_run_ends[index] = self.blank_run_ends[index + 1]
 
 
 def is_blank(line: str):
@@ -65,10 +95,7 @@ def is_blank(line: str):
 
 
 def count_leading_whitespace_chars(line: str):
-    count = 0
-    for _ in takewhile(lambda x: x == " " or x == "\t", line):
-        count += 1
-    return count
+    return len(line) - len(line.lstrip(" \t"))
 
 
 class HasLineNo(Protocol):
@@ -81,7 +108,3 @@ def has_lineno(node: AST) -> TypeGuard[HasLineNo]:
 
 def is_comment(line: str):
     return line.strip().startswith("#")
-
-
-def get_class_nodes(ast: Module):
-    return [node for node in ast.body if isinstance(node, ClassDef)]
@@ -6,6 +6,16 @@ def read_file(file_path: str | Path) -> str:
         return f.read()
 
 
+def read_file_bytes(file_path: str | Path) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def decode_source(source: bytes) -> str:
+    """Decode the raw contents of a file the same way read_file does, i.e. translating all newlines to \\n"""
+    return source.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
 def split_lines(source: str) -> list[str]:
     """Split source into lines the way Python's tokenizer does,
     as opposed to what str.splitlines does.
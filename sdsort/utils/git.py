@@ -0,0 +1,31 @@
+import os
+import subprocess
+
+
+class GitError(Exception):
+    pass
+
+
+def find_repository_root(directory: str = ".") -> str:
+    return _git(directory, "rev-parse", "--show-toplevel").rstrip("\n")
+
+
+def find_changed_files(base: str, directory: str = ".") -> list[str]:
+    """Find the files in the working tree that differ from `base`, including untracked files that aren't ignored.
+    Deleted files are left out. The paths are relative to the current directory.
+    """
+    top_level = find_repository_root(directory)
+    changed = _git(top_level, "diff", "--name-only", "-z", "--no-renames", "--diff-filter=d", base, "--")
+    untracked = _git(top_level, "ls-files", "--others", "--exclude-standard", "-z")
+    names = dict.fromkeys(name for name in (changed + untracked).split("\0") if name)
+    return [os.path.relpath(os.path.join(top_level, name)) for name in names]
+
+
+def _git(directory: str, *args: str) -> str:
+    try:
+        process = subprocess.run(["git", *args], cwd=directory, capture_output=True, text=True, encoding="utf-8")
+    except OSError as e:
+        raise GitError(f"could not run git: {e}") from e
+    if process.returncode != 0:
+        raise GitError(process.stderr.strip() or f"git {args[0]} failed")
+    return process.stdout
@@ -0,0 +1,94 @@
+import re
+from pathlib import Path
+from typing import Optional
+
+
+class GitIgnore:
+    """The patterns of a single .gitignore file, which apply to paths below the directory it's in.
+    Global excludes and .git/info/exclude aren't taken into account.
+    """
+
+    def __init__(self, directory: str, lines: list[str]):
+        self.directory = directory
+        self._rules: list[tuple[re.Pattern[str], bool, bool]] = []  # (pattern, is_negated, directories_only)
+        for line in lines:
+            rule = _parse_rule(line)
+            if rule is not None:
+                self._rules.append(rule)
+        self._any_rule = re.compile("|".join(f"(?:{pattern.pattern})" for pattern, _, _ in self._rules) or "(?!)")
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["GitIgnore"]:
+        try:
+            with open(Path(directory, ".gitignore"), encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        return cls(directory, lines)
+
+    def match(self, relative_path: str, is_dir: bool) -> Optional[bool]:
+        """Check whether a path, relative to the .gitignore and separated by /, is ignored.
+        Returns None if no pattern applies to it, which leaves the decision to .gitignore files further up.
+        """
+        if not self._any_rule.match(relative_path):
+            return None
+        for pattern, is_negated, directories_only in reversed(self._rules):
+            if directories_only and not is_dir:
+                continue
+            if pattern.match(relative_path):
+                return not is_negated
+        return None
+
+
+def _parse_rule(line: str) -> Optional[tuple[re.Pattern[str], bool, bool]]:
+    if not line.strip() or line.startswith("#"):
+        return None
+    if not line.endswith("\\ "):
+        line = line.rstrip()
+    is_negated = line.startswith("!")
+    if is_negated:
+        line = line[1:]
+    directories_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # A pattern containing a slash is relative to the .gitignore, otherwise it can match at any level below it
+    is_anchored = "/" in line
+    body = _translate(line.lstrip("/"))
+    prefix = "" if is_anchored else "(?:.*/)?"
+    return re.compile(f"{prefix}{body}$"), is_negated, directories_only
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob to a regular expression"""
+    result: list[str] = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            result.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            result.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            characters = pattern[i + 1 : end]
+            is_negated = characters.startswith(("!", "^"))
+            if is_negated:
+                characters = characters[1:]
+            characters = characters.replace("\\", "\\\\").replace("[", "\\[")
+            result.append("[" + ("^" if is_negated else "") + characters + "]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            result.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            result.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(result)
@@ -0,0 +1,85 @@
+"""Cumulative wall and CPU time per phase of processing files, as reported by --profile.
+
+Phases are only timed while profiling is switched on. Otherwise `phase` returns a shared no-op context manager,
+so instrumented code pays for little more than a function call.
+"""
+
+import time
+from typing import Optional
+
+
+class Profile:
+    def __init__(self):
+        # Wall time, CPU time and number of times each phase was entered, in the order the phases were first seen
+        self.phases: dict[str, list[float]] = {}
+
+    def add(self, name: str, wall: float, cpu: float, count: int = 1):
+        totals = self.phases.get(name)
+        if totals is None:
+            self.phases[name] = [wall, cpu, count]
+        else:
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += count
+
+    def merge(self, other: "Profile"):
+        for name, (wall, cpu, count) in other.phases.items():
+            self.add(name, wall, cpu, int(count))
+
+    def format_table(self) -> list[str]:
+        rows = [f"{'Phase':<24}{'Wall (s)':>10}{'CPU (s)':>10}{'Count':>9}"]
+        for name, (wall, cpu, count) in self.phases.items():
+            rows.append(f"{name:<24}{wall:>10.3f}{cpu:>10.3f}{int(count):>9}")
+        total_wall = sum(wall for wall, _, _ in self.phases.values())
+        total_cpu = sum(cpu for _, cpu, _ in self.phases.values())
+        rows.append(f"{'total':<24}{total_wall:>10.3f}{total_cpu:>10.3f}")
+        return rows
+
+
+class _Phase:
+    __slots__ = ("_profile", "_name", "_wall", "_cpu")
+
+    def __init__(self, profile: Profile, name: str):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def __exit__(self, *args):
+        self._profile.add(self._name, time.perf_counter() - self._wall, time.process_time() - self._cpu)
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+# The profile of the current process, if profiling is on
+_active: Optional[Profile] = None
+
+
+def phase(name: str) -> "_Phase | _NoPhase":
+    """Time the code in a `with` block as part of the named phase. Phases shouldn't be nested."""
+    return _NO_PHASE if _active is None else _Phase(_active, name)
+
+
+def start_profiling() -> Profile:
+    global _active
+    _active = Profile()
+    return _active
+
+
+def stop_profiling():
+    global _active
+    _active = None
+
+
+def active_profile() -> Optional[Profile]:
+    return _active
@@ -0,0 +1,103 @@
+from bisect import bisect_right
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Union, overload
+
+# A range of lines in a list of lines: the list, the start and the (exclusive) end
+Span = tuple[Sequence[str], int, int]
+
+
+class SpannedLines(Sequence[str]):
+    """Lines made up of spans of other lists of lines, which aren't copied.
+
+    Slicing gives the spans that cover the slice, so re-arrangements of re-arrangements stay spans over the
+    original lines, and the lines are only copied when they're finally needed in one piece.
+    """
+
+    def __init__(self, spans: Iterable[Span] = ()):
+        self._spans: list[Span] = []
+        self._starts: list[int] = []  # the position of each span within these lines
+        self._length = 0
+        self.extend_spans(spans)
+
+    @classmethod
+    def of(cls, lines: Sequence[str]) -> "SpannedLines":
+        if isinstance(lines, SpannedLines):
+            return lines
+        return cls([(lines, 0, len(lines))])
+
+    @property
+    def spans(self) -> list[Span]:
+        return self._spans
+
+    def __len__(self) -> int:
+        return self._length
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "SpannedLines": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, "SpannedLines"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                raise ValueError("spanned lines can only be sliced contiguously")
+            return SpannedLines(self.spans_between(start, stop))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("line index out of range")
+        span_index = bisect_right(self._starts, index) - 1
+        lines, start, _ = self._spans[span_index]
+        return lines[start + index - self._starts[span_index]]
+
+    def __iter__(self) -> Iterator[str]:
+        for lines, start, end in self._spans:
+            for index in range(start, end):
+                yield lines[index]
+
+    def spans_between(self, start: int, stop: int) -> Iterator[Span]:
+        """The spans that make up the lines from start up to stop, trimmed to fit"""
+        if start >= stop:
+            return
+        span_index = bisect_right(self._starts, start) - 1
+        while span_index < len(self._spans) and self._starts[span_index] < stop:
+            lines, span_start, span_end = self._spans[span_index]
+            offset = self._starts[span_index]
+            yield (
+                lines,
+                span_start + max(start - offset, 0),
+                span_start + min(stop - offset, span_end - span_start),
+            )
+            span_index += 1
+
+    def replace(self, replacements: Iterable[tuple[int, "SpannedLines"]]) -> "SpannedLines":
+        """Substitute ranges of these lines by as many others, given as (start position, lines) in order"""
+        spans: list[Span] = []
+        position = 0
+        for start, lines in replacements:
+            spans.extend(self.spans_between(position, start))
+            spans.extend(lines.spans)
+            position = start + len(lines)
+        spans.extend(self.spans_between(position, self._length))
+        return SpannedLines(spans)
+
+    def extend_spans(self, spans: Iterable[Span]):
+        for span in spans:
+            self.append_span(span)
+
+    def append_span(self, span: Span):
+        lines, start, end = span
+        if end <= start:
+            return
+        if self._spans:
+            # Merge contiguous spans, so the number of spans only grows with the number of moves
+            last_lines, last_start, last_end = self._spans[-1]
+            if last_lines is lines and last_end == start:
+                self._spans[-1] = (lines, last_start, end)
+                self._length += end - start
+                return
+        self._spans.append(span)
+        self._starts.append(self._length)
+        self._length += end - start
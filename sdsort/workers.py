@@ -0,0 +1,203 @@
+"""Processing of files and sources, either in the current process or spread over a pool of worker processes."""
+
+import os
+from collections.abc import Iterable, Iterator
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from .cache import ResultCache, content_digest
+from .context import Context
+from .sort import ResultType, Status, check_step_down_order, sort_source, step_down_sort
+from .utils.file import read_file_bytes
+from .utils.profile import Profile, active_profile, phase, start_profiling, stop_profiling
+
+if TYPE_CHECKING:
+    from multiprocessing.synchronize import Event
+
+# Starting a worker process costs about as much as processing this many files
+_MIN_FILES_PER_WORKER = 16
+
+# How many files a worker is handed at a time when results are wanted as soon as they're known
+_MAX_UNORDERED_CHUNK_SIZE = 8
+
+# How many sources each worker process is handed ahead of time, so streams of sources aren't read all at once
+_SOURCES_PER_WORKER = 4
+
+# The cache of the current worker process. Workers only read from it, the parent process records the results.
+_worker_cache: Optional[ResultCache] = None
+
+# Set by the parent process when it no longer needs the results of the files the workers have been handed
+_worker_stop: Optional["Event"] = None
+
+FileResult = tuple[Status, Optional[str]]
+"""The status of a processed file, and the digest of its contents if the cache is in use"""
+
+
+def process_files(
+    file_paths: list[str], check: bool, cache: Optional[ResultCache], jobs: Optional[int]
+) -> Iterator[FileResult]:
+    """Sort (or check) the files, yielding their results in the same order as the paths.
+    `jobs` is the number of worker processes to use, or None to decide based on the number of files and CPUs.
+    Modified files are written by the workers, so only statuses have to be sent back.
+    """
+    workers = _count_workers(jobs, len(file_paths))
+    if workers <= 1:
+        yield from map(partial(_process_file, check=check, cache=cache), file_paths)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor  # not needed for a few files, which is the common case
+
+    chunk_size = max(1, len(file_paths) // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=_initialize_worker, initargs=(cache is not None,)) as executor:
+        profile = active_profile()
+        if profile is None:
+            yield from executor.map(
+                partial(_process_file_in_worker, check=check), file_paths, chunksize=chunk_size
+            )
+            return
+        # Each worker profiles its files, and the parent adds them up
+        for result, file_profile in executor.map(
+            partial(_profile_file_in_worker, check=check), file_paths, chunksize=chunk_size
+        ):
+            profile.merge(file_profile)
+            yield result
+
+
+def process_files_as_completed(
+    file_paths: list[str], check: bool, cache: Optional[ResultCache], jobs: Optional[int]
+) -> Iterator[tuple[str, FileResult]]:
+    """Sort (or check) the files like `process_files`, but yield each path with its result as soon as it's known.
+    Closing the iterator early cancels the files that haven't been started, and has the workers stop after the
+    file they're on, so a caller looking for a single result doesn't wait for the rest.
+    """
+    workers = _count_workers(jobs, len(file_paths))
+    if workers <= 1:
+        for file_path in file_paths:
+            yield file_path, _process_file(file_path, check, cache)
+        return
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    stop = multiprocessing.Event()
+    chunk_size = max(1, min(len(file_paths) // (workers * 4), _MAX_UNORDERED_CHUNK_SIZE))
+    profile = active_profile()
+    with ProcessPoolExecutor(
+        workers, initializer=_initialize_worker, initargs=(cache is not None, stop)
+    ) as executor:
+        chunks = {
+            executor.submit(_process_chunk_in_worker, chunk, check, profile is not None): chunk
+            for chunk in (file_paths[i : i + chunk_size] for i in range(0, len(file_paths), chunk_size))
+        }
+        try:
+            for future in as_completed(chunks):
+                results, chunk_profile = future.result()
+                if profile is not None and chunk_profile is not None:
+                    profile.merge(chunk_profile)
+                yield from zip(chunks[future], results)
+        finally:
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+
+
+def sort_many(
+    sources: Iterable[tuple[str | Path, str]], *, context: Optional[Context] = None, jobs: Optional[int] = 1
+) -> Iterator[tuple[str | Path, ResultType]]:
+    """Sort sources that are already in memory, given as (name, source) pairs, yielding each name with its result
+    as soon as it's known. The names are used as the filenames of `sort_source`, as is the context.
+    `jobs` is the number of worker processes to use, or None for one per CPU. With 1, the sources are sorted in
+    the current process, in order. Only a few sources per worker are taken ahead, so `sources` can be a stream.
+    """
+    workers = count_cpus() if jobs is None else jobs
+    if workers <= 1:
+        for name, source in sources:
+            yield name, sort_source(source, filename=name, context=context)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+    remaining_sources = iter(sources)
+    pending: dict[Future[ResultType], str | Path] = {}
+    with ProcessPoolExecutor(workers) as executor:
+        try:
+            while True:
+                for name, source in islice(remaining_sources, workers * _SOURCES_PER_WORKER - len(pending)):
+                    pending[executor.submit(sort_source, source, filename=name, context=context)] = name
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def _count_workers(jobs: Optional[int], num_files: int) -> int:
+    if jobs is None:
+        jobs = min(count_cpus(), -(-num_files // _MIN_FILES_PER_WORKER))
+    return min(jobs, num_files)
+
+
+def count_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _initialize_worker(use_cache: bool, stop: Optional["Event"] = None):
+    # Loading this function imports sdsort in the worker, so that's done before it's handed any files
+    global _worker_cache, _worker_stop
+    _worker_cache = ResultCache.open() if use_cache else None
+    _worker_stop = stop
+
+
+def _process_file_in_worker(file_path: str, check: bool) -> FileResult:
+    return _process_file(file_path, check, _worker_cache)
+
+
+def _profile_file_in_worker(file_path: str, check: bool) -> tuple[FileResult, Profile]:
+    profile = start_profiling()
+    try:
+        return _process_file(file_path, check, _worker_cache), profile
+    finally:
+        stop_profiling()
+
+
+def _process_chunk_in_worker(
+    file_paths: list[str], check: bool, profile: bool
+) -> tuple[list[FileResult], Optional[Profile]]:
+    """Process the files in turn, leaving out the rest once the parent process has stopped waiting for them"""
+    chunk_profile = start_profiling() if profile else None
+    results: list[FileResult] = []
+    try:
+        for file_path in file_paths:
+            if _worker_stop is not None and _worker_stop.is_set():
+                break
+            results.append(_process_file(file_path, check, _worker_cache))
+    finally:
+        if profile:
+            stop_profiling()
+    return results, chunk_profile
+
+
+def _process_file(file_path: str, check: bool, cache: Optional[ResultCache]) -> FileResult:
+    with phase("read"):
+        raw_source = read_file_bytes(file_path)
+    digest = None
+    if cache is not None:
+        with phase("cache"):
+            digest = content_digest(raw_source)
+            status = cache.get_by_digest(file_path, digest)
+        if status is not None:
+            return status, digest
+
+    if check:
+        return check_step_down_order(file_path, raw_source=raw_source), digest
+
+    status, modified_source = step_down_sort(file_path, raw_source=raw_source)
+    if modified_source is not None:
+        with phase("write"), open(file_path, "w", encoding="utf-8") as file:
+            file.write(modified_source)
+    return status, digest
@@ -0,0 +1,11 @@
+class Greeter(Base):
+    def greet(self):
+        return "Hello"
+    def run(self):
+        return self.greet()
+Base = object
+
+# A dangling comment, which doesn't belong to any definition
+
+def main():
+    Greeter().run()
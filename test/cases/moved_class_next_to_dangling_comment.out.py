@@ -0,0 +1,14 @@
+Base = object
+
+
+class Greeter(Base):
+    def run(self):
+        return self.greet()
+
+    def greet(self):
+        return "Hello"
+# A dangling comment, which doesn't belong to any definition
+
+
+def main():
+    Greeter().run()
@@ -0,0 +1,11 @@
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep tests from reading or writing the user's result cache."""
+    cache_dir = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("SDSORT_CACHE_DIR", str(cache_dir))
+    return cache_dir
@@ -0,0 +1,99 @@
+"""Generator of synthetic modules, for benchmarking sdsort on large inputs with a known shape."""
+
+import random
+from dataclasses import dataclass
+
+
+@dataclass
+class ModuleShape:
+    functions: int = 100
+    """Number of top-level functions"""
+    classes: int = 0
+    methods_per_class: int = 10
+    calls_per_function: int = 1
+    """Calls from each function (and method) to ones after it in step-down order. The first one continues its call
+    chain, if any."""
+    chain_depth: int = 1
+    """Length of the call chains the functions (and methods) are split into"""
+    recursive_chains: bool = False
+    """Call the first function (or method) of each call chain from its last, which makes the chain a cycle"""
+    decorators: bool = False
+    """Decorate every function with a decorator defined in the module"""
+    annotated_statements: int = 0
+    """Module-level annotated assignments, which refer to the classes"""
+    nested_statements: int = 1
+    """Module-level assignments of deeply nested expressions, like tables in generated code"""
+    nesting_depth: int = 0
+    """How deeply those expressions nest, or 0 for none at all"""
+    seed: int = 0
+
+    @property
+    def blocks(self) -> int:
+        """The approximate number of top-level blocks in the module"""
+        return self.functions + self.classes + self.annotated_statements + (1 if self.decorators else 0)
+
+
+def generate_module(shape: ModuleShape) -> str:
+    """Generate a module in reverse step-down order, i.e. with callees before their callers, so sdsort has to move
+    just about every block.
+    """
+    rng = random.Random(shape.seed)
+    parts = ["from typing import Optional\n"]
+    if shape.decorators:
+        parts.append("def decorate(function):\n    return function\n")
+
+    for index in reversed(range(shape.classes)):
+        parts.append(_generate_class(index, shape, rng))
+
+    function_names = [f"function_{index}" for index in range(shape.functions)]
+    for index in reversed(range(shape.functions)):
+        callees = _pick_callees(index, shape.functions, shape, rng)
+        body = "".join(f"    {function_names[callee]}()\n" for callee in callees) or "    pass\n"
+        decorator = "@decorate\n" if shape.decorators else ""
+        annotation = f"value: Class_{index % shape.classes}" if shape.classes else "value: int"
+        parts.append(f"{decorator}def {function_names[index]}({annotation}) -> None:\n{body}")
+
+    for index in range(shape.nested_statements if shape.nesting_depth else 0):
+        parts.append(f"nested_{index} = {_generate_nested_expression(shape.nesting_depth, shape.functions)}\n")
+
+    for index in range(shape.annotated_statements):
+        referenced = f"Class_{index % shape.classes}" if shape.classes else "int"
+        parts.append(f"annotated_{index}: dict[str, Optional[{referenced}]] = {{}}\n")
+
+    return "\n\n".join(parts)
+
+
+def _generate_class(class_index: int, shape: ModuleShape, rng: random.Random) -> str:
+    lines = [f"class Class_{class_index}:\n"]
+    for index in reversed(range(shape.methods_per_class)):
+        callees = _pick_callees(index, shape.methods_per_class, shape, rng)
+        body = "".join(f"        self.method_{callee}()\n" for callee in callees) or "        pass\n"
+        lines.append(f"    def method_{index}(self) -> None:\n{body}")
+    return "\n".join(lines)
+
+
+def _generate_nested_expression(depth: int, functions: int) -> str:
+    """A chain of binary operations, which nests without brackets (Python limits those to 200 levels).
+    It calls the first function, if any, so the statement depends on it.
+    """
+    operands = [f"value_{index}" for index in range(depth)]
+    if functions:
+        operands[0] = "function_0()"
+    return " + ".join(operands)
+
+
+def _pick_callees(index: int, count: int, shape: ModuleShape, rng: random.Random) -> list[int]:
+    """Pick the functions (or methods) called by the one at `index`, out of `count` of them.
+
+    Like in real code, the call graph is mostly acyclic, and any cycles are small.
+    """
+    callees: list[int] = []
+    if (index + 1) % shape.chain_depth != 0 and index + 1 < count:
+        callees.append(index + 1)
+    while len(callees) < shape.calls_per_function and index + 1 < count:
+        callees.append(rng.randrange(index + 1, count))
+    chain_start = index - index % shape.chain_depth
+    is_chain_end = (index + 1) % shape.chain_depth == 0 or index + 1 == count
+    if shape.recursive_chains and is_chain_end and index > chain_start:
+        callees.append(chain_start)
+    return callees
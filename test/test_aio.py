@@ -0,0 +1,78 @@
+import asyncio
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import sdsort.aio
+from sdsort import asort_file, asort_many, step_down_sort
+from sdsort.utils.file import read_file
+
+TEST_CASES_DIR = Path("test", "cases")
+
+
+@pytest.mark.parametrize("write", [False, True])
+def test_asort_file_gives_the_same_result_as_sorting_the_file(tmp_path: Path, write: bool):
+    # Arrange
+    target_path = Path(shutil.copy(TEST_CASES_DIR / "comments.in.py", tmp_path))
+    expected_result = step_down_sort(target_path)
+
+    # Act
+    result = asyncio.run(asort_file(target_path, write=write))
+
+    # Assert
+    assert result == expected_result
+    expected_file = "comments.out.py" if write else "comments.in.py"
+    assert read_file(target_path) == read_file(TEST_CASES_DIR / expected_file)
+
+
+def test_asort_many_sorts_on_a_process_pool(tmp_path: Path):
+    # Arrange
+    test_cases = ["comments", "dataclass", "single_class", "top_level_functions", "skip_file_directive", "jpe"]
+    paths = [Path(shutil.copy(TEST_CASES_DIR / f"{tc}.in.py", tmp_path)) for tc in test_cases]
+
+    async def sort_all():
+        with ProcessPoolExecutor(2) as executor:
+            return {path: result async for path, result in asort_many(paths, concurrency=3, executor=executor)}
+
+    # Act
+    results = asyncio.run(sort_all())
+
+    # Assert
+    assert results == {path: step_down_sort(path) for path in paths}
+
+
+def test_asort_many_yields_results_in_completion_order_with_bounded_concurrency(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Arrange
+    paths = [Path(shutil.copy(TEST_CASES_DIR / "comments.in.py", tmp_path / f"{index}.py")) for index in range(6)]
+    lock = threading.Lock()
+    in_progress = 0
+    max_in_progress = 0
+
+    def slow_sort(python_file_path: Path, raw_source: bytes):
+        nonlocal in_progress, max_in_progress
+        with lock:
+            in_progress += 1
+            max_in_progress = max(max_in_progress, in_progress)
+        time.sleep(0.2 if python_file_path == paths[0] else 0.01)
+        with lock:
+            in_progress -= 1
+        return step_down_sort(python_file_path, raw_source=raw_source)
+
+    monkeypatch.setattr(sdsort.aio, "step_down_sort", slow_sort)
+
+    async def sort_all():
+        return [path async for path, _ in asort_many(paths, concurrency=2)]
+
+    # Act
+    sorted_paths = asyncio.run(sort_all())
+
+    # Assert
+    assert sorted(sorted_paths) == sorted(paths)
+    assert sorted_paths[-1] == paths[0], "The slowest file should come last"
+    assert max_in_progress == 2
@@ -0,0 +1,347 @@
+"""Scaling benchmarks, which fail when a phase of sorting grows much faster than the number of blocks, or than
+the nesting depth of a statement, and memory benchmarks, which fail when sorting a file takes much more memory
+than the file itself. The language server benchmark replays typing into a large file, and fails when
+the server takes too long to answer the editor after a keystroke.
+
+They take several minutes, so they only run when SDSORT_BENCHMARK is set:
+
+    SDSORT_BENCHMARK=1 pytest test/test_benchmark.py -s
+"""
+
+import io
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pytest
+from synthetic import ModuleShape, generate_module
+
+import sdsort.sort as sort
+from sdsort.block import ClassBlock
+from sdsort.format import normalize_blank_lines
+from sdsort.graph import AcyclicGraph
+from sdsort.lsp import LanguageServer
+from sdsort.utils.spans import SpannedLines
+
+SIZES = [int(size) for size in os.environ.get("SDSORT_BENCHMARK_SIZES", "10,100,1000,10000,50000").split(",")]
+
+# n log n fits within this over the sizes above. Quadratic growth is 2, and exponential growth is off the charts.
+MAX_GROWTH_EXPONENT = 1.3
+
+# A single run of a phase faster than this is dominated by noise, so sorting is repeated until each phase has taken
+# this long in total, and the phases are timed per run on average
+MIN_MEASURED_SECONDS = 0.005
+
+# How long to keep repeating sorting for phases that take next to no time, like sorting the one block of a class
+MAX_REPEATING_SECONDS = 2
+
+# A size that takes longer than this has grown far beyond what the fit allows
+TIMEOUT_SECONDS = 120
+
+SHAPES: dict[str, Callable[[int], ModuleShape]] = {
+    "independent_functions": lambda n: ModuleShape(functions=n, calls_per_function=0),
+    "sparse_calls": lambda n: ModuleShape(functions=n, calls_per_function=1),
+    "dense_calls": lambda n: ModuleShape(functions=n, calls_per_function=4),
+    "mutual_recursion": lambda n: ModuleShape(
+        functions=n, calls_per_function=2, chain_depth=4, recursive_chains=True
+    ),
+    "deep_chain": lambda n: ModuleShape(functions=n, calls_per_function=1, chain_depth=n),
+    "large_class": lambda n: ModuleShape(functions=0, classes=1, methods_per_class=n, calls_per_function=2),
+    "decorated_and_annotated": lambda n: ModuleShape(
+        functions=n // 2,
+        classes=max(1, n // 20),
+        methods_per_class=5,
+        decorators=True,
+        annotated_statements=n // 2,
+    ),
+}
+
+# Python 3.11 can't parse expressions much deeper than 3000 levels
+DEPTHS = [100, 300, 1000, 2500]
+
+NESTED_SHAPES: dict[str, Callable[[int], ModuleShape]] = {
+    "deeply_nested_statement": lambda depth: ModuleShape(functions=10, nesting_depth=depth),
+    "many_nested_statements": lambda depth: ModuleShape(functions=10, nested_statements=20, nesting_depth=depth),
+}
+
+# Number of blocks in the files the memory benchmarks sort
+MEMORY_BENCHMARK_SIZE = 20000
+
+# How much more memory than the size of the file sorting it may take at its peak. Parsing takes most of it.
+MAX_PEAK_MEMORY_PER_SOURCE_BYTE = 200
+
+# How much more memory than the size of the file the blocks may hold on to, once the AST has been analyzed
+MAX_BLOCK_MEMORY_PER_SOURCE_BYTE = 20
+
+# About 4500 lines, already sorted, so every keystroke is checked all the way through
+LANGUAGE_SERVER_SHAPE = ModuleShape(
+    functions=400, classes=20, methods_per_class=25, calls_per_function=2, decorators=True
+)
+
+# Lines typed into the functions and methods of the file, one keystroke at a time
+TYPED_LINES = 100
+
+# Editors ask for code actions after each keystroke, which have to be answered within a frame or two
+MAX_P99_KEYSTROKE_SECONDS = 0.020
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("SDSORT_BENCHMARK"), reason="set SDSORT_BENCHMARK=1 to run the benchmarks"
+)
+
+
+@pytest.mark.parametrize("shape_name", SHAPES)
+def test_sorting_scales_with_the_number_of_blocks(shape_name: str):
+    # Act
+    timings = _measure_sizes(SHAPES[shape_name], SIZES, "blocks")
+
+    # Assert
+    _assert_growth_is_bounded(shape_name, timings)
+
+
+@pytest.mark.parametrize("shape_name", NESTED_SHAPES)
+def test_sorting_scales_with_the_nesting_depth(shape_name: str):
+    # Act
+    timings = _measure_sizes(NESTED_SHAPES[shape_name], DEPTHS, "levels of nesting")
+
+    # Assert
+    _assert_growth_is_bounded(shape_name, timings)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="peak memory is measured with the POSIX-only resource module")
+@pytest.mark.parametrize("shape_name", ["sparse_calls", "large_class", "decorated_and_annotated"])
+def test_memory_is_proportional_to_the_file_size(shape_name: str, tmp_path: Path):
+    # Arrange
+    source = generate_module(SHAPES[shape_name](MEMORY_BENCHMARK_SIZE)).encode()
+    file_path = tmp_path / "synthetic.py"
+    file_path.write_bytes(source)
+
+    # Act
+    result = _run_in_subprocess(_measure_memory, file_path)
+
+    # Assert
+    assert result is not None, f"sorting {MEMORY_BENCHMARK_SIZE} blocks took more than {TIMEOUT_SECONDS}s"
+    peak_memory, block_memory = result
+    print(
+        f"\n{shape_name}: {len(source) / 2**20:.1f} MiB file, peak RSS +{peak_memory / 2**20:.1f} MiB, "
+        f"blocks {block_memory / 2**20:.1f} MiB"
+    )
+    assert peak_memory / len(source) < MAX_PEAK_MEMORY_PER_SOURCE_BYTE
+    assert block_memory / len(source) < MAX_BLOCK_MEMORY_PER_SOURCE_BYTE
+
+
+def test_language_server_keeps_up_with_typing():
+    # Arrange
+    source = sort.sort_source(generate_module(LANGUAGE_SERVER_SHAPE))[1]
+    assert source is not None
+    uri = "file:///synthetic.py"
+    server = LanguageServer(io.BytesIO(), io.BytesIO())
+    server.respond(
+        "initialize",
+        {"capabilities": {"textDocument": {"codeAction": {"resolveSupport": {"properties": ["edit"]}}}}},
+    )
+    server.respond("textDocument/didOpen", {"textDocument": {"uri": uri, "text": source}})
+    lines = source.split("\n")
+    rng = random.Random(0)
+    timings = []
+
+    # Act
+    for _ in range(TYPED_LINES):
+        line = rng.choice([i for i, text in enumerate(lines) if text.lstrip().startswith("def ")])
+        indentation = lines[line][: len(lines[line]) - len(lines[line].lstrip())] + "    "
+        if indentation == "    ":
+            typed_line = f"function_{rng.randrange(LANGUAGE_SERVER_SHAPE.functions)}(value)"
+        else:
+            typed_line = f"self.method_{rng.randrange(LANGUAGE_SERVER_SHAPE.methods_per_class)}()"
+        lines.insert(line + 1, "")
+        column = len(lines[line])
+        # Typing goes through states that can't be parsed, like `self.` and an open bracket
+        for character in f"\n{indentation}{typed_line}":
+            start = time.perf_counter()
+            server.respond("textDocument/didChange", _insertion(uri, line, column, character))
+            server.respond("textDocument/codeAction", {"textDocument": {"uri": uri}, "range": _whole_line(line)})
+            timings.append(time.perf_counter() - start)
+            line, column = (line + 1, 0) if character == "\n" else (line, column + 1)
+        lines[line] = f"{indentation}{typed_line}"
+
+    # Assert
+    timings.sort()
+    p50, p99 = timings[len(timings) // 2], timings[len(timings) * 99 // 100]
+    print(f"\n{len(lines)} lines, {len(timings)} keystrokes: p50 {p50 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms")
+    assert p99 < MAX_P99_KEYSTROKE_SECONDS
+
+
+def _insertion(uri: str, line: int, column: int, text: str) -> dict[str, Any]:
+    position = {"line": line, "character": column}
+    return {
+        "textDocument": {"uri": uri},
+        "contentChanges": [{"range": {"start": position, "end": position}, "text": text}],
+    }
+
+
+def _whole_line(line: int) -> dict[str, Any]:
+    return {"start": {"line": line, "character": 0}, "end": {"line": line + 1, "character": 0}}
+
+
+def _measure_sizes(shape_of_size: Callable[[int], ModuleShape], sizes: list[int], unit: str):
+    timings: dict[str, dict[int, float]] = defaultdict(dict)
+    for size in sizes:
+        phases = _run_in_subprocess(_measure_phases, shape_of_size(size))
+        if phases is None:
+            pytest.fail(f"sorting {size} {unit} took more than {TIMEOUT_SECONDS}s")
+        for phase, seconds in phases.items():
+            timings[phase][size] = seconds
+    return timings
+
+
+def _assert_growth_is_bounded(shape_name: str, timings: dict[str, dict[int, float]]):
+    print(f"\n{shape_name}")
+    exponents = {phase: _growth_exponent(by_size) for phase, by_size in timings.items()}
+    for phase, by_size in timings.items():
+        measurements = ", ".join(f"{size}: {seconds * 1000:.3f}ms" for size, seconds in by_size.items())
+        exponent = exponents[phase]
+        print(f"  {phase:<22} exponent {'-' if exponent is None else f'{exponent:.2f}'} ({measurements})")
+    too_steep = {
+        phase: round(exponent, 2)
+        for phase, exponent in exponents.items()
+        if exponent is not None and exponent > MAX_GROWTH_EXPONENT
+    }
+    assert not too_steep, f"{shape_name}: running time grows faster than n^{MAX_GROWTH_EXPONENT}"
+    unfitted = [phase for phase, exponent in exponents.items() if exponent is None]
+    assert not unfitted, f"{shape_name}: {unfitted} weren't measured at enough sizes to fit their growth"
+
+
+def _growth_exponent(seconds_by_size: dict[int, float]) -> Optional[float]:
+    """Fit seconds = c * size^k by least squares on a log-log scale, and return k. Returns None if there are too
+    few sizes to fit.
+    """
+    points = [(math.log(size), math.log(seconds)) for size, seconds in seconds_by_size.items()]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance
+
+
+def _run_in_subprocess(measure: Callable[[Any, Any], None], argument: Any) -> Any:
+    """Measure in a fresh process, which can be stopped if it takes too long. Returns None if it was stopped."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.SimpleQueue()
+    process = context.Process(target=measure, args=(argument, queue))
+    process.start()
+    process.join(TIMEOUT_SECONDS)
+    if process.is_alive():
+        process.kill()
+        process.join()
+        return None
+    if queue.empty():
+        raise RuntimeError(f"the benchmark process exited with code {process.exitcode}")
+    result = queue.get()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def _measure_phases(shape: ModuleShape, queue) -> None:
+    """Time the phases of sorting the module, in seconds per run, over as many runs as they take to measure"""
+    try:
+        raw_source = generate_module(shape).encode()
+        totals: dict[str, float] = defaultdict(float)
+        runs = 0
+        start = time.perf_counter()
+        while not totals or (
+            min(totals.values()) < MIN_MEASURED_SECONDS and time.perf_counter() - start < MAX_REPEATING_SECONDS
+        ):
+            for phase, seconds in _time_phases(raw_source).items():
+                totals[phase] += seconds
+            runs += 1
+        queue.put({phase: total / runs for phase, total in totals.items()})
+    except BaseException as e:
+        queue.put(e)
+
+
+def _measure_memory(file_path: Path, queue) -> None:
+    """Measure how far sorting a file raises the peak memory use of the process, over what it uses already,
+    then how much memory its blocks (and lines) hold on to.
+    """
+    try:
+        baseline = _peak_memory()
+        sort.step_down_sort(file_path)
+        peak_memory = _peak_memory() - baseline
+
+        tracemalloc.start()
+        source_lines, blocks = sort._find_blocks(file_path.read_bytes(), file_path)
+        block_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        queue.put((peak_memory, block_memory))
+    except BaseException as e:
+        queue.put(e)
+
+
+def _peak_memory() -> int:
+    import resource  # POSIX-only, so importing it at the top would keep the other benchmarks from running on Windows
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+def _time_phases(raw_source: bytes) -> dict[str, float]:
+    """Time the phases of step_down_sort one by one, then the whole of it."""
+    timings: dict[str, float] = defaultdict(float)
+    build_graph = AcyclicGraph.__init__
+
+    def timed_build_graph(self: AcyclicGraph, *args, **kwargs) -> None:
+        start = time.perf_counter()
+        try:
+            build_graph(self, *args, **kwargs)
+        finally:
+            timings["build_graph"] += time.perf_counter() - start
+
+    AcyclicGraph.__init__ = timed_build_graph
+    try:
+        start = time.perf_counter()
+        source_lines, blocks = sort._find_blocks(raw_source, "synthetic.py")
+        timings["find_blocks"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dependencies = sort._find_dependencies(blocks, sort._function_calls)
+        timings["find_dependencies"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sorted_blocks = sort._depth_first_sort(blocks, dependencies)
+        timings["depth_first_sort"] = time.perf_counter() - start
+    finally:
+        AcyclicGraph.__init__ = build_graph
+
+    start = time.perf_counter()
+    modified_lines = sort._rearrange_lines(SpannedLines.of(source_lines), blocks, sorted_blocks)
+    timings["rearrange_lines"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    class_bodies = [
+        sort._sort_methods_within_class(modified_lines, block)
+        for block in sorted_blocks
+        if isinstance(block, ClassBlock) and block.method_blocks
+    ]
+    timings["sort_methods"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    final_lines = list(modified_lines.replace(class_bodies))
+    timings["rearrange_lines"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    normalize_blank_lines(final_lines, sorted_blocks)
+    timings["normalize_blank_lines"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sort.step_down_sort("synthetic.py", raw_source=raw_source)
+    timings["step_down_sort"] = time.perf_counter() - start
+    return dict(timings)
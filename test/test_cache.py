@@ -0,0 +1,125 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+import sdsort.workers
+from sdsort import main
+from sdsort.cache import ResultCache, content_digest
+
+TEST_CASES_DIR = Path("test", "cases")
+AN_HOUR_AGO = 3600
+
+
+def test_unchanged_file_is_not_read_again(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    target_path = _copy_with_old_mtime(TEST_CASES_DIR / "comments.out.py", tmp_path)
+    runner = CliRunner()
+    runner.invoke(main, ["--check", str(target_path)])
+
+    def fail(*args: object, **kwargs: object):
+        raise AssertionError("file should not be read")
+
+    monkeypatch.setattr(sdsort.workers, "read_file_bytes", fail)
+
+    # Act
+    result = runner.invoke(main, ["--check", str(target_path)])
+
+    # Assert
+    assert result.exit_code == 0
+    assert "1 file already sorted" in result.output
+
+
+def test_fail_fast_checks_the_files_that_are_not_cached(tmp_path: Path):
+    # Arrange
+    for index in range(5):
+        _write_old_file(tmp_path / f"sorted_{index}.py", (TEST_CASES_DIR / "comments.out.py").read_text())
+    runner = CliRunner()
+    runner.invoke(main, ["--check", str(tmp_path)])
+    _write_old_file(tmp_path / "unsorted.py", (TEST_CASES_DIR / "comments.in.py").read_text())
+
+    # Act
+    result = runner.invoke(main, ["--check", "--fail-fast", str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 1
+    assert f"- {tmp_path / 'unsorted.py'}" in result.output
+    assert "5 files already sorted" in result.output
+
+
+def test_file_is_analyzed_again_after_it_changes(tmp_path: Path):
+    # Arrange
+    target_path = _copy_with_old_mtime(TEST_CASES_DIR / "comments.out.py", tmp_path)
+    runner = CliRunner()
+    runner.invoke(main, ["--check", str(target_path)])
+    shutil.copy(TEST_CASES_DIR / "comments.in.py", target_path)
+
+    # Act
+    result = runner.invoke(main, ["--check", str(target_path)])
+
+    # Assert
+    assert result.exit_code == 1
+    assert "would be re-arranged" in result.output
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path):
+    # Arrange
+    paths = [_write_old_file(tmp_path / f"{name}.py", f"{name} = 1\n") for name in ["a", "b", "c"]]
+    for path in paths:
+        cache = ResultCache.open(tmp_path / "cache", max_entries=2)
+        assert cache is not None
+        cache.put(str(path), path.stat(), content_digest(path.read_bytes()), "unchanged")
+        cache.close()
+
+    # Act
+    cache = ResultCache.open(tmp_path / "cache", max_entries=2)
+    assert cache is not None
+    statuses = [cache.get_by_digest(str(path), content_digest(path.read_bytes())) for path in paths]
+    cache.close()
+
+    # Assert
+    assert statuses == [None, "unchanged", "unchanged"]
+
+
+def test_concurrent_processes_can_share_the_cache(tmp_path: Path):
+    # Arrange
+    paths = [_write_old_file(tmp_path / f"file_{n}.py", f"n = {n}\n") for n in range(20)]
+    chunks = [paths[i::4] for i in range(4)]
+
+    # Act
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_cache_files, [tmp_path / "cache"] * len(chunks), chunks))
+
+    # Assert
+    cache = ResultCache.open(tmp_path / "cache")
+    assert cache is not None
+    assert all(cache.get(str(path), path.stat()) == "unchanged" for path in paths)
+    cache.close()
+
+
+def _cache_files(cache_dir: Path, paths: list[Path]):
+    cache = ResultCache.open(cache_dir)
+    assert cache is not None
+    for path in paths:
+        cache.put(str(path), path.stat(), content_digest(path.read_bytes()), "unchanged")
+    cache.close()
+
+
+def _copy_with_old_mtime(source: Path, directory: Path) -> Path:
+    target = Path(shutil.copy(source, directory))
+    return _make_old(target)
+
+
+def _write_old_file(path: Path, content: str) -> Path:
+    path.write_text(content, encoding="utf-8")
+    return _make_old(path)
+
+
+def _make_old(path: Path) -> Path:
+    """Files modified very recently don't have their stat cached"""
+    old_time = path.stat().st_mtime - AN_HOUR_AGO
+    os.utime(path, (old_time, old_time))
+    return path
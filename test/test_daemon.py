@@ -0,0 +1,181 @@
+import shutil
+import socket
+import tempfile
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pytest
+from click.testing import CliRunner
+
+import sdsort.workers
+from sdsort import main
+from sdsort.client import DaemonClient
+from sdsort.daemon import SortServer
+from sdsort.utils.file import read_file
+
+TEST_CASES_DIR = Path("test", "cases")
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="the daemon requires Unix domain sockets")
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> Iterator[SortServer]:
+    # Socket paths are limited to about a hundred characters, which pytest's temporary directories can exceed
+    socket_dir = Path(tempfile.mkdtemp(prefix="sdsort"))
+    socket_path = socket_dir / "daemon.sock"
+    monkeypatch.setenv("SDSORT_DAEMON_SOCKET", str(socket_path))
+    server = SortServer(socket_path, jobs=1)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    shutil.rmtree(socket_dir)
+
+
+def test_cli_forwards_files_to_the_daemon(server: SortServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    test_cases = ["comments", "dataclass", "skip_file_directive"]
+    for tc in test_cases:
+        shutil.copy(TEST_CASES_DIR / f"{tc}.in.py", tmp_path)
+
+    def fail(*args: object, **kwargs: object):
+        raise AssertionError("files should be processed by the daemon")
+
+    monkeypatch.setattr(sdsort.workers, "step_down_sort", fail)
+
+    # Act
+    result = CliRunner().invoke(main, ["--no-cache", str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 0, result.output
+    for tc in test_cases:
+        assert read_file(tmp_path / f"{tc}.in.py") == read_file(TEST_CASES_DIR / f"{tc}.out.py")
+    assert server.stats.summary()["sort"]["count"] == len(test_cases)
+
+
+def test_fail_fast_stops_at_the_first_file_the_daemon_would_re_arrange(server: SortServer, tmp_path: Path):
+    # Arrange
+    for index in range(20):
+        shutil.copy(TEST_CASES_DIR / "comments.out.py", tmp_path / f"sorted_{index:02}.py")
+    shutil.copy(TEST_CASES_DIR / "comments.in.py", tmp_path / "a_unsorted.py")
+    shutil.copy(TEST_CASES_DIR / "single_class.in.py", tmp_path / "z_unsorted.py")
+
+    # Act
+    result = CliRunner().invoke(main, ["--check", "--fail-fast", "--no-cache", "--jobs", "1", str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 1
+    assert [line for line in result.output.splitlines() if line.startswith("- ")] == [
+        f"- {tmp_path / 'a_unsorted.py'}"
+    ]
+    assert server.stats.summary()["check"]["count"] < 22, (
+        "Files after the first unsorted one should not be checked"
+    )
+
+
+def test_daemon_serves_concurrent_connections(server: SortServer):
+    # Arrange
+    raw_sources = [(TEST_CASES_DIR / f"{tc}.in.py").read_bytes() for tc in ["comments", "dataclass"] * 8]
+
+    def sort(raw_source: bytes):
+        client = DaemonClient.connect()
+        assert client is not None
+        try:
+            return client.sort("module.py", raw_source)
+        finally:
+            client.close()
+
+    # Act
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(sort, raw_sources))
+
+    # Assert
+    assert [status for status, _ in results] == ["sorted"] * len(raw_sources)
+    assert results[0][1] == read_file(TEST_CASES_DIR / "comments.out.py")
+    assert server.stats.summary()["sort"]["count"] == len(raw_sources)
+
+
+def test_daemon_notices_changes_to_pyproject(server: SortServer, tmp_path: Path):
+    # Arrange
+    source = b"def main(helper: Helper):\n    pass\n\n\nclass Helper:\n    pass\n"
+    pyproject = tmp_path / "pyproject.toml"
+    pyproject.write_text('[project]\nrequires-python = ">=3.11"\n')
+    client = DaemonClient.connect()
+    assert client is not None
+    status_before = client.check(str(tmp_path / "module.py"), source)
+
+    # Act
+    pyproject.write_text('[project]\nrequires-python = ">=3.14"\n')
+    status_after = client.check(str(tmp_path / "module.py"), source)
+    client.close()
+
+    # Assert
+    assert (status_before, status_after) == ("sorted", "unchanged")
+
+
+@pytest.mark.parametrize("stdin", [False, True])
+def test_relative_paths_are_resolved_where_sdsort_runs(
+    server: SortServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, stdin: bool
+):
+    # Arrange
+    project = tmp_path / "project"
+    (project / "pkg").mkdir(parents=True)
+    (project / "pyproject.toml").write_text('[project]\nrequires-python = ">=3.14"\n')
+    source = "def main(helper: Helper):\n    pass\n\n\nclass Helper:\n    pass\n"
+    (project / "pkg" / "a.py").write_text(source)
+    daemon_directory = tmp_path / "daemon"
+    daemon_directory.mkdir()
+    respond = server.respond
+
+    def respond_elsewhere(request: dict[str, Any]) -> dict[str, Any]:
+        # The daemon runs in a directory of its own, which relative paths would be resolved against
+        with monkeypatch.context() as m:
+            m.chdir(daemon_directory)
+            return respond(request)
+
+    monkeypatch.setattr(server, "respond", respond_elsewhere)
+    monkeypatch.chdir(project)
+    arguments = (
+        ["--check", "--stdin-filename", "pkg/a.py", "-"] if stdin else ["--check", "--no-cache", "pkg/a.py"]
+    )
+
+    # Act
+    result = CliRunner().invoke(main, arguments, input=source)
+
+    # Assert
+    assert result.exit_code == 0, result.output
+    assert server.stats.summary()["check"]["count"] == 1
+
+
+def test_failure_to_forward_stdin_is_reported(server: SortServer, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    respond = server.respond
+
+    def fail_to_sort(request: dict[str, Any]) -> dict[str, Any]:
+        return {"error": "out of workers"} if request["command"] == "sort" else respond(request)
+
+    monkeypatch.setattr(server, "respond", fail_to_sort)
+
+    # Act
+    result = CliRunner().invoke(main, ["-"], input="x = 1\n")
+
+    # Assert
+    assert result.exit_code == 1
+    assert "Failed to forward stdin to the daemon (out of workers)" in result.output
+    assert result.exception is None or isinstance(result.exception, SystemExit)
+
+
+def test_daemon_running_a_different_version_is_not_used(server: SortServer, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(server, "_fingerprint", "some other version")
+
+    # Act
+    client = DaemonClient.connect()
+
+    # Assert
+    assert client is None
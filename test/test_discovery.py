@@ -0,0 +1,131 @@
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from click.testing import CliRunner
+
+from sdsort import main
+from sdsort.discovery import DEFAULT_EXCLUDES, find_python_files
+
+TEST_CASES_DIR = Path("test", "cases").absolute()
+
+
+def test_default_excludes_are_not_descended_into(tmp_path: Path):
+    # Arrange
+    _touch(tmp_path, "app.py", ".venv/lib/site.py", "node_modules/pkg/x.py", "src/build/gen.py", "src/builder.py")
+
+    # Act
+    found = _find(tmp_path, [re.compile(DEFAULT_EXCLUDES)])
+
+    # Assert
+    assert found == ["app.py", "src/builder.py"]
+
+
+def test_gitignore_patterns_are_respected(tmp_path: Path):
+    # Arrange
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("generated/\n*_pb2.py\n/top.py\n")
+    (tmp_path / "src" / "sub").mkdir(parents=True)
+    (tmp_path / "src" / "sub" / ".gitignore").write_text("!keep_pb2.py\n")
+    _touch(
+        tmp_path,
+        "top.py",
+        "src/top.py",
+        "src/api_pb2.py",
+        "src/sub/keep_pb2.py",
+        "src/sub/other_pb2.py",
+        "src/generated/models.py",
+    )
+
+    # Act
+    found_from_root = _find(tmp_path, [])
+    found_from_subdir = _find(tmp_path / "src", [], root=tmp_path)
+
+    # Assert
+    assert found_from_root == ["src/sub/keep_pb2.py", "src/top.py"]
+    assert found_from_subdir == ["src/sub/keep_pb2.py", "src/top.py"]
+
+
+def test_explicitly_given_files_are_always_included(tmp_path: Path):
+    # Arrange
+    _touch(tmp_path, "build/gen.py")
+    file_path = str(tmp_path / "build" / "gen.py")
+
+    # Act
+    found = list(find_python_files([file_path], [re.compile(DEFAULT_EXCLUDES)]))
+
+    # Assert
+    assert found == [(file_path, None)]
+
+
+def test_extend_exclude_adds_to_the_default_excludes(tmp_path: Path):
+    # Arrange
+    _touch(tmp_path, "app.py", "migrations/0001_initial.py", "venv/lib/site.py")
+
+    # Act
+    result = CliRunner().invoke(main, ["--check", "--extend-exclude", "/migrations/", str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 0
+    assert "1 file already sorted" in result.output
+
+
+def _touch(directory: Path, *relative_paths: str):
+    for relative_path in relative_paths:
+        path = directory / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x = 1\n")
+
+
+def _find(directory: Path, excludes: list[re.Pattern[str]], root: Optional[Path] = None) -> list[str]:
+    found = find_python_files([str(directory)], excludes)
+    return sorted(Path(path).relative_to(root or directory).as_posix() for path, _ in found)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_diff_base_only_processes_changed_and_untracked_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.chdir(tmp_path)
+    _touch(tmp_path, "committed.py", "modified.py", "deleted.py", "lib/modified.py")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "Initial commit")
+    for unsorted_path in ["modified.py", "lib/modified.py", "untracked.py", "ignored.py"]:
+        shutil.copy(TEST_CASES_DIR / "comments.in.py", tmp_path / unsorted_path)
+    (tmp_path / "deleted.py").unlink()
+    (tmp_path / ".gitignore").write_text("ignored.py\n")
+
+    # Act
+    result = CliRunner().invoke(main, ["--check", "--diff-base", "HEAD"])
+    filtered_result = CliRunner().invoke(main, ["--check", "--diff-base", "HEAD", "lib"])
+
+    # Assert
+    assert result.exit_code == 1
+    assert _listed_files(result.output) == ["lib/modified.py", "modified.py", "untracked.py"]
+    assert _listed_files(filtered_result.output) == ["lib/modified.py"]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_diff_base_reports_git_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.chdir(tmp_path)
+    _git(tmp_path, "init", "-q")
+
+    # Act
+    result = CliRunner().invoke(main, ["--diff-base", "no-such-ref"])
+
+    # Assert
+    assert result.exit_code == 1
+    assert "--diff-base" in result.output
+
+
+def _git(directory: Path, *args: str):
+    identity = ["-c", "user.name=sdsort", "-c", "user.email=sdsort@example.com", "-c", "commit.gpgsign=false"]
+    subprocess.run(["git", *identity, *args], cwd=directory, check=True)
+
+
+def _listed_files(output: str) -> list[str]:
+    return sorted(Path(line[2:]).as_posix() for line in output.splitlines() if line.startswith("- "))
@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+from sdsort.format import _adjust_blank_lines
+from sdsort.utils.ast import is_blank
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_adjust_blank_lines_matches_rewriting_every_line(seed: int):
+    # Arrange
+    rng = random.Random(seed)
+    lines = [rng.choice(["", "    ", "x = 1", "def f():", "    pass"]) for _ in range(rng.randrange(0, 40))]
+    code_lines = [index for index, line in enumerate(lines) if not is_blank(line)]
+    required_blanks = {index: rng.choice([0, 1, 2]) for index in code_lines if rng.random() < 0.3}
+
+    # Act
+    adjusted_lines = _adjust_blank_lines(lines, required_blanks)
+
+    # Assert
+    assert adjusted_lines == _rewrite_every_line(lines, required_blanks)
+
+
+def _rewrite_every_line(lines: list[str], required_blanks: dict[int, int]) -> list[str]:
+    """The original implementation, which goes through the lines one by one"""
+    result: list[str] = []
+    for i, line in enumerate(lines):
+        if i in required_blanks:
+            while result and is_blank(result[-1]):
+                result.pop()
+            result.extend([""] * required_blanks[i])
+        if not is_blank(line) or len(result) < 2 or any(not is_blank(line) for line in result[-2:]):
+            result.append(line)
+    return result
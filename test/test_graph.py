@@ -0,0 +1,92 @@
+import ast
+import random
+
+import pytest
+
+from sdsort.block import Block, block_for
+from sdsort.context import Context
+from sdsort.graph import AcyclicGraph
+from sdsort.sort import _depth_first_sort
+from sdsort.utils.ast import LineIndex
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_graph_keeps_the_same_edges_as_a_reachability_search(seed: int):
+    # Arrange
+    rng = random.Random(seed)
+    nodes = _make_blocks(rng.randrange(2, 40))
+    edges = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(rng.randrange(1, 200))]
+    reference = _ReferenceGraph()
+    for source, target in edges:
+        reference.add_edge(source, target)
+
+    # Act
+    graph = AcyclicGraph(edges)
+
+    # Assert
+    for node in nodes:
+        assert list(graph.get_successors(node)) == reference.edges.get(node, [])
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_depth_first_sort_matches_the_recursive_walk(seed: int):
+    # Arrange
+    rng = random.Random(seed)
+    blocks = _make_blocks(rng.randrange(1, 15))
+    edges = [(rng.choice(blocks), rng.choice(blocks)) for _ in range(rng.randrange(0, 40))]
+    dependencies = AcyclicGraph(edges)
+    expected: list[Block] = []
+    for block in blocks:
+        _recursive_depth_first_sort(block, dependencies, expected, [])
+
+    # Act
+    sorted_blocks = _depth_first_sort(blocks, dependencies)
+
+    # Assert
+    assert sorted_blocks == expected
+
+
+def _recursive_depth_first_sort(
+    current_block: Block, dependencies: AcyclicGraph, sorted_blocks: list[Block], path: list[Block]
+):
+    """The original walk, which re-visits shared dependencies from every block that depends on them"""
+    path.append(current_block)
+    if current_block in sorted_blocks:
+        sorted_blocks.remove(current_block)
+    sorted_blocks.append(current_block)
+    for dependency in dependencies.get_successors(current_block):
+        if dependency not in path:
+            _recursive_depth_first_sort(dependency, dependencies, sorted_blocks, path)
+    path.pop()
+
+
+def _make_blocks(count: int) -> list[Block]:
+    source_lines = [f"x{index} = {index}" for index in range(count)]
+    syntax_tree = ast.parse("\n".join(source_lines))
+    return [
+        block_for(node, LineIndex(source_lines), Context(deferred_annotations=False)) for node in syntax_tree.body
+    ]
+
+
+class _ReferenceGraph:
+    """Searches the whole graph for every edge, like the graph did originally"""
+
+    def __init__(self):
+        self.edges: dict[Block, list[Block]] = {}
+
+    def add_edge(self, source: Block, target: Block):
+        if source == target or target in self.edges.get(source, []) or self._is_reachable(source, start=target):
+            return
+        self.edges.setdefault(source, []).append(target)
+
+    def _is_reachable(self, node: Block, *, start: Block) -> bool:
+        visited: set[Block] = set()
+        stack = [start]
+        while stack:
+            current = stack.pop()
+            if current == node:
+                return True
+            if current not in visited:
+                visited.add(current)
+                stack.extend(self.edges.get(current, []))
+        return False
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent
+
+
+def test_importing_sdsort_loads_nothing_else():
+    # Act
+    imported = _imported_modules("import sdsort")
+
+    # Assert
+    assert [module for module in imported if module.startswith("sdsort")] == ["sdsort"]
+    assert "click" not in imported
+
+
+def test_sorting_a_file_only_imports_what_it_uses(tmp_path: Path):
+    # Arrange
+    (tmp_path / "pyproject.toml").write_text('[project]\nrequires-python = ">=3.11"\n')
+    settled_path = tmp_path / "settled.py"
+    settled_path.write_text("from __future__ import annotations\n\n\ndef a():\n    b()\n\n\ndef b():\n    pass\n")
+    unsettled_path = tmp_path / "unsettled.py"
+    unsettled_path.write_text("def a():\n    b()\n\n\ndef b():\n    pass\n")
+
+    # Act
+    settled_imports = _imported_modules(f"import sdsort; sdsort.step_down_sort({str(settled_path)!r})")
+    unsettled_imports = _imported_modules(f"import sdsort; sdsort.step_down_sort({str(unsettled_path)!r})")
+
+    # Assert
+    assert "tokenize" not in settled_imports
+    assert "tomllib" not in settled_imports
+    assert "tomllib" in unsettled_imports
+
+
+def test_checking_one_file_only_imports_what_it_uses(tmp_path: Path):
+    # Arrange
+    file_path = tmp_path / "one.py"
+    file_path.write_text("def a():\n    b()\n\n\ndef b():\n    pass\n")
+    command = f"from sdsort import main; main(['--check', {str(file_path)!r}])"
+
+    # Act
+    imported = _imported_modules(command)
+
+    # Assert
+    # tokenize is missing from the list, since click imports it (through inspect)
+    assert not imported & {"tomllib", "concurrent.futures", "subprocess", "socket"}
+
+
+def _imported_modules(code: str) -> set[str]:
+    """Run the code in a fresh interpreter, and report the modules it imports"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if process.returncode not in (0, 1):
+        pytest.fail(process.stderr)
+    return {
+        line.split("|")[-1].strip()
+        for line in process.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line
+    }
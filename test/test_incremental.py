@@ -0,0 +1,141 @@
+import random
+from pathlib import Path
+from tokenize import TokenError
+
+import pytest
+from synthetic import ModuleShape, generate_module
+
+import sdsort.incremental
+from sdsort import IncrementalSource, sort_source
+from sdsort.utils.file import read_file
+
+TEST_CASES_DIR = Path("test", "cases")
+
+SNIPPETS = [
+    "\n",
+    "# a comment\n",
+    "    # an indented comment\n",
+    "@decorate\n",
+    "    @property\n",
+    "x = function_1()\n",
+    "    def extra(self):\n        return self.method_1()\n",
+    "def extra():\n    return function_2()\n",
+    "class Extra:\n    def method(self):\n        pass\n",
+    "\\\n",
+    '"""\n',
+    "(\n",
+]
+
+
+def _sources() -> list[str]:
+    sources = [read_file(path) for path in sorted(TEST_CASES_DIR.glob("*.in.py"))]
+    sources.append(generate_module(ModuleShape(functions=10, classes=3, methods_per_class=5, decorators=True)))
+    return sources
+
+
+def _edit_randomly(document: IncrementalSource, rng: random.Random):
+    lines = document.lines
+    line = rng.randrange(len(lines))
+    match rng.randrange(4):
+        case 0:
+            document.edit(line, 0, line, 0, rng.choice(SNIPPETS))
+        case 1:
+            document.edit(line, 0, min(line + rng.randint(1, 4), len(lines) - 1), 0, "")
+        case 2:
+            copied = "".join(f"{copied_line}\n" for copied_line in lines[rng.randrange(len(lines)) :][:3])
+            document.edit(line, 0, line, 0, copied)
+        case _:
+            column = rng.randint(0, len(lines[line]))
+            document.edit(line, column, line, column, rng.choice(["x", " ", "self.method_0()", "(", "\n"]))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sorting_after_each_edit_gives_the_same_result_as_sorting_the_edited_source(seed: int):
+    # Arrange
+    rng = random.Random(seed)
+    mismatches = []
+
+    for source in _sources():
+        document = IncrementalSource(source)
+        for _ in range(30):
+            # Act
+            _edit_randomly(document, rng)
+            try:
+                result = document.sort()
+            except (SyntaxError, TokenError):
+                result = None
+
+            # Assert
+            try:
+                expected_result = sort_source(document.text)
+            except (SyntaxError, TokenError):
+                expected_result = None
+            if result is None and expected_result is not None:
+                # Some sources can't be re-arranged, which is found out without parsing them
+                with pytest.raises((SyntaxError, TokenError)):
+                    compile(document.text, "<unknown>", "exec")
+            elif result != expected_result:
+                mismatches.append(document.text)
+            if result is not None:
+                assert document.check() == result[0]
+            if result is None and rng.random() < 0.5:
+                document = IncrementalSource(source)
+
+    assert mismatches == []
+
+
+def test_an_edit_within_a_method_only_parses_the_methods_around_it(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    source = generate_module(ModuleShape(functions=50, classes=2, methods_per_class=20))
+    document = IncrementalSource(source)
+    document.sort()
+    parsed_sources = []
+    parse = sdsort.incremental.parse
+
+    def spy_on_parse(source: str, *args, **kwargs):
+        parsed_sources.append(source)
+        return parse(source, *args, **kwargs)
+
+    monkeypatch.setattr(sdsort.incremental, "parse", spy_on_parse)
+    line = document.lines.index("    def method_10(self) -> None:")
+
+    # Act
+    document.edit(line + 1, 0, line + 1, 0, "        self.method_2()\n")
+    result = document.sort()
+
+    # Assert
+    assert result == sort_source(document.text)
+    assert len(parsed_sources) == 1
+    assert parsed_sources[0].count("\n    def ") == 3, "Only the method and the ones on either side are parsed"
+
+
+def test_an_edit_that_leaves_a_bracket_open_has_the_whole_source_parsed():
+    # Arrange
+    source = generate_module(ModuleShape(functions=5))
+    document = IncrementalSource(source)
+    document.sort()
+    line = document.lines.index("def function_2(value: int) -> None:")
+
+    # Act
+    document.edit(line, 0, line, 0, "x = (\n")
+
+    # Assert
+    with pytest.raises(SyntaxError):
+        document.sort()
+    document.edit(line + 1, 0, line + 1, 0, ")\n")
+    assert document.sort() == sort_source(document.text)
+
+
+def test_blocks_that_only_swap_with_copies_of_themselves_leave_the_source_unchanged():
+    # Arrange
+    duplicate_class = (
+        "class Encoder(codecs.Encoder):\n    def encode(self, input):\n        return encode(input)\n"
+    )
+    document = IncrementalSource(duplicate_class)
+
+    # Act
+    document.edit(3, 0, 3, 0, f"\n{duplicate_class}\n")
+
+    # Assert
+    assert document.check() == "unchanged"
+    assert document.sort() == sort_source(document.text) == ("unchanged", None)
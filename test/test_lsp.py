@@ -0,0 +1,212 @@
+import io
+import json
+from pathlib import Path
+from typing import Any
+
+from sdsort import sort_source
+from sdsort.lsp import SORT_ACTION_KIND, SORT_ACTION_TITLE, LanguageServer
+from sdsort.utils.file import read_file
+
+TEST_CASES_DIR = Path("test", "cases")
+
+URI = "file:///project/module.py"
+
+
+def test_code_action_sorts_the_document():
+    # Arrange
+    source = read_file(TEST_CASES_DIR / "top_level_functions.in.py")
+    messages = [
+        *_open_document(source, resolve_support=True),
+        _request(2, "textDocument/codeAction", {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0)}),
+    ]
+
+    # Act
+    _, responses = _serve(messages)
+    (action,) = responses[2]["result"]
+    _, resolve_responses = _serve([*messages, _request(3, "codeAction/resolve", action)])
+
+    # Assert
+    assert action["title"] == SORT_ACTION_TITLE
+    assert action["kind"] == SORT_ACTION_KIND
+    assert "edit" not in action, "The edit is only put together once the action is resolved"
+    edits = resolve_responses[3]["result"]["edit"]["changes"][URI]
+    assert _apply_edits(source, edits) == sort_source(source)[1]
+
+
+def test_code_action_comes_with_the_edit_when_the_client_cant_resolve_it():
+    # Arrange
+    source = read_file(TEST_CASES_DIR / "single_class.in.py")
+    messages = [
+        *_open_document(source),
+        _request(2, "textDocument/codeAction", {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0)}),
+    ]
+
+    # Act
+    _, responses = _serve(messages)
+
+    # Assert
+    (action,) = responses[2]["result"]
+    assert _apply_edits(source, action["edit"]["changes"][URI]) == sort_source(source)[1]
+
+
+def test_code_action_is_only_offered_for_documents_that_sorting_would_change():
+    # Arrange
+    sorted_source = read_file(TEST_CASES_DIR / "top_level_functions.out.py")
+    unsorted_source = read_file(TEST_CASES_DIR / "top_level_functions.in.py")
+    messages = [
+        *_open_document(sorted_source),
+        _request(2, "textDocument/codeAction", {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0)}),
+        _change_document([{"range": _range(0, 0, 0, 0), "text": "def broken(:\n"}]),
+        _request(3, "textDocument/codeAction", {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0)}),
+        _change_document([{"text": unsorted_source}]),
+        _request(
+            4,
+            "textDocument/codeAction",
+            {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0), "context": {"only": ["quickfix"]}},
+        ),
+        _request(
+            5,
+            "textDocument/codeAction",
+            {"textDocument": {"uri": URI}, "range": _range(0, 0, 0, 0), "context": {"only": ["source"]}},
+        ),
+    ]
+
+    # Act
+    _, responses = _serve(messages)
+
+    # Assert
+    assert responses[2]["result"] == []
+    assert responses[3]["result"] == [], "A document that can't be parsed has no actions"
+    assert responses[4]["result"] == []
+    assert [action["title"] for action in responses[5]["result"]] == [SORT_ACTION_TITLE]
+
+
+def test_formatting_applies_incremental_changes_first():
+    # Arrange
+    source = "def main():\n    return 'é😀'\n\n\ndef helper():\n    pass\n"
+    messages = [
+        *_open_document(source),
+        # Positions are in UTF-16 code units, in which the emoji takes up two
+        _change_document([{"range": _range(1, 15, 1, 15), "text": "x' + helper() + '"}]),
+        _change_document([{"range": _range(0, 0, 0, 0), "text": "def first():\n    pass\n\n\n"}]),
+        _change_document([{"range": _range(5, 11, 5, 11), "text": "first() + "}]),
+        _request(2, "textDocument/formatting", {"textDocument": {"uri": URI}, "options": {}}),
+    ]
+    edited_source = (
+        "def first():\n    pass\n\n\n"
+        "def main():\n    return first() + 'é😀x' + helper() + ''\n\n\n"
+        "def helper():\n    pass\n"
+    )
+
+    # Act
+    _, responses = _serve(messages)
+
+    # Assert
+    assert _apply_edits(edited_source, responses[2]["result"]) == sort_source(edited_source)[1]
+
+
+def test_formatting_a_sorted_document_changes_nothing():
+    # Arrange
+    source = read_file(TEST_CASES_DIR / "top_level_functions.out.py")
+    messages = [
+        *_open_document(source),
+        _request(2, "textDocument/formatting", {"textDocument": {"uri": URI}, "options": {}}),
+    ]
+
+    # Act
+    _, responses = _serve(messages)
+
+    # Assert
+    assert responses[2]["result"] == []
+
+
+def test_exit_code_tells_if_the_server_was_shut_down():
+    # Arrange
+    messages = [*_open_document("x = 1\n"), _request(2, "shutdown", None), _notification("exit", None)]
+
+    # Act
+    shut_down_exit_code, _ = _serve(messages)
+    exit_code, _ = _serve([*messages[:-2], _notification("exit", None)])
+
+    # Assert
+    assert shut_down_exit_code == 0
+    assert exit_code == 1
+
+
+def test_unknown_requests_are_answered_with_an_error():
+    # Arrange
+    messages = [
+        *_open_document("x = 1\n"),
+        _notification("$/cancelRequest", {"id": 1}),
+        _request(2, "textDocument/hover", {"textDocument": {"uri": URI}, "position": {"line": 0, "character": 0}}),
+    ]
+
+    # Act
+    _, responses = _serve(messages)
+
+    # Assert
+    assert responses[2]["error"]["code"] == -32601
+    assert list(responses) == [1, 2], "Unknown notifications are ignored"
+
+
+def _open_document(source: str, resolve_support: bool = False) -> list[dict[str, Any]]:
+    code_action_capabilities = {"resolveSupport": {"properties": ["edit"]}} if resolve_support else {}
+    return [
+        _request(1, "initialize", {"capabilities": {"textDocument": {"codeAction": code_action_capabilities}}}),
+        _notification("initialized", {}),
+        _notification(
+            "textDocument/didOpen",
+            {"textDocument": {"uri": URI, "languageId": "python", "version": 1, "text": source}},
+        ),
+    ]
+
+
+def _change_document(changes: list[dict[str, Any]]) -> dict[str, Any]:
+    return _notification("textDocument/didChange", {"textDocument": {"uri": URI}, "contentChanges": changes})
+
+
+def _request(id: int, method: str, params: Any) -> dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": id, "method": method, "params": params}
+
+
+def _notification(method: str, params: Any) -> dict[str, Any]:
+    return {"jsonrpc": "2.0", "method": method, "params": params}
+
+
+def _range(start_line: int, start_character: int, end_line: int, end_character: int) -> dict[str, Any]:
+    return {
+        "start": {"line": start_line, "character": start_character},
+        "end": {"line": end_line, "character": end_character},
+    }
+
+
+def _serve(messages: list[dict[str, Any]]) -> tuple[int, dict[int, dict[str, Any]]]:
+    """Run the server on the messages, and collect its responses by the id of the request"""
+    content = b""
+    for message in messages:
+        body = json.dumps(message).encode("utf-8")
+        content += b"Content-Length: %d\r\n\r\n" % len(body) + body
+    output = io.BytesIO()
+    exit_code = LanguageServer(io.BytesIO(content), output).serve()
+
+    responses = {}
+    output.seek(0)
+    while header := output.readline():
+        length = int(header.split(b":")[1])
+        output.readline()
+        response = json.loads(output.read(length))
+        responses[response["id"]] = response
+    return exit_code, responses
+
+
+def _apply_edits(source: str, edits: list[dict[str, Any]]) -> str:
+    """Apply text edits that don't start or end after a character beyond the BMP, so positions are indices"""
+    lines = source.split("\n")
+    for edit in sorted(
+        edits, key=lambda edit: (edit["range"]["start"]["line"], edit["range"]["start"]["character"]), reverse=True
+    ):
+        start, end = edit["range"]["start"], edit["range"]["end"]
+        prefix = lines[start["line"]][: start["character"]]
+        suffix = lines[end["line"]][end["character"] :]
+        lines[start["line"] : end["line"] + 1] = (prefix + edit["newText"] + suffix).split("\n")
+    return "\n".join(lines)
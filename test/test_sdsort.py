@@ -7,9 +7,19 @@ from pathlib import Path
 import pytest
 from click.testing import CliRunner
 
-from sdsort import main, step_down_sort
+import sdsort.context
+import sdsort.sort
+from sdsort import (
+    Context,
+    check_step_down_order,
+    main,
+    sort_many,
+    sort_source,
+    sort_syntax_tree,
+    step_down_sort,
+)
 from sdsort.context import _targets_python314_or_newer
-from sdsort.utils.file import read_file
+from sdsort.utils.file import read_file, split_lines
 
 TEST_CASES_DIR = Path("test", "cases")
 
@@ -47,6 +57,7 @@ TEST_CASES_DIR = Path("test", "cases")
         "deferred_class_attribute_annotations",
         "deferred_statement_annotation",
         "skip_file_directive",
+        "moved_class_next_to_dangling_comment",
     ],
 )
 def test_all_cases(test_case: str):
@@ -75,6 +86,101 @@ def test_type_alias_is_not_reordered_below_class_it_references():
     assert actual_output == expected_output
 
 
+@pytest.mark.parametrize("case_file_path", sorted(TEST_CASES_DIR.glob("*.py")), ids=lambda path: path.name)
+def test_check_reports_the_same_status_as_sorting(case_file_path: Path):
+    if case_file_path.name.startswith("type_declaration") and sys.version_info < (3, 12):
+        pytest.skip("`type` alias statement requires Python 3.12+")
+
+    status, _ = step_down_sort(case_file_path)
+
+    assert check_step_down_order(case_file_path) == status
+
+
+def test_check_reports_blocks_that_only_swap_with_copies_of_themselves_as_unchanged(tmp_path: Path):
+    # Arrange
+    duplicate_class = (
+        "class IncrementalEncoder(codecs.IncrementalEncoder):\n"
+        "    def encode(self, input, final=False):\n"
+        "        return oem_encode(input, self.errors)[0]\n"
+    )
+    target_path = tmp_path / "duplicates.py"
+    target_path.write_text(f"{duplicate_class}\n{duplicate_class}\n", encoding="utf-8")
+
+    # Act
+    status = check_step_down_order(target_path)
+
+    # Assert
+    assert status == step_down_sort(target_path)[0] == "unchanged"
+
+
+@pytest.mark.parametrize("case_file_path", sorted(TEST_CASES_DIR.glob("*.py")), ids=lambda path: path.name)
+def test_sorting_a_parsed_syntax_tree_does_not_parse_it_again(
+    case_file_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Arrange
+    if case_file_path.name.startswith("type_declaration") and sys.version_info < (3, 12):
+        pytest.skip("`type` alias statement requires Python 3.12+")
+    source = read_file(case_file_path)
+    syntax_tree = ast.parse(source)
+    expected_result = step_down_sort(case_file_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the source should not be parsed again")
+
+    monkeypatch.setattr(sdsort.sort, "parse", fail)
+
+    # Act
+    result = sort_syntax_tree(syntax_tree, split_lines(source), filename=case_file_path)
+
+    # Assert
+    assert result == expected_result
+
+
+@pytest.mark.parametrize("test_case", ["comments", "dataclass", "skip_file_directive", "jpe"])
+def test_sort_source_gives_the_same_result_as_sorting_the_file(test_case: str):
+    # Arrange
+    input_file_path = TEST_CASES_DIR / f"{test_case}.in.py"
+
+    # Act
+    result = sort_source(read_file(input_file_path), filename=input_file_path)
+
+    # Assert
+    assert result == step_down_sort(input_file_path)
+
+
+@pytest.mark.parametrize(
+    "context,expected_status", [(None, "sorted"), (Context(deferred_annotations=True), "unchanged")]
+)
+def test_sort_source_does_not_touch_the_filesystem_without_a_filename(
+    monkeypatch: pytest.MonkeyPatch, context: Context | None, expected_status: str
+):
+    # Arrange
+    def fail(*args):
+        raise AssertionError("the filesystem should not be searched for a project")
+
+    monkeypatch.setattr(sdsort.context, "find_pyproject", fail)
+    source = "def main(helper: Helper):\n    pass\n\n\nclass Helper:\n    pass\n"
+
+    # Act
+    status, _ = sort_source(source, context=context)
+
+    # Assert
+    assert status == expected_status
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_sort_many_yields_the_result_of_each_source(jobs: int):
+    # Arrange
+    test_cases = ["comments", "dataclass", "single_class", "top_level_functions", "skip_file_directive", "jpe"]
+    sources = ((f"{tc}.py", read_file(TEST_CASES_DIR / f"{tc}.in.py")) for tc in test_cases)
+
+    # Act
+    results = dict(sort_many(sources, jobs=jobs))
+
+    # Assert
+    assert results == {f"{tc}.py": sort_source(read_file(TEST_CASES_DIR / f"{tc}.in.py")) for tc in test_cases}
+
+
 def test_when_single_file_is_targeted_then_other_files_are_not_modified(tmp_path: Path):
     # Arrange
     file_to_sort = TEST_CASES_DIR / "comments.in.py"
@@ -155,6 +261,33 @@ def test_check_flag_exits_cleanly_when_files_are_already_sorted(tmp_path: Path):
     assert "would be re-arranged" not in result.output
 
 
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_fail_fast_stops_at_the_first_file_that_would_be_re_arranged(tmp_path: Path, jobs: str):
+    # Arrange
+    for index in range(200):
+        shutil.copy(TEST_CASES_DIR / "comments.out.py", tmp_path / f"sorted_{index:03}.py")
+    shutil.copy(TEST_CASES_DIR / "comments.in.py", tmp_path / "a_unsorted.py")
+    shutil.copy(TEST_CASES_DIR / "single_class.in.py", tmp_path / "z_unsorted.py")
+
+    # Act
+    result = CliRunner().invoke(main, ["--check", "--fail-fast", "--no-cache", "--jobs", jobs, str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 1
+    assert [line for line in result.output.splitlines() if line.startswith("- ")] == [
+        f"- {tmp_path / 'a_unsorted.py'}"
+    ]
+    checked_files = int(result.output.split("Checked ")[1].split()[0])
+    assert checked_files < 202, "Files after the first unsorted one should not all be checked"
+
+
+def test_fail_fast_requires_check(tmp_path: Path):
+    result = CliRunner().invoke(main, ["--fail-fast", str(tmp_path)])
+
+    assert result.exit_code == 2
+    assert "--fail-fast can only be used with --check" in result.output
+
+
 @pytest.mark.parametrize(
     "requires_python,expected",
     [
@@ -189,3 +322,175 @@ def test_form_feed_between_functions_does_not_crash(tmp_path: Path):
     tree = ast.parse(output)
     assert {n.name for n in tree.body if isinstance(n, ast.FunctionDef)} == {"helper", "main"}
     assert output.index("def main") < output.index("def helper"), "main should come before helper"
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "\fdef a():\n    pass\n\n\n\fdef b():\n    return a()\n",
+        "x = 1\n\fdef a():\n    pass\n\n\n  \fdef b():\n    return a()\n",
+        "class A:\n    def a(self):\n        pass\n\n\f    def b(self):\n        return self.a()\n",
+    ],
+)
+def test_form_feed_before_a_definition_is_not_mistaken_for_a_statement(
+    source: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Arrange
+    target_path = tmp_path / "form_feed.py"
+    target_path.write_text(source, encoding="utf-8")
+
+    # Act
+    result = step_down_sort(target_path)
+    monkeypatch.setattr(sdsort.sort, "cannot_be_reordered", lambda source: False)
+    parsed_result = step_down_sort(target_path)
+
+    # Assert
+    assert result == parsed_result
+    assert result[0] == "sorted"
+
+
+def test_skip_directive_inside_a_string_is_ignored(tmp_path: Path):
+    # Arrange
+    source = (
+        'def a():\n    """\n    # sdsort: skip_file\n    """\n    b()\n\n\n'
+        "def b():\n    pass\n\n\ndef main():\n    a()\n"
+    )
+    target_path = tmp_path / "directive_in_docstring.py"
+    target_path.write_text(source, encoding="utf-8")
+
+    # Act
+    status, _ = step_down_sort(target_path)
+
+    # Assert
+    assert status == "sorted"
+
+
+def test_file_that_cannot_be_reordered_is_not_parsed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    source = (
+        '"""A module with a single class.\n\nIt has a single method.\n"""\n'
+        "import os\n\n\nclass A:\n    def f(self):\n        return os.getcwd()\n"
+    )
+    target_path = tmp_path / "single_method.py"
+    target_path.write_text(source, encoding="utf-8")
+
+    def fail(*args: object, **kwargs: object):
+        raise AssertionError("parse should not be called")
+
+    monkeypatch.setattr(sdsort.sort, "parse", fail)
+
+    # Act
+    status, _ = step_down_sort(target_path)
+
+    # Assert
+    assert status == "unchanged"
+
+
+def test_single_function_referenced_by_earlier_statement_is_moved(tmp_path: Path):
+    # Arrange
+    source = (
+        "try:\n    from foo import bar\nexcept ImportError:\n    def bar():\n        return _fallback()\n\n\n"
+        "def _fallback():\n    pass\n"
+    )
+    target_path = tmp_path / "fallback.py"
+    target_path.write_text(source, encoding="utf-8")
+
+    # Act
+    status, output = step_down_sort(target_path)
+
+    # Assert
+    assert status == "sorted"
+    assert output is not None
+    assert output.index("def _fallback") < output.index("try:")
+
+
+def test_statement_nested_deeper_than_the_recursion_limit_is_sorted(tmp_path: Path):
+    # Arrange
+    depth = sys.getrecursionlimit() * 2
+    expression = " + ".join(["helper()", *(f"value_{index}" for index in range(depth))])
+    source = f"table = {expression}\n\n\ndef helper():\n    return main()\n\n\ndef main():\n    pass\n"
+    target_path = tmp_path / "generated.py"
+    target_path.write_text(source, encoding="utf-8")
+
+    # Act
+    status, output = step_down_sort(target_path)
+
+    # Assert
+    assert status == "sorted"
+    assert output is not None
+    assert output.index("def helper") < output.index("def main")
+
+
+def test_parallel_jobs_produce_the_same_results_as_serial_processing(tmp_path: Path):
+    # Arrange
+    test_cases = ["comments", "dataclass", "single_class", "top_level_functions", "skip_file_directive", "jpe"]
+    runner = CliRunner()
+    outputs: dict[str, str] = {}
+    for jobs in ["1", "3"]:
+        directory = tmp_path / f"jobs_{jobs}"
+        mkdir(directory)
+        for tc in test_cases:
+            shutil.copy(TEST_CASES_DIR / f"{tc}.in.py", directory / f"{tc}.py")
+            shutil.copy(TEST_CASES_DIR / f"{tc}.out.py", directory / f"{tc}_sorted.py")
+
+        # Act
+        result = runner.invoke(main, ["--no-cache", "--jobs", jobs, str(directory)])
+        outputs[jobs] = result.output.replace(str(directory), "<dir>").rsplit("Done!", 1)[0]
+
+        # Assert
+        assert result.exit_code == 0
+        for tc in test_cases:
+            assert read_file(directory / f"{tc}.py") == read_file(TEST_CASES_DIR / f"{tc}.out.py")
+    assert outputs["1"] == outputs["3"]
+
+
+def test_jobs_must_be_positive_or_auto(tmp_path: Path):
+    result = CliRunner().invoke(main, ["--jobs", "0", str(tmp_path)])
+
+    assert result.exit_code == 2
+    assert "must be a positive integer or 'auto'" in result.output
+
+
+def test_stdin_is_sorted_to_stdout():
+    # Act
+    result = CliRunner().invoke(main, ["-"], input=read_file(TEST_CASES_DIR / "comments.in.py"))
+
+    # Assert
+    assert result.exit_code == 0
+    assert result.output == read_file(TEST_CASES_DIR / "comments.out.py")
+
+
+@pytest.mark.parametrize("requires_python,expected_exit_code", [(">=3.11", 1), (">=3.14", 0)])
+def test_stdin_filename_is_used_to_find_project_configuration(
+    tmp_path: Path, requires_python: str, expected_exit_code: int
+):
+    # Arrange
+    (tmp_path / "pyproject.toml").write_text(f'[project]\nrequires-python = "{requires_python}"\n')
+    source = "def main(helper: Helper):\n    pass\n\n\nclass Helper:\n    pass\n"
+
+    # Act
+    result = CliRunner().invoke(
+        main, ["--check", "-", "--stdin-filename", str(tmp_path / "module.py")], input=source
+    )
+
+    # Assert
+    assert result.exit_code == expected_exit_code
+
+
+def test_profile_adds_up_phases_from_all_workers(tmp_path: Path):
+    # Arrange
+    test_cases = ["comments", "dataclass", "single_class", "top_level_functions"]
+    for tc in test_cases:
+        shutil.copy(TEST_CASES_DIR / f"{tc}.in.py", tmp_path)
+
+    # Act
+    result = CliRunner().invoke(main, ["--no-cache", "--profile", "--jobs", "2", str(tmp_path)])
+
+    # Assert
+    assert result.exit_code == 0
+    profile_rows = {
+        line.split()[0]: line.split()[1:] for line in result.output.split("Time per phase")[1].splitlines()[2:]
+    }
+    assert profile_rows["parse"][2] == str(len(test_cases))
+    assert profile_rows["write"][2] == str(len(test_cases))
+    assert "total" in profile_rows
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from sdsort.utils.spans import SpannedLines
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_spanned_lines_behave_like_the_lines_they_span(seed: int):
+    # Arrange
+    rng = random.Random(seed)
+    source = [f"line {index}" for index in range(rng.randrange(0, 30))]
+    expected: list[str] = []
+    spans = []
+    for _ in range(rng.randrange(0, 6)):
+        start = rng.randrange(0, len(source) + 1)
+        end = rng.randrange(start, len(source) + 1)
+        spans.append((source, start, end))
+        expected.extend(source[start:end])
+
+    # Act
+    lines = SpannedLines(spans)
+    start = rng.randrange(0, len(expected) + 1)
+    stop = rng.randrange(start, len(expected) + 1)
+
+    # Assert
+    assert list(lines) == expected
+    assert [lines[index] for index in range(-len(expected), len(expected))] == expected + expected
+    assert list(lines[start:stop]) == expected[start:stop]
+
+
+def test_replace_substitutes_ranges_of_the_same_length():
+    # Arrange
+    lines = SpannedLines.of(["a", "b", "c", "d", "e"])
+    replacement = SpannedLines.of(["x", "y"])
+
+    # Act
+    replaced = lines.replace([(0, SpannedLines.of(["w"])), (2, replacement)])
+
+    # Assert
+    assert list(replaced) == ["w", "b", "x", "y", "e"]